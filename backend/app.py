@@ -16,6 +16,12 @@ from common.log import setup_logger
 from common.response import RestResponse
 from common.tracing import Otel
 from config import SETTINGS
+from infra.db import init_indexes, chat_counter, connect_db, close_db
+from infra.http import HTTP
+from infra.job_queue import JobWorker
+from infra.redis_cache import ASYNC_REDIS
+from infra.storage import STORAGE
+from infra.task_events import TASK_EVENTS
 from middleware.auth_middleware import JWTAuthMiddleware
 from middleware.trace_middleware import TraceIdMiddleware
 from routes import api_router, voice_router, auth_router, twitter_tts_router
@@ -29,7 +35,21 @@ setup_logger()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logging.info("Starting lifespan")
+    connect_db()
+    await STORAGE.open()
+    await init_indexes()
+    job_worker = JobWorker() if SETTINGS.JOB_WORKER_EMBEDDED else None
+    if job_worker:
+        await job_worker.start()
     yield
+    if job_worker:
+        await job_worker.stop()
+    await chat_counter.close()
+    close_db()
+    await STORAGE.close()
+    await HTTP.close()
+    await TASK_EVENTS.close()
+    await ASYNC_REDIS.close()
     logging.info("Stopping lifespan")
 
 
@@ -1,10 +1,10 @@
 import logging
 
-import aiohttp
 from openai import AsyncOpenAI
 
 from config import SETTINGS
 from infra.file import download_and_upload_url, img_url_to_base64
+from infra.http import http_session
 
 
 async def gen_gpt_4o_img_svc(img_urls: list[str], prompt: str, scenario: str = "") -> str | None:
@@ -35,27 +35,27 @@ async def gen_gpt_4o_img_svc(img_urls: list[str], prompt: str, scenario: str = "
         }
 
         logging.info(f"Generating...")
-        async with aiohttp.ClientSession() as session:
-            async with session.post(f"{SETTINGS.PROXY_OPENAI_BASE_URL}/chat/completions", json=data, headers=headers,
-                                    timeout=1200) as response:
-                logging.info(f"Response: {response.status}")
-                if response.status != 200:
-                    logging.warning(f'gen_img: http status: {response.status} {scenario}')
-                    return None
-                result = await response.json()
-                if "error" in result:
-                    return None
-                if "choices" in result and isinstance(result["choices"], list):
-                    for choice in result["choices"]:
-                        if "message" in choice and "content" in choice["message"]:
-                            content = choice["message"]["content"]
-                            import re
-                            matches = re.findall(r"!\[.*?\]\((https?://[^\s]+)\)", content)
-                            for image_url in matches:
-                                if image_url:
-                                    ret_img = await download_and_upload_url(image_url)
-                                    if ret_img:
-                                        return ret_img
+        session = http_session()
+        async with session.post(f"{SETTINGS.PROXY_OPENAI_BASE_URL}/chat/completions", json=data, headers=headers,
+                                timeout=1200) as response:
+            logging.info(f"Response: {response.status}")
+            if response.status != 200:
+                logging.warning(f'gen_img: http status: {response.status} {scenario}')
+                return None
+            result = await response.json()
+            if "error" in result:
+                return None
+            if "choices" in result and isinstance(result["choices"], list):
+                for choice in result["choices"]:
+                    if "message" in choice and "content" in choice["message"]:
+                        content = choice["message"]["content"]
+                        import re
+                        matches = re.findall(r"!\[.*?\]\((https?://[^\s]+)\)", content)
+                        for image_url in matches:
+                            if image_url:
+                                ret_img = await download_and_upload_url(image_url)
+                                if ret_img:
+                                    return ret_img
     except Exception as e:
         logging.error(f"gen_img error: {e} {scenario}", exc_info=True)
     return None
@@ -2,11 +2,10 @@ import json
 import logging
 import re
 
-import aiohttp
-
 from config import SETTINGS
 from entities.dto import GenVideoResp
 from infra.file import img_url_to_base64
+from infra.http import http_session
 
 task_id_pattern = re.compile(r"Task ID: `([^`]+)`")
 watch_pattern = re.compile(r"\[▶️ Watch Online\]\(([^)]+)\)")
@@ -43,43 +42,43 @@ async def veo3_gen_video_svc(img_url: str, prompt: str) -> GenVideoResp | None:
 
         data = {}
         success = False
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as resp:
-                if resp.status == 200:
-                    async for chunk in resp.content:
-                        if chunk:
-                            text = chunk.decode("utf-8", errors="ignore").strip()
-                            logging.info(f"veo3_gen_video_chunk {text}")
-
-                            for line in text.splitlines():
-                                line = line.strip()
-                                if not line.startswith("data: "):
-                                    continue
-                                if line == "data: [DONE]":
-                                    continue
+        session = http_session("stream")
+        async with session.post(url, json=payload, headers=headers) as resp:
+            if resp.status == 200:
+                async for chunk in resp.content:
+                    if chunk:
+                        text = chunk.decode("utf-8", errors="ignore").strip()
+                        logging.info(f"veo3_gen_video_chunk {text}")
 
-                            json_str = line[len("data: "):].strip()
-                            try:
-                                obj = json.loads(json_str)
-                            except json.JSONDecodeError:
-                                logging.warning(f"Not valid JSON: {json_str}")
+                        for line in text.splitlines():
+                            line = line.strip()
+                            if not line.startswith("data: "):
                                 continue
+                            if line == "data: [DONE]":
+                                continue
+
+                        json_str = line[len("data: "):].strip()
+                        try:
+                            obj = json.loads(json_str)
+                        except json.JSONDecodeError:
+                            logging.warning(f"Not valid JSON: {json_str}")
+                            continue
 
-                            content = obj["choices"][0]["delta"].get("content", "")
+                        content = obj["choices"][0]["delta"].get("content", "")
 
-                            m = task_id_pattern.search(content)
-                            if m:
-                                data["task_id"] = m.group(1)
+                        m = task_id_pattern.search(content)
+                        if m:
+                            data["task_id"] = m.group(1)
 
-                            wm = watch_pattern.search(content)
-                            dm = download_pattern.search(content)
-                            if wm:
-                                data["watch_url"] = wm.group(1)
-                            if dm:
-                                data["download_url"] = dm.group(1)
-                                success = True
-                else:
-                    logging.error(f"Request failed with status {resp.status}")
+                        wm = watch_pattern.search(content)
+                        dm = download_pattern.search(content)
+                        if wm:
+                            data["watch_url"] = wm.group(1)
+                        if dm:
+                            data["download_url"] = dm.group(1)
+                            success = True
+            else:
+                logging.error(f"Request failed with status {resp.status}")
         if success:
             logging.info(f"veo3_gen_video_svc success {data}")
             return GenVideoResp(
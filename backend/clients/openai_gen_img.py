@@ -1,18 +1,17 @@
+import asyncio
 import io
 import logging
 
-import aiohttp
 import openai
 from openai.types import ImagesResponse
 
 from config import SETTINGS
+from infra.image_cache import IMAGES
 
 
 async def gemini_gen_img_svc(img_url: str, prompt: str, scenario: str = "") -> ImagesResponse | None:
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(img_url) as resp:
-                img_bytes = await resp.read()
+        img_bytes = await IMAGES.get_bytes(img_url)
 
         image_file = io.BytesIO(img_bytes)
         image_file.name = "template.png"
@@ -39,10 +38,8 @@ async def gemini_gen_img_svc(img_url: str, prompt: str, scenario: str = "") -> I
 async def gpt_image_1_gen_imgs_svc(img_urls: list[str], prompt: str, scenario: str = "") -> ImagesResponse | None:
     try:
         image_files = []
-        for img_url in img_urls:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(img_url) as resp:
-                    img_bytes = await resp.read()
+        imgs = await asyncio.gather(*(IMAGES.get_bytes(img_url) for img_url in img_urls))
+        for img_url, img_bytes in zip(img_urls, imgs):
             image_file = io.BytesIO(img_bytes)
             image_file.name = "template.png"
             logging.info(f"M gpt_image_1_gen_imgs_svc: {img_url} {scenario}")
@@ -3,11 +3,11 @@ import logging
 from abc import ABC, abstractmethod
 from typing import Optional
 
-import aiohttp
 import fal_client
 import openai
 
 from config import SETTINGS
+from infra.http import http_session
 
 
 class BaseTTSClient(ABC):
@@ -197,15 +197,15 @@ class VoiceCloneTTSClient(BaseTTSClient):
             )
 
             result = await handler.get()
-            async with aiohttp.ClientSession() as session:
-                if 'audio' in result and 'url' in result['audio']:
-                    # Download the audio file
-                    audio_url = result['audio']['url']
-                    async with session.get(audio_url) as audio_response:
-                        if audio_response.status == 200:
-                            audio_data = await audio_response.read()
-                            logging.info(f"Voice clone TTS conversion successful, audio size: {len(audio_data)} bytes")
-                            return audio_data
+            session = http_session("stream")
+            if 'audio' in result and 'url' in result['audio']:
+                # Download the audio file
+                audio_url = result['audio']['url']
+                async with session.get(audio_url) as audio_response:
+                    if audio_response.status == 200:
+                        audio_data = await audio_response.read()
+                        logging.info(f"Voice clone TTS conversion successful, audio size: {len(audio_data)} bytes")
+                        return audio_data
 
         except Exception as e:
             logging.error(f"Voice clone TTS conversion error: {e}", exc_info=True)
@@ -1,9 +1,9 @@
 import json
 import logging
 
-import aiohttp
-
 from config import SETTINGS
+from infra.cache import cached
+from infra.http import http_session
 
 host = SETTINGS.XAPI_IO_HOST
 headers = {
@@ -16,32 +16,31 @@ async def x_get_user_info_by_username(username: str):
     logging.info(f"Fetching {url}")
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                response.raise_for_status()
-                if response.status == 200:
-                    res = await response.json()
-                    if "status" in res and "success" == res["status"]:
-                        logging.info(f"fetched {json.dumps(res["data"], ensure_ascii=False)}")
-                        return res["data"]
+        async with http_session().get(url, headers=headers) as response:
+            response.raise_for_status()
+            if response.status == 200:
+                res = await response.json()
+                if "status" in res and "success" == res["status"]:
+                    logging.info(f"fetched {json.dumps(res["data"], ensure_ascii=False)}")
+                    return res["data"]
     except Exception as ex:
         logging.error("Failed to fetch user info", exc_info=True)
     return None
 
 
-async def x_get_user_last_tweets_by_username(username: str):
+@cached(ttl=SETTINGS.X_TWEETS_CACHE_TTL_SECONDS)
+async def x_get_user_last_tweets_by_username(username: str) -> list[dict] | None:
     url = f"{host}/twitter/user/last_tweets?userName={username}"
     logging.info(f"Fetching {url}")
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                response.raise_for_status()
-                if response.status == 200:
-                    res = await response.json()
-                    if "status" in res and "success" == res["status"]:
-                        logging.info(f"fetched {json.dumps(res["data"]["tweets"], ensure_ascii=False)}")
-                        return res["data"]["tweets"]
+        async with http_session().get(url, headers=headers) as response:
+            response.raise_for_status()
+            if response.status == 200:
+                res = await response.json()
+                if "status" in res and "success" == res["status"]:
+                    logging.info(f"fetched {json.dumps(res["data"]["tweets"], ensure_ascii=False)}")
+                    return res["data"]["tweets"]
     except Exception as ex:
         logging.error("Failed x_get_user_last_tweets_by_username", exc_info=True)
     return None
@@ -52,14 +51,13 @@ async def x_get_tweets_by_id(id: str):
     logging.info(f"Fetching {url}")
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                response.raise_for_status()
-                if response.status == 200:
-                    res = await response.json()
-                    if "status" in res and "success" == res["status"]:
-                        logging.info(f"fetched {json.dumps(res["tweets"][0], ensure_ascii=False)}")
-                        return res["tweets"][0]
+        async with http_session().get(url, headers=headers) as response:
+            response.raise_for_status()
+            if response.status == 200:
+                res = await response.json()
+                if "status" in res and "success" == res["status"]:
+                    logging.info(f"fetched {json.dumps(res["tweets"][0], ensure_ascii=False)}")
+                    return res["tweets"][0]
     except Exception as ex:
         logging.error("Failed x_get_user_last_tweets_by_username", exc_info=True)
     return None
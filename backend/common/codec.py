@@ -0,0 +1,148 @@
+import json
+from typing import Any, Protocol
+
+from common.error import raise_error
+from common.json_encoder import UniversalEncoder, universal_decoder, encode_default
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+try:
+    import msgpack
+    HAS_MSGPACK = True
+except ImportError:
+    HAS_MSGPACK = False
+
+
+class Codec(Protocol):
+    name: str
+
+    def dumps(self, obj: Any) -> bytes: ...
+
+    def loads(self, data: bytes | str) -> Any: ...
+
+
+def _fallback(obj):
+    handled, value = encode_default(obj)
+    return value if handled else str(obj)
+
+
+def _revive(obj):
+    """Apply universal_decoder bottom-up in place, for parsers without an object_hook"""
+    if type(obj) is dict:
+        for k, v in obj.items():
+            if type(v) is dict or type(v) is list:
+                obj[k] = _revive(v)
+        return universal_decoder(obj)
+    if type(obj) is list:
+        for i, v in enumerate(obj):
+            if type(v) is dict or type(v) is list:
+                obj[i] = _revive(v)
+    return obj
+
+
+class JsonCodec:
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, cls=UniversalEncoder).encode()
+
+    def loads(self, data: bytes | str) -> Any:
+        return json.loads(data, object_hook=universal_decoder)
+
+
+class OrjsonCodec:
+    """
+    Same wire format as JsonCodec for dates and models, written by orjson.
+    UUIDs are serialized natively by orjson, so they come back as plain strings.
+    """
+    name = "orjson"
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_fallback, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+    def loads(self, data: bytes | str) -> Any:
+        obj = orjson.loads(data)
+        # type tags all start with "__", documents without any skip the Python-level walk
+        marker = b'"__' if isinstance(data, bytes) else '"__'
+        return _revive(obj) if marker in data else obj
+
+
+class MsgpackCodec:
+    """Binary format, tagged values use the same type ids as the JSON codecs"""
+    name = "msgpack"
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, default=_fallback, use_bin_type=True)
+
+    def loads(self, data: bytes | str) -> Any:
+        return msgpack.unpackb(data, object_hook=universal_decoder, raw=False, strict_map_key=False)
+
+
+CODECS: dict[str, type] = {"json": JsonCodec}
+if HAS_ORJSON:
+    CODECS["orjson"] = OrjsonCodec
+if HAS_MSGPACK:
+    CODECS["msgpack"] = MsgpackCodec
+
+
+def get_codec(name: str) -> Codec:
+    """
+    The codec called `name`. Fails when its library is not installed rather than falling back:
+    processes sharing a Redis must agree on the format of the values they read and write.
+    """
+    if name not in CODECS:
+        raise_error(f"Redis codec {name} is not available, install its library or use json")
+    return CODECS[name]()
+
+
+# Benchmark ==================================================
+
+if __name__ == '__main__':
+    import datetime
+    import timeit
+    import uuid
+
+    from entities.dto import AIGCTask, Cover, GenCoverImgReq, GenCoverResp, Lyrics, GenerateLyricsReq, \
+        GenerateLyricsResp, Music, GenMusicReq, GenerateMusicResp, Video, GenVideoReq, GenVideoResp, VideoKeyType, \
+        Audio, GenXAudioReq, Fee, TaskStatus
+
+    now = datetime.datetime.now()
+    task_id = str(uuid.uuid4())
+    url = "https://cdn.example.com/" + "a" * 80
+    sub = dict(sub_task_id=str(uuid.uuid4()), status=TaskStatus.DONE, created_at=now, done_at=now, history_count=3,
+               fee=[Fee.total_fee([Fee.img_fee(), Fee.llm_fee()])])
+    task = AIGCTask(
+        task_id=task_id,
+        tenant_id=str(uuid.uuid4()),
+        twitter_link="https://x.com/someone",
+        slogan="slogan " * 10,
+        created_at=now,
+        updated_at=now,
+        cover=Cover(input=GenCoverImgReq(task_id=task_id, x_link="https://x.com/someone"),
+                    output=GenCoverResp(first_frame_img_url=url, cover_img_url=url, dance_first_frame_img_url=url,
+                                        sing_first_frame_img_url=url, figure_first_frame_img_url=url), **sub),
+        lyrics=Lyrics(input=GenerateLyricsReq(task_id=task_id),
+                      output=GenerateLyricsResp(lyrics="la la la\n" * 200, title="title"), **sub),
+        music=Music(input=GenMusicReq(task_id=task_id, lyrics="la la la\n" * 200, style="pop",
+                                      reference_audio_url=url),
+                    output=GenerateMusicResp(audio_url=url, lyrics="la la la\n" * 200, style="pop", voice="alloy",
+                                              model="tts-1", response_format="mp3", speed=1.0), **sub),
+        audio=Audio(input=GenXAudioReq(task_id=task_id, x_tts_urls=[url] * 5), **sub),
+        videos=[Video(input=GenVideoReq(task_id=task_id, key=key),
+                      output=GenVideoResp(out_id=str(uuid.uuid4()), view_url=url, download_url=url), **sub)
+                for key in VideoKeyType],
+    )
+    payload = [task] * 10  # one cached page of tasks
+
+    number = 200
+    print(f"{'codec':<10}{'bytes':>10}{'dumps ms':>12}{'loads ms':>12}")
+    for name in CODECS:
+        codec = get_codec(name)
+        data = codec.dumps(payload)
+        dumps_ms = timeit.timeit(lambda: codec.dumps(payload), number=number) / number * 1000
+        loads_ms = timeit.timeit(lambda: codec.loads(data), number=number) / number * 1000
+        print(f"{name:<10}{len(data):>10}{dumps_ms:>12.3f}{loads_ms:>12.3f}")
@@ -27,6 +27,12 @@ _TYPE_REGISTRY = {
 }
 
 
+# type -> registry entry (or None), filled lazily from the MRO so lookups are O(1) after the first hit
+_DISPATCH: dict[type, dict | None] = {}
+# type_id -> deserialize
+_DECODERS: dict[str, callable] = {info['type_id']: info['deserialize'] for info in _TYPE_REGISTRY.values()}
+
+
 def register_type(
         cls: type,
         serialize_fn: callable,
@@ -39,28 +45,51 @@ def register_type(
         'deserialize': deserialize_fn,
         'type_id': type_id
     }
+    _DECODERS[type_id] = deserialize_fn
+    _DISPATCH.clear()
+
+
+def _lookup(tp: type) -> dict | None:
+    try:
+        return _DISPATCH[tp]
+    except KeyError:
+        info = next((_TYPE_REGISTRY[c] for c in tp.__mro__ if c in _TYPE_REGISTRY), None)
+        _DISPATCH[tp] = info
+        return info
+
+
+def encode_default(obj):
+    """
+    Tagged form of an object the serializer can't handle natively, shared by every codec.
+
+    Returns (handled, value); unhandled objects are left to the caller's own fallback.
+    """
+    info = _lookup(type(obj))
+    if info is not None:
+        return True, {info['type_id']: info['serialize'](obj)}
+
+    # Support for Pydantic BaseModel
+    if HAS_PYDANTIC and isinstance(obj, BaseModel):
+        # Use model_dump() for Pydantic v2 or dict() for v1
+        if hasattr(obj, 'model_dump'):
+            return True, obj.model_dump()
+        else:
+            return True, obj.dict()
+
+    # Handle custom classes (via __dict__)
+    if hasattr(obj, '__dict__'):
+        return True, vars(obj)
+
+    return False, None
 
 
 class UniversalEncoder(json.JSONEncoder):
     """JSON encoder that supports multiple data types"""
 
     def default(self, obj):
-        # Check registered types
-        for cls, info in _TYPE_REGISTRY.items():
-            if isinstance(obj, cls):
-                return {info['type_id']: info['serialize'](obj)}
-
-        # Support for Pydantic BaseModel
-        if HAS_PYDANTIC and isinstance(obj, BaseModel):
-            # Use model_dump() for Pydantic v2 or dict() for v1
-            if hasattr(obj, 'model_dump'):
-                return obj.model_dump()
-            else:
-                return obj.dict()
-
-        # Handle custom classes (via __dict__)
-        if hasattr(obj, '__dict__'):
-            return vars(obj)
+        handled, value = encode_default(obj)
+        if handled:
+            return value
 
         # Handle other iterable objects
         try:
@@ -71,9 +100,12 @@ class UniversalEncoder(json.JSONEncoder):
 
 def universal_decoder(obj_dict):
     """Universal decoder"""
-    for info in _TYPE_REGISTRY.values():
-        if info['type_id'] in obj_dict:
-            return info['deserialize'](obj_dict[info['type_id']])
+    # tagged values are single-key dicts
+    if len(obj_dict) == 1:
+        type_id = next(iter(obj_dict))
+        deserialize = _DECODERS.get(type_id)
+        if deserialize:
+            return deserialize(obj_dict[type_id])
 
     # Handle custom class reconstruction (requires class definition in scope)
     if '__class__' in obj_dict:
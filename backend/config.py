@@ -33,6 +33,11 @@ class Settings(BaseSettings):
     REDIS_SSL: bool = False
     REDIS_DB: int = 0
     REDIS_PREFIX: str = "default"
+    REDIS_MAX_CONNECTIONS: int = 50  # shared async pool
+    REDIS_SOCKET_TIMEOUT: float = 2.0
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 2.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  # PING connections idle for longer before reuse
+    REDIS_CODEC: str = "json"  # json / orjson / msgpack for list and hash values, orjson and msgpack must be installed
     IMAGE_TO_VIDEO_V2: str = ""
     IMAGE_TO_VIDEO_V3: str = ""
     IMAGE_TO_IMAGE_V3: str = ""
@@ -57,5 +62,82 @@ class Settings(BaseSettings):
     X_APP_REDIRECT_URI: str = ""
     APP_HOME_URI: str = ""
 
+    # Mongo client configuration
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: int = 2000  # fail fast instead of queueing behind a saturated pool
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 5000
+    MONGO_READ_PREFERENCE: str = "primary"
+    MONGO_LIST_READ_PREFERENCE: str = "primary"  # e.g. secondaryPreferred to move listings off the primary
+    MONGO_LIST_MAX_TIME_MS: int = 3000
+    LIST_TOTAL_CACHE_TTL_SECONDS: int = 60  # totals from infra.db.count_cached (find_with_total's cached_total)
+
+    # Job queue configuration
+    JOB_WORKER_EMBEDDED: bool = True  # also drain jobs inside the API process
+    JOB_WORKER_CONCURRENCY: int = 8
+    JOB_POLL_INTERVAL_SECONDS: float = 1.0
+    JOB_LEASE_SECONDS: int = 120
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BACKOFF_SECONDS: int = 10
+    JOB_RETRY_BACKOFF_MAX_SECONDS: int = 600
+    JOB_RETENTION_SECONDS: int = 7 * 24 * 3600  # done and failed jobs are deleted this long after finishing
+
+    # Read-through cache configuration
+    CACHE_LOCAL_MAXSIZE: int = 2048  # entries per namespace held in process
+    CACHE_LOCAL_TTL_SECONDS: float = 5  # upper bound on staleness across processes
+    CACHE_REDIS_TTL_SECONDS: int = 300
+    CACHE_NEGATIVE_TTL_SECONDS: int = 30  # how long @cached keeps a None result
+    X_USER_CACHE_TTL_SECONDS: int = 3600
+    X_TWEETS_CACHE_TTL_SECONDS: int = 300
+
+    # Object storage of infra/storage.py: s3 | local | memory (tests); presigned uploads need s3
+    STORAGE_BACKEND: str = "s3"
+    STORAGE_LOCAL_ROOT: str = "./storage"
+    STORAGE_LOCAL_BASE_URL: str = "http://localhost:8080/files"
+
+    # S3, one client per process; S3_ENDPOINT_URL is only set for S3-compatible stores
+    S3_REGION: str = "ap-southeast-2"
+    S3_BUCKET: str = "web3ai"
+    S3_ENDPOINT_URL: str = ""
+    S3_MAX_POOL_CONNECTIONS: int = 50
+    S3_CONNECT_TIMEOUT_SECONDS: int = 5
+    S3_READ_TIMEOUT_SECONDS: int = 60
+    # streamed uploads hold about (S3_PART_CONCURRENCY + 1) parts in memory
+    S3_PART_SIZE_BYTES: int = 8 * 1024 * 1024
+    S3_PART_CONCURRENCY: int = 2
+    UPLOAD_MAX_BYTES: int = 128 * 1024 * 1024
+    S3_PRESIGN_EXPIRES_SECONDS: int = 900
+    PENDING_UPLOAD_TTL_SECONDS: int = 24 * 3600  # presigned keys not completed within this can't be completed
+
+    # Outbound HTTP, one pooled aiohttp session per profile in infra/http.py
+    HTTP_LIMIT: int = 200
+    HTTP_LIMIT_PER_HOST: int = 50
+    HTTP_KEEPALIVE_SECONDS: int = 30
+    HTTP_DNS_CACHE_SECONDS: int = 300
+    HTTP_TIMEOUT_SECONDS: int = 300
+    HTTP_CONNECT_TIMEOUT_SECONDS: int = 10
+    HTTP_STREAM_READ_TIMEOUT_SECONDS: int = 300
+
+    # Remote images fed to generation models, held by infra/image_cache.py
+    IMAGE_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    IMAGE_CACHE_MAX_ENTRY_BYTES: int = 16 * 1024 * 1024
+    IMAGE_CACHE_TTL_SECONDS: int = 300  # revalidated with ETag/Last-Modified after this
+
+    # Server-sent task events
+    SSE_KEEPALIVE_SECONDS: int = 15
+    SSE_MAX_SECONDS: int = 600  # clients reconnect after this
+
+    # Cross-worker lock per generated sub task, renewed by its job's heartbeat; bounds how long a crashed job
+    # blocks a retry by the user, and must outlast the retry backoff (JOB_RETRY_BACKOFF_MAX_SECONDS)
+    GEN_LOCK_TTL_SECONDS: int = 900
+    LOCK_FENCE_TTL_SECONDS: int = 7 * 24 * 3600  # fence counters of idle locks expire after this
+
+    # Rate limiter, definitions live in the resource_limits collection
+    RATE_LIMIT_DEFINITION_TTL_SECONDS: int = 60
+
+    # digital_human.chat_count increments are coalesced and flushed in one bulk_write
+    CHAT_COUNT_FLUSH_INTERVAL_MS: int = 1000
+    CHAT_COUNT_FLUSH_MAX_EVENTS: int = 1000
+
 
 SETTINGS = Settings()
@@ -1,13 +1,37 @@
 import datetime
 import uuid
 from enum import StrEnum
-from typing import Any, Optional, List
+from typing import Any, Optional, Generic, TypeVar
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 from common.error import raise_error
 from entities.bo import Language, TwitterTTSResp
 
+T = TypeVar('T')
+
+
+class TrackedModel(BaseModel):
+    """
+    Records the fields assigned since the last mark_clean(), so saves can $set only what changed.
+    In-place mutations (list.append, ...) are not seen and must be flagged with mark_dirty().
+    """
+    _dirty: set[str] = PrivateAttr(default_factory=set)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in type(self).model_fields:
+            self._dirty.add(name)
+
+    def mark_dirty(self, *names: str) -> None:
+        self._dirty.update(names)
+
+    def dirty_fields(self) -> set[str]:
+        return set(self._dirty)
+
+    def mark_clean(self) -> None:
+        self._dirty.clear()
+
 
 class Fee(BaseModel):
     name: str
@@ -107,25 +131,38 @@ class AIGCTaskID(BaseModel):
     task_id: str = Field(description="task_id", default="")
 
 
-class SubTask(BaseModel):
+class SubTask(TrackedModel):
     sub_task_id: str = Field(description="sub_task_id")
     status: TaskStatus = Field(description="status", default=TaskStatus.IN_PROGRESS)
     created_at: datetime.datetime = Field(description="created_at")
     done_at: datetime.datetime | None = Field(description="done_at", default=None)
-    history: list[dict[str, Any]] = Field(description="history", default_factory=list)
+    history_count: int = Field(description="number of archived versions, see aigc_task_history", default=0)
     fee: list[Fee] = Field(description="fee", default_factory=list)
 
+    # versions archived by regenerate() and not yet written to aigc_task_history
+    _archive: list[dict[str, Any]] = PrivateAttr(default_factory=list)
+
     def regenerate(self) -> None:
         if self.status == TaskStatus.DONE:
-            current_dict = self.model_dump()
-            current_dict.pop("history", None)
-            self.history.insert(0, current_dict)
+            self._archive.insert(0, self.model_dump())
+            self.history_count += 1
 
         self.status = TaskStatus.IN_PROGRESS
         self.created_at = datetime.datetime.now()
         self.done_at = None
         self.sub_task_id = str(uuid.uuid4())
 
+    def pop_archive(self) -> list[dict[str, Any]]:
+        ret, self._archive = self._archive, []
+        return ret
+
+    def add_fee(self, fee: Fee) -> None:
+        self.fee.append(fee)
+        self.mark_dirty("fee")
+
+    def status_summary(self) -> dict[str, Any]:
+        return self.model_dump(mode="json", include={"sub_task_id", "status", "done_at"})
+
 
 class GenCoverImgReq(AIGCTaskID):
     x_link: str = Field(description="x link")
@@ -165,6 +202,42 @@ class PageReq(BaseModel):
     pagesize: int = Field(default=10, ge=1, le=1000)
 
 
+class CursorPage(BaseModel, Generic[T]):
+    """
+    cursor page
+    """
+    items: list[T] = Field(description="items", default_factory=list)
+    next_cursor: str | None = Field(description="cursor of the next page, None on the last page", default=None)
+
+
+class PresignUploadReq(BaseModel):
+    """
+    """
+    filename: str = Field(description="original file name, its extension is kept in the key", default="")
+    content_type: str = Field(description="content type the file will be uploaded with")
+    size: int = Field(description="size in bytes", gt=0)
+    sha256: str = Field(description="hex sha256 of the content", pattern=r"^[0-9a-f]{64}$")
+
+
+class PresignUploadResp(BaseModel):
+    """
+    Either `file_url` of identical content uploaded before, or where to PUT the file with `headers`
+    """
+    key: str = Field(description="object key, passed to upload_file/complete")
+    file_url: str | None = Field(description="url of the existing file, nothing to upload", default=None)
+    upload_url: str | None = Field(description="presigned PUT url", default=None)
+    headers: dict[str, str] = Field(description="headers the PUT must send", default_factory=dict)
+    expires_in: int = Field(description="seconds upload_url is valid", default=0)
+
+
+class CompleteUploadReq(BaseModel):
+    """
+    """
+    key: str = Field(description="key from upload_file/presign")
+    sha256: str = Field(description="hex sha256 of the content", pattern=r"^[0-9a-f]{64}$")
+    filename: str = Field(description="original file name", default="")
+
+
 class DigitalHumanPageReq(BaseModel):
     """
     """
@@ -323,7 +396,7 @@ class Video(SubTask):
     output: GenVideoResp | None = Field(description="video url", default=None)
 
 
-class AIGCTask(AIGCTaskID, TaskAndHuman):
+class AIGCTask(AIGCTaskID, TaskAndHuman, TrackedModel):
     tenant_id: str = Field(description="tenant_id")
     cover: Cover | None = Field(description="cover", default=None)
     lyrics: Lyrics | None = Field(description="lyrics", default=None)
@@ -333,6 +406,52 @@ class AIGCTask(AIGCTaskID, TaskAndHuman):
     created_at: datetime.datetime = Field(description="created_at", default=None)
     updated_at: datetime.datetime | None = Field(description="Last update time", default=None)
 
+    # keys of the videos stored in the db, None until the task is loaded and marked clean
+    _video_keys: set[str] | None = PrivateAttr(default=None)
+
+    def sub_tasks(self) -> dict[str, SubTask]:
+        ret = {}
+        for name in ("cover", "lyrics", "music", "audio"):
+            sub_task = getattr(self, name)
+            if sub_task is not None:
+                ret[name] = sub_task
+        return ret
+
+    def is_tracked(self) -> bool:
+        return self._video_keys is not None
+
+    def stored_video_keys(self) -> set[str]:
+        return self._video_keys or set()
+
+    def mark_clean(self) -> None:
+        super().mark_clean()
+        for sub_task in self.sub_tasks().values():
+            sub_task.mark_clean()
+        for video in self.videos:
+            video.mark_clean()
+        self._video_keys = {video.input.key for video in self.videos}
+
+    def status_delta(self, changed_only: bool = True) -> dict[str, Any]:
+        """
+        Status of the sub tasks and videos, by default only those changed since mark_clean().
+        """
+        changed_only = changed_only and self.is_tracked()
+        dirty = self.dirty_fields()
+        delta = {}
+        for name, sub_task in self.sub_tasks().items():
+            if not changed_only or name in dirty or sub_task.dirty_fields():
+                delta[name] = sub_task.status_summary()
+
+        stored = self.stored_video_keys()
+        videos = {
+            video.input.key: video.status_summary()
+            for video in self.videos
+            if not changed_only or "videos" in dirty or video.dirty_fields() or video.input.key not in stored
+        }
+        if videos:
+            delta["videos"] = videos
+        return delta
+
     def check_all_ready(self):
         if not self.cover or not self.cover.output or not self.cover.status == TaskStatus.DONE:
             raise_error("cover not ready")
@@ -345,7 +464,7 @@ class AIGCTask(AIGCTaskID, TaskAndHuman):
 
         if not self.audio:
             raise_error("audio not ready")
-        elif self.audio.status == TaskStatus.FAILED and not self.audio.history:
+        elif self.audio.status == TaskStatus.FAILED and not self.audio.history_count:
             raise_error("audio not ready")
 
         if not self.videos or len(self.videos) == 0:
@@ -518,7 +637,6 @@ class Profile(BaseModel):
     verified_x_avatar_url: str = Field(description="verified_x_avatar_url", default="")
     adopted: bool = Field(description="Adopted", default=False)
     total_points: int = Field(description="Total points", default=0)
-    points_details: List[PointsDetails] = Field(description="Points details", default_factory=list)
     follow_digital_human_ids: list[str] = Field(description="Follow digital humans", default_factory=list)
     invitation_code: str = Field(description="Invitation code", default="")
     from_invitation_code: str = Field(description="From invitation code", default="")
@@ -0,0 +1,231 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+import typing
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from pydantic import TypeAdapter
+
+from config import SETTINGS
+from infra.redis_cache import ASYNC_REDIS
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LRUTTLCache:
+    """In-process LRU where every entry also expires `ttl` seconds after it was written"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+TTL = int | Callable[[Any], int]
+
+# every TwoTierCache by namespace, for metrics
+CACHES: dict[str, "TwoTierCache"] = {}
+
+
+class TwoTierCache:
+    """
+    Read-through cache: a short-lived in-process LRU in front of Redis.
+
+    Values are validated objects locally and JSON in Redis, both tiers cache None as well.
+    Other processes only see delete()/clear() once their local entries expire, so the local ttl
+    bounds how stale a read can be. Cached objects are shared between callers and must not be mutated.
+    Concurrent misses of one key in a process share a single load. Redis errors are logged and treated as misses.
+    """
+
+    def __init__(self, namespace: str, adapter: TypeAdapter,
+                 local_maxsize: int = SETTINGS.CACHE_LOCAL_MAXSIZE,
+                 local_ttl: float = SETTINGS.CACHE_LOCAL_TTL_SECONDS,
+                 redis_ttl: TTL = SETTINGS.CACHE_REDIS_TTL_SECONDS,
+                 negative_ttl: int | None = None):
+        """
+        :param redis_ttl: Seconds in Redis, or a function of the value returning them.
+        :param negative_ttl: Seconds both tiers keep a None, defaults to the regular ttls.
+        """
+        self.namespace = namespace
+        self.adapter = adapter
+        self.redis_ttl = redis_ttl
+        self.negative_ttl = negative_ttl
+        self._local = LRUTTLCache(local_maxsize, local_ttl)
+        self._gen_key = f"{SETTINGS.REDIS_PREFIX}.cache.{namespace}.gen"
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.hits_local = 0
+        self.hits_redis = 0
+        self.misses = 0
+        self.coalesced = 0
+        CACHES[namespace] = self
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits_local": self.hits_local,
+            "hits_redis": self.hits_redis,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "local_size": len(self._local),
+        }
+
+    async def _generation(self) -> str:
+        gen = self._local.get(self._gen_key)
+        if gen is None:
+            gen = await ASYNC_REDIS.get_value(self._gen_key) or "0"
+            self._local.set(self._gen_key, gen)
+        return gen
+
+    async def _redis_key(self, key: str) -> str:
+        return f"{SETTINGS.REDIS_PREFIX}.cache.{self.namespace}.{await self._generation()}.{key}"
+
+    def _ttls(self, value: Any) -> tuple[float | None, int]:
+        if value is None and self.negative_ttl is not None:
+            return min(self.negative_ttl, self._local.ttl), self.negative_ttl
+        redis_ttl = self.redis_ttl(value) if callable(self.redis_ttl) else self.redis_ttl
+        return None, redis_ttl
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = self._local.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits_local += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # the loading request was cancelled, not this one: load again
+                if inflight.cancelled() and not asyncio.current_task().cancelling():
+                    return await self.get_or_load(key, loader)
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._load(key, loader)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # nobody may be waiting, don't log "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        redis_key = await self._redis_key(key)
+        raw = await ASYNC_REDIS.get_value(redis_key)
+        if raw is not None:
+            try:
+                value = self.adapter.validate_json(raw)
+                self.hits_redis += 1
+                self._local.set(key, value, self._ttls(value)[0])
+                return value
+            except ValueError as e:
+                logger.warning(f"Dropping undecodable cache entry {redis_key}: {e}")
+
+        self.misses += 1
+        value = await loader()
+        local_ttl, redis_ttl = self._ttls(value)
+        self._local.set(key, value, local_ttl)
+        if redis_ttl > 0:
+            await ASYNC_REDIS.set_value(redis_key, self.adapter.dump_json(value).decode(), redis_ttl)
+        return value
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._local.delete(key)
+        redis_keys = [await self._redis_key(key) for key in keys]
+        await ASYNC_REDIS.delete_keys(redis_keys)
+
+    async def clear(self) -> None:
+        """Drop every entry of the namespace by moving it to a new generation; old keys expire on their own"""
+        self._local.clear()
+        await ASYNC_REDIS.incr(self._gen_key)
+
+
+def cached(namespace: str | None = None,
+           ttl: TTL = SETTINGS.CACHE_REDIS_TTL_SECONDS,
+           local_ttl: float = SETTINGS.CACHE_LOCAL_TTL_SECONDS,
+           negative_ttl: int | None = SETTINGS.CACHE_NEGATIVE_TTL_SECONDS,
+           local_maxsize: int = SETTINGS.CACHE_LOCAL_MAXSIZE,
+           key: Callable[..., str] | None = None):
+    """
+    Cache a coroutine's result in a TwoTierCache, values are (de)serialized with its return annotation.
+
+    The key is built from the call arguments (after defaults), or by `key` called with the same arguments.
+    The wrapper gains `invalidate(*args, **kwargs)`, `invalidate_all()`, `cache` and `uncached`.
+
+    :param ttl: Seconds in Redis, or a function of the result returning them (0 keeps it local only).
+    :param negative_ttl: Seconds a None result is kept, None to treat it like any other result.
+    """
+
+    def decorator(fn):
+        adapter = TypeAdapter(typing.get_type_hints(fn).get("return", Any))
+        cache = TwoTierCache(namespace or f"{fn.__module__}.{fn.__qualname__}", adapter,
+                             local_maxsize=local_maxsize, local_ttl=local_ttl, redis_ttl=ttl,
+                             negative_ttl=negative_ttl)
+        signature = inspect.signature(fn)
+
+        def make_key(*args, **kwargs) -> str:
+            if key:
+                return key(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return ":".join(str(v) for v in bound.arguments.values())
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            return await cache.get_or_load(make_key(*args, **kwargs), lambda: fn(*args, **kwargs))
+
+        async def invalidate(*args, **kwargs):
+            await cache.delete(make_key(*args, **kwargs))
+
+        wrapper.invalidate = invalidate
+        wrapper.invalidate_all = cache.clear
+        wrapper.cache = cache
+        wrapper.uncached = fn
+        return wrapper
+
+    return decorator
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    return {namespace: cache.stats() for namespace, cache in CACHES.items()}
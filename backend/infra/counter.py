@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from collections import Counter
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedCounter:
+    """
+    Coalesces `$inc` on one field of a collection in memory and writes them with a single bulk_write,
+    every `flush_interval` seconds or once `max_events` increments are pending, whichever comes first.
+
+    Increments still pending when the process dies are lost, so only use it for approximate counters.
+    """
+
+    def __init__(self, col, field: str, key_field: str = "id", flush_interval: float = 1.0,
+                 max_events: int = 1000, upsert: bool = False):
+        self.col = col
+        self.field = field
+        self.key_field = key_field
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self.upsert = upsert
+        self._pending: Counter[str] = Counter()
+        self._events = 0
+        self._loop_task: asyncio.Task | None = None
+        # flushes started by incr(), referenced until done so they are not garbage collected mid-write
+        self._flush_tasks: set[asyncio.Task] = set()
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._closed = False
+
+    def incr(self, key: str, n: int = 1) -> None:
+        if self._closed:
+            logger.warning(f"Counter {self.field} is closed, dropping increment of {key}")
+            return
+
+        self._pending[key] += n
+        self._events += 1
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._loop())
+        if self._events >= self.max_events and not self._flush_lock.locked():
+            task = asyncio.create_task(self.flush())
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self) -> int:
+        """Write pending increments, returns the number of keys written"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            pending, self._pending, self._events = self._pending, Counter(), 0
+            ops = [UpdateOne({self.key_field: key}, {"$inc": {self.field: n}}, upsert=self.upsert)
+                   for key, n in pending.items()]
+            try:
+                await self.col.bulk_write(ops, ordered=False)
+            except Exception as e:
+                # keep the counts for the next flush
+                logger.error(f"Error flushing {len(ops)} {self.field} increments: {e}", exc_info=True)
+                self._pending.update(pending)
+                return 0
+            return len(ops)
+
+    async def _loop(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def close(self):
+        """
+        Stop the flush loop and write whatever is still pending.
+
+        The loop is woken rather than cancelled: cancelling it inside bulk_write would drop the
+        increments it had already taken out of the buffer.
+        """
+        self._closed = True
+        self._wake.set()
+        if self._loop_task:
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
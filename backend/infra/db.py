@@ -1,20 +1,95 @@
+import asyncio
+import base64
 import datetime
+import json
+import logging
 import uuid
 from typing import Literal
 
 import motor.motor_asyncio
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import BaseModel, TypeAdapter
+from pymongo import IndexModel, UpdateOne, ReadPreference, ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
 from common.error import raise_error
 from config import SETTINGS
-from entities.dto import AIGCTask, TwitterTTSTask, DigitalHuman, Profile
+from infra.cache import TwoTierCache, cached
+from infra.counter import BufferedCounter
+from infra.task_events import publish_task_event
+from entities.dto import AIGCTask, TwitterTTSTask, DigitalHuman, Profile, CursorPage
 from entities.dto import PredefinedVoice
 
-client = motor.motor_asyncio.AsyncIOMotorClient(SETTINGS.MONGO_STR)
-db = client[SETTINGS.MONGO_DB]
+logger = logging.getLogger(__name__)
+
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+_client: motor.motor_asyncio.AsyncIOMotorClient | None = None
+
+
+def connect_db() -> motor.motor_asyncio.AsyncIOMotorClient:
+    """
+    Create the Mongo client of this process. Called from lifespan so every worker process gets its own pool;
+    collections fall back to connecting on first use for scripts.
+    """
+    global _client
+    if _client is None:
+        _client = motor.motor_asyncio.AsyncIOMotorClient(
+            SETTINGS.MONGO_STR,
+            maxPoolSize=SETTINGS.MONGO_MAX_POOL_SIZE,
+            minPoolSize=SETTINGS.MONGO_MIN_POOL_SIZE,
+            waitQueueTimeoutMS=SETTINGS.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            serverSelectionTimeoutMS=SETTINGS.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            read_preference=_READ_PREFERENCES[SETTINGS.MONGO_READ_PREFERENCE],
+        )
+        logger.info(f"Mongo client created, maxPoolSize={SETTINGS.MONGO_MAX_POOL_SIZE} "
+                    f"readPreference={SETTINGS.MONGO_READ_PREFERENCE}")
+    return _client
+
+
+def close_db():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+class _LazyDatabase:
+    def __getitem__(self, name: str) -> "_LazyCollection":
+        return _LazyCollection(name)
+
+    def __getattr__(self, item):
+        return getattr(connect_db()[SETTINGS.MONGO_DB], item)
+
+
+class _LazyCollection:
+    """Stands in for a motor collection and resolves it against the current client on every access"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, item):
+        return getattr(connect_db()[SETTINGS.MONGO_DB][self.name], item)
+
+
+def listing(col):
+    """The collection with the read preference for listing queries, pair with .max_time_ms(SETTINGS.MONGO_LIST_MAX_TIME_MS)"""
+    return col.with_options(read_preference=_READ_PREFERENCES[SETTINGS.MONGO_LIST_READ_PREFERENCE])
+
+
+db = _LazyDatabase()
 twitter_user_col = db["twitter_user"]
 xapi_user_col = db["xapi_user"]
 file_col = db["file"]
 aigc_task_col = db["aigc_task"]
+aigc_task_history_col = db["aigc_task_history"]
 users_col = db["users"]  # Collection for user authentication data
 twitter_tts_task_col = db["twitter_tts_task"]  # Collection for Twitter TTS tasks
 digital_human_col = db["digital_human"]
@@ -25,16 +100,104 @@ logs_col = db["logs"]
 messages_col = db["messages"]
 x_oauth_col = db["x_oauth"]
 profiles_col = db["profiles"]
+points_ledger_col = db["points_ledger"]
+jobs_col = db["jobs"]
+pending_upload_col = db["pending_upload"]
+
+
+def encode_cursor(doc: dict) -> str:
+    """
+    Opaque keyset cursor pointing just after `doc` in (created_at desc, _id desc) order;
+    legacy documents without created_at sort after all others
+    """
+    created_at = doc.get("created_at")
+    raw = json.dumps({"c": created_at.isoformat() if created_at else None, "i": str(doc["_id"])})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime | None, ObjectId]:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.datetime.fromisoformat(raw["c"]) if raw["c"] is not None else None
+        return created_at, ObjectId(raw["i"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise_error("invalid cursor")
+
+
+async def find_by_cursor(col, query: dict, cursor: str | None, limit: int,
+                         projection: dict | None = None) -> tuple[list[dict], str | None]:
+    """
+    Keyset pagination on (created_at, _id), newest first.
+
+    An empty cursor returns the first page. Seeks straight to the next page instead of skipping,
+    so deep pages cost the same as the first one.
+    """
+    if cursor:
+        created_at, _id = decode_cursor(cursor)
+        if created_at is None:
+            # already among the undated documents, which sort last
+            after = {"created_at": None, "_id": {"$lt": _id}}
+        else:
+            after = {"$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": _id}},
+                {"created_at": None},
+            ]}
+        query = {"$and": [query, after]}
+
+    docs = await listing(col).find(query, projection) \
+        .sort([("created_at", -1), ("_id", -1)]) \
+        .limit(limit + 1) \
+        .max_time_ms(SETTINGS.MONGO_LIST_MAX_TIME_MS) \
+        .to_list(length=limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1])
+    return docs, next_cursor
+
+
+chat_counter = BufferedCounter(
+    digital_human_col,
+    "chat_count",
+    flush_interval=SETTINGS.CHAT_COUNT_FLUSH_INTERVAL_MS / 1000,
+    max_events=SETTINGS.CHAT_COUNT_FLUSH_MAX_EVENTS,
+    upsert=True,
+)
+
+
+# short-lived counts for listings that accept a slightly stale total
+_count_cache = TwoTierCache("count", TypeAdapter(int), redis_ttl=SETTINGS.LIST_TOTAL_CACHE_TTL_SECONDS)
+
+
+async def count_cached(col, query: dict) -> int:
+    key = f"{col.name}:{json.dumps(query, sort_keys=True, default=str)}"
+    return await _count_cache.get_or_load(
+        key, lambda: listing(col).count_documents(query, maxTimeMS=SETTINGS.MONGO_LIST_MAX_TIME_MS))
+
+
+async def find_with_total(col, query: dict, sort: list[tuple[str, int]], skip: int, limit: int,
+                          cached_total: bool = False) -> tuple[list[dict], int]:
+    """
+    One page of `query` plus the total number of matches.
+
+    The page is an indexed find().sort() and the total a count_documents, both run concurrently;
+    with `cached_total` the total comes from count_cached, for tenants where counting every request
+    is too expensive.
+    """
+    docs_cursor = listing(col).find(query).sort(sort).skip(skip).limit(limit) \
+        .max_time_ms(SETTINGS.MONGO_LIST_MAX_TIME_MS)
+    if cached_total:
+        count = count_cached(col, query)
+    else:
+        count = listing(col).count_documents(query, maxTimeMS=SETTINGS.MONGO_LIST_MAX_TIME_MS)
+    docs, total = await asyncio.gather(docs_cursor.to_list(length=limit), count)
+    return docs, total
 
 
 async def digital_human_chat_count(digital_human_id: str):
-    await digital_human_col.update_one(
-        {"id": digital_human_id},
-        {
-            "$inc": {"chat_count": 1},
-        },
-        upsert=True,
-    )
+    """Buffered, the increment reaches the db with the next chat_counter flush"""
+    chat_counter.incr(digital_human_id)
 
 
 async def add_points(
@@ -43,38 +206,47 @@ async def add_points(
         remark: str = "",
         points_type: Literal["add", "subtract"] = "add",
 ):
+    """Append a row to the points ledger and move the profile's total_points counter by the same amount"""
     if points <= 0:
         raise_error("points must be positive")
 
     delta = points if points_type == "add" else -points
 
-    detail = {
+    await points_ledger_col.insert_one({
+        "tenant_id": tenant_id,
         "points": points,
         "type": points_type,
         "remark": remark,
         "created_at": datetime.datetime.now(),
-    }
-
+    })
     await profiles_col.update_one(
         {"tenant_id": tenant_id},
-        {
-            "$inc": {"total_points": delta},
-            "$push": {"points_details": detail},
-        },
+        {"$inc": {"total_points": delta}},
         upsert=True,
     )
+    await get_profile_by_tenant_id_cached.invalidate(tenant_id)
 
 
 async def profile_save(p: Profile):
+    """Save profile fields; total_points is owned by add_points and never overwritten here"""
     if not p.invitation_code:
         p.invitation_code = p.tenant_id
-    await profiles_col.replace_one({"tenant_id": p.tenant_id}, p.model_dump(), upsert=True)
+    await profiles_col.update_one(
+        {"tenant_id": p.tenant_id},
+        {
+            "$set": p.model_dump(exclude={"total_points"}),
+            "$setOnInsert": {"total_points": p.total_points},
+        },
+        upsert=True,
+    )
+    await get_profile_by_tenant_id_cached.invalidate(p.tenant_id)
 
 
 async def get_profile_by_tenant_id(tenant_id: str) -> Profile | None:
     if not tenant_id:
         raise_error("tenant_id is required")
-    ret = await profiles_col.find_one({"tenant_id": tenant_id})
+    # legacy documents may still carry the unbounded points_details array, see m_v2
+    ret = await profiles_col.find_one({"tenant_id": tenant_id}, {"points_details": 0})
     if ret:
         p = Profile(**ret)
         if not p.invitation_code:
@@ -91,10 +263,29 @@ async def get_profile_by_tenant_id(tenant_id: str) -> Profile | None:
         return p
 
 
+@cached(negative_ttl=None)
+async def get_profile_by_tenant_id_cached(tenant_id: str) -> Profile | None:
+    """Cached get_profile_by_tenant_id for read-only use, dropped by profile_save and add_points"""
+    return await get_profile_by_tenant_id(tenant_id)
+
+
+# public digital human reads: one entry per id / digital_name, plus list pages in their own namespace
+_digital_human_cache = TwoTierCache("digital_human", TypeAdapter(DigitalHuman | None))
+_digital_human_page_cache = TwoTierCache("digital_human_page", TypeAdapter(CursorPage[DigitalHuman]))
+
+
+async def digital_human_invalidate(digital_human: DigitalHuman | dict):
+    if isinstance(digital_human, DigitalHuman):
+        digital_human = digital_human.model_dump()
+    await _digital_human_cache.delete(f"id:{digital_human.get('id')}", f"name:{digital_human.get('digital_name')}")
+    await _digital_human_page_cache.clear()
+
+
 async def digital_human_save(digital_human: DigitalHuman):
     digital_human.updated_at = datetime.datetime.now()
     await digital_human_col.replace_one({"digital_name": digital_human.digital_name}, digital_human.model_dump(),
                                         upsert=True)
+    await digital_human_invalidate(digital_human)
 
 
 async def digital_human_get_by_digital_human(username: str) -> DigitalHuman | None:
@@ -105,8 +296,16 @@ async def digital_human_get_by_digital_human(username: str) -> DigitalHuman | No
         return None
 
 
+async def digital_human_get_by_digital_human_cached(username: str) -> DigitalHuman | None:
+    """Cached digital_human_get_by_digital_human, the result is shared and must not be modified"""
+    return await _digital_human_cache.get_or_load(f"name:{username}",
+                                                  lambda: digital_human_get_by_digital_human(username))
+
+
 async def digital_human_col_delete_by_id(id: str):
-    await digital_human_col.delete_one({'id': id})
+    ret = await digital_human_col.find_one_and_delete({'id': id})
+    if ret:
+        await digital_human_invalidate(ret)
 
 
 async def digital_human_get_by_id(id: str) -> DigitalHuman | None:
@@ -117,10 +316,47 @@ async def digital_human_get_by_id(id: str) -> DigitalHuman | None:
         return None
 
 
+async def digital_human_get_by_id_cached(id: str) -> DigitalHuman | None:
+    """Cached digital_human_get_by_id, the result is shared and must not be modified"""
+    return await _digital_human_cache.get_or_load(f"id:{id}", lambda: digital_human_get_by_id(id))
+
+
+async def digital_human_page(tag: str, page: int, pagesize: int, cursor: str | None) -> CursorPage[DigitalHuman]:
+    """
+    One page of digital humans, newest first, optionally filtered by tag.
+
+    A non-None cursor switches to keyset mode, otherwise page/pagesize with skip. Pages are cached
+    and the whole page cache is dropped on any digital human write.
+    """
+
+    async def load() -> CursorPage[DigitalHuman]:
+        query = {"tag": tag} if tag else {}
+        if cursor is not None:
+            docs, next_cursor = await find_by_cursor(digital_human_col, query, cursor, pagesize)
+            return CursorPage(items=[DigitalHuman(**doc) for doc in docs], next_cursor=next_cursor)
+
+        docs = await listing(digital_human_col).find(query) \
+            .sort("created_at", -1) \
+            .skip((page - 1) * pagesize) \
+            .limit(pagesize) \
+            .max_time_ms(SETTINGS.MONGO_LIST_MAX_TIME_MS) \
+            .to_list(length=pagesize)
+        return CursorPage(items=[DigitalHuman(**doc) for doc in docs])
+
+    key = f"{tag}:c:{cursor}:{pagesize}" if cursor is not None else f"{tag}:p:{page}:{pagesize}"
+    return await _digital_human_page_cache.get_or_load(key, load)
+
+
+# legacy documents still embed every past version of a sub task, see m_v3
+AIGC_TASK_PROJECTION = {f"{name}.history": 0 for name in ("cover", "lyrics", "music", "audio", "videos")}
+
+
 async def aigc_task_get_by_id(task_id: str) -> AIGCTask | None:
-    ret = await aigc_task_col.find_one({"task_id": task_id})
+    ret = await aigc_task_col.find_one({"task_id": task_id}, AIGC_TASK_PROJECTION)
     if ret:
-        return AIGCTask(**ret)
+        task = AIGCTask(**ret)
+        task.mark_clean()
+        return task
     else:
         return None
 
@@ -130,18 +366,94 @@ async def aigc_task_delete_by_id(task_id: str):
 
 
 async def aigc_task_count_by_tenant_id(tenant_id: str) -> int:
-    return await aigc_task_col.count_documents({"tenant_id": tenant_id})
+    return await listing(aigc_task_col).count_documents({"tenant_id": tenant_id},
+                                                         maxTimeMS=SETTINGS.MONGO_LIST_MAX_TIME_MS)
+
+
+def _dump_field(model: BaseModel, name: str):
+    return model.model_dump(include={name})[name]
+
+
+def _aigc_task_updates(task: AIGCTask) -> list[UpdateOne]:
+    """
+    Translate the fields changed since load into sub-document updates, so concurrent jobs working on
+    different sub tasks (cover, music, one video per key, ...) never overwrite each other.
+    """
+    dirty = task.dirty_fields()
+    sets = {name: _dump_field(task, name) for name in dirty}
+    for name, sub_task in task.sub_tasks().items():
+        if name not in dirty:
+            for field in sub_task.dirty_fields():
+                sets[f"{name}.{field}"] = _dump_field(sub_task, field)
+
+    ops = []
+    array_filters = []
+    if "videos" not in dirty:
+        stored_keys = task.stored_video_keys()
+        for i, video in enumerate(task.videos):
+            key = video.input.key
+            if key not in stored_keys:
+                ops.append(UpdateOne(
+                    {"task_id": task.task_id, "videos.input.key": {"$ne": key}},
+                    {"$push": {"videos": video.model_dump()}},
+                ))
+            elif video.dirty_fields():
+                array_filters.append({f"v{i}.input.key": key})
+                for field in video.dirty_fields():
+                    sets[f"videos.$[v{i}].{field}"] = _dump_field(video, field)
+
+    ops.insert(0, UpdateOne({"task_id": task.task_id}, {"$set": sets}, array_filters=array_filters or None))
+    return ops
+
+
+async def aigc_task_history_get(task_id: str, sub_task: str) -> list[dict]:
+    """
+    Archived versions of a sub task, newest first.
+
+    :param sub_task: cover / lyrics / music / audio, or videos.<key>
+    """
+    docs = await aigc_task_history_col.find({"task_id": task_id, "sub_task": sub_task}) \
+        .sort([("archived_at", -1), ("_id", -1)]) \
+        .to_list(length=None)
+    return [doc["data"] for doc in docs]
+
+
+async def _aigc_task_archive(task: AIGCTask):
+    now = datetime.datetime.now()
+    sub_tasks = [(name, sub_task) for name, sub_task in task.sub_tasks().items()]
+    sub_tasks += [(f"videos.{video.input.key}", video) for video in task.videos]
+
+    docs = []
+    for name, sub_task in sub_tasks:
+        # pop_archive() is newest first, insert oldest first so archived_at keeps the order
+        for data in reversed(sub_task.pop_archive()):
+            docs.append({"task_id": task.task_id, "sub_task": name, "data": data, "archived_at": now})
+    if docs:
+        await aigc_task_history_col.insert_many(docs, ordered=True)
 
 
 async def aigc_task_save(task: AIGCTask):
     task.updated_at = datetime.datetime.now()
-    await aigc_task_col.replace_one({"task_id": task.task_id}, task.model_dump(), upsert=True)
+    delta = task.status_delta()
+    await _aigc_task_archive(task)
+    if not task.is_tracked():
+        await aigc_task_col.replace_one({"task_id": task.task_id}, task.model_dump(), upsert=True)
+    else:
+        await aigc_task_col.bulk_write(_aigc_task_updates(task), ordered=True)
+    task.mark_clean()
+    if delta:
+        await publish_task_event(task.task_id, {"task_id": task.task_id, "updated_at": task.updated_at, **delta})
 
 
 # Twitter TTS Task operations
 async def twitter_tts_task_save(task: TwitterTTSTask):
     """Save or update Twitter TTS task"""
     await twitter_tts_task_col.replace_one({"task_id": task.task_id}, task.model_dump(), upsert=True)
+    await publish_task_event(task.task_id, twitter_tts_task_delta(task))
+
+
+def twitter_tts_task_delta(task: TwitterTTSTask) -> dict:
+    return task.model_dump(mode="json", include={"task_id", "status", "audio_url", "error_message", "updated_at"})
 
 
 async def twitter_tts_task_get_by_id(task_id: str) -> TwitterTTSTask | None:
@@ -168,9 +480,15 @@ async def twitter_tts_task_get_by_username_and_url(username: str, twitter_url: s
 
 
 async def twitter_tts_task_get_by_tenant(tenant_id: str, page: int = 1, page_size: int = 20, status: str = None,
-                                         task_type: str = None, style: str = None, username: str = None) -> \
-        tuple[list[TwitterTTSTask], int]:
-    """Get Twitter TTS tasks by tenant with pagination"""
+                                         task_type: str = None, style: str = None, username: str = None,
+                                         cursor: str = None,
+                                         cached_total: bool = False) -> tuple[list[TwitterTTSTask], int, str | None]:
+    """
+    Get Twitter TTS tasks by tenant with pagination
+
+    Pages by cursor instead of page number when `cursor` is not None (empty string for the first page).
+    With `cached_total` the total may lag behind by LIST_TOTAL_CACHE_TTL_SECONDS.
+    """
     skip = (page - 1) * page_size
 
     # Build query
@@ -184,16 +502,19 @@ async def twitter_tts_task_get_by_tenant(tenant_id: str, page: int = 1, page_siz
     if username:
         query["username"] = username
 
-    # Get total count
-    total = await twitter_tts_task_col.count_documents(query)
-
-    # Get tasks with pagination
-    cursor = twitter_tts_task_col.find(query).sort("created_at", -1).skip(skip).limit(page_size)
-    tasks = []
-    async for doc in cursor:
-        tasks.append(TwitterTTSTask(**doc))
+    # Get tasks and total count
+    next_cursor = None
+    if cursor is not None:
+        count = count_cached(twitter_tts_task_col, query) if cached_total else \
+            listing(twitter_tts_task_col).count_documents(query, maxTimeMS=SETTINGS.MONGO_LIST_MAX_TIME_MS)
+        (docs, next_cursor), total = await asyncio.gather(
+            find_by_cursor(twitter_tts_task_col, query, cursor, page_size), count)
+    else:
+        docs, total = await find_with_total(twitter_tts_task_col, query, [("created_at", -1)], skip, page_size,
+                                            cached_total)
+    tasks = [TwitterTTSTask(**doc) for doc in docs]
 
-    return tasks, total
+    return tasks, total, next_cursor
 
 
 async def twitter_tts_task_get_pending() -> list[TwitterTTSTask]:
@@ -210,8 +531,10 @@ async def twitter_tts_task_get_pending() -> list[TwitterTTSTask]:
 async def predefined_voice_save(voice: PredefinedVoice):
     """Save or update predefined voice"""
     await predefined_voice_col.replace_one({"voice_id": voice.voice_id}, voice.model_dump(), upsert=True)
+    await predefined_voice_get_all.invalidate_all()
 
 
+@cached()
 async def predefined_voice_get_all(category: str = None, is_active: bool = True) -> tuple[list[PredefinedVoice], int]:
     """Get all predefined voices with optional filtering"""
     # Build query
@@ -219,11 +542,8 @@ async def predefined_voice_get_all(category: str = None, is_active: bool = True)
     if category:
         query["category"] = category
 
-    # Get total count
-    total = await predefined_voice_col.count_documents(query)
-
     # Get voices
-    cursor = predefined_voice_col.find(query).sort("name", 1)
+    cursor = listing(predefined_voice_col).find(query).sort("name", 1).max_time_ms(SETTINGS.MONGO_LIST_MAX_TIME_MS)
     voices = []
     async for doc in cursor:
         # Handle missing fields with defaults
@@ -234,7 +554,8 @@ async def predefined_voice_get_all(category: str = None, is_active: bool = True)
 
         voices.append(PredefinedVoice(**doc))
 
-    return voices, total
+    # the list is not paged, so the total is simply its length
+    return voices, len(voices)
 
 
 async def predefined_voice_get_by_id(voice_id: str) -> PredefinedVoice | None:
@@ -252,54 +573,250 @@ async def predefined_voice_get_by_id(voice_id: str) -> PredefinedVoice | None:
         return None
 
 
-async def create_user_indexes():
-    """Create indexes for the users collection"""
-    try:
-        await users_col.create_index("username", unique=True)
-        await users_col.create_index("email", unique=True, sparse=True)
-        await users_col.create_index("wallet_address", unique=True)
-        await users_col.create_index("tenant_id")
-        print("User indexes created successfully")
-    except Exception as e:
-        print(f"Error creating user indexes: {e}")
+async def resource_usage_consume(client: str, resource: str, limit: int) -> tuple[bool, int]:
+    """
+    Consume one unit of the lifetime quota of `resource` for `client` unless it is used up; a `limit`
+    on the usage document overrides the given one. Only allowed requests are counted.
 
+    A limit of N allows N - 1 uses, as the counter always has: the stored limits were chosen with that in mind.
 
-async def create_twitter_tts_indexes():
-    """Create indexes for the twitter_tts_task collection"""
+    :return: (allowed, count)
+    """
+    query = {"client": client, "resource": resource}
     try:
-        await twitter_tts_task_col.create_index("task_id", unique=True)
-        await twitter_tts_task_col.create_index("tenant_id")
-        await twitter_tts_task_col.create_index("status")
-        await twitter_tts_task_col.create_index("task_type")
-        await twitter_tts_task_col.create_index("style")
-        await twitter_tts_task_col.create_index("created_at")
-        await twitter_tts_task_col.create_index("tweet_id")
-        await twitter_tts_task_col.create_index("username")
-        print("Twitter TTS task indexes created successfully")
-    except Exception as e:
-        print(f"Error creating Twitter TTS task indexes: {e}")
-
-
-async def create_predefined_voice_indexes():
-    """Create indexes for the predefined_voice collection"""
-    try:
-        await predefined_voice_col.create_index("voice_id", unique=True)
-        await predefined_voice_col.create_index("name")
-        await predefined_voice_col.create_index("category")
-        await predefined_voice_col.create_index("is_active")
-        await predefined_voice_col.create_index("created_at")
-        print("Predefined voice indexes created successfully")
-    except Exception as e:
-        print(f"Error creating predefined voice indexes: {e}")
+        usage = await resource_usage_col.find_one_and_update(
+            {**query, "$expr": {"$lt": [{"$add": [{"$ifNull": ["$count", 0]}, 1]}, {"$ifNull": ["$limit", limit]}]}},
+            {"$inc": {"count": 1}},
+            # without a usage document only the given limit applies; when it allows nothing, nothing is inserted
+            upsert=limit > 1,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # the usage document exists but is at its limit: the filter missed and the upsert hit the unique index
+        usage = None
+    if usage is None:
+        usage = await resource_usage_col.find_one(query)
+        return False, usage["count"] if usage else 0
+    return True, usage["count"]
+
+
+def _file_identity(storage: str, sha256: str, content_type: str | None, suffix: str) -> dict:
+    """
+    What makes two uploads the same file: the storage scope holding them (see StorageBackend.scope),
+    their bytes, and the content type and key suffix they are served with, so the same bytes uploaded
+    as .wav don't come back as an earlier .mp3
+    """
+    return {"storage": storage, "sha256": sha256, "content_type": content_type, "suffix": suffix}
+
+
+async def file_get_by_content(storage: str, sha256: str, content_type: str | None, suffix: str) -> dict | None:
+    return await file_col.find_one(_file_identity(storage, sha256, content_type, suffix))
+
+
+async def file_save_if_absent(file: dict) -> dict:
+    """
+    Record an uploaded file unless the same one exists (see _file_identity); returns the stored record,
+    which is the earlier one when two uploads of the same content race.
+    """
+    return await file_col.find_one_and_update(
+        _file_identity(file["storage"], file["sha256"], file["content_type"], file["suffix"]),
+        {"$setOnInsert": file},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def file_get_by_key(storage: str, key: str) -> dict | None:
+    return await file_col.find_one({"storage": storage, "key": key})
+
+
+async def pending_upload_save(storage: str, key: str, tenant_id: str):
+    """Remember who a presigned key was handed to, until the upload is completed or PENDING_UPLOAD_TTL_SECONDS pass"""
+    await pending_upload_col.insert_one({
+        "storage": storage,
+        "key": key,
+        "tenant_id": tenant_id,
+        "created_at": datetime.datetime.now(),
+    })
+
+
+async def pending_upload_get(storage: str, key: str, tenant_id: str) -> dict | None:
+    return await pending_upload_col.find_one({"storage": storage, "key": key, "tenant_id": tenant_id})
+
+
+async def pending_upload_delete(storage: str, key: str):
+    await pending_upload_col.delete_one({"storage": storage, "key": key})
+
+
+# collection name -> indexes backing its hot queries; applied idempotently by init_indexes() at startup
+INDEX_REGISTRY: dict[str, list[IndexModel]] = {
+    "users": [
+        IndexModel("username", unique=True),
+        IndexModel("email", unique=True, sparse=True),
+        IndexModel("wallet_address", unique=True),
+        IndexModel("tenant_id"),
+    ],
+    "aigc_task": [
+        IndexModel("task_id", unique=True),
+        IndexModel([("tenant_id", 1), ("created_at", -1), ("_id", -1)]),
+    ],
+    "aigc_task_history": [
+        IndexModel([("task_id", 1), ("sub_task", 1), ("archived_at", -1), ("_id", -1)]),
+    ],
+    "digital_human": [
+        IndexModel("id", unique=True),
+        # not unique: legacy documents share empty or missing names
+        IndexModel("digital_name", name="digital_name_lookup"),
+        IndexModel([("created_at", -1), ("_id", -1)]),
+        IndexModel([("tag", 1), ("created_at", -1), ("_id", -1)]),
+    ],
+    "twitter_tts_task": [
+        IndexModel("task_id", unique=True),
+        IndexModel([("tenant_id", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("status", 1), ("created_at", 1)]),
+        IndexModel([("username", 1), ("twitter_url", 1), ("tenant_id", 1)]),
+    ],
+    "predefined_voice": [
+        IndexModel("voice_id", unique=True),
+        IndexModel([("is_active", 1), ("name", 1)]),
+        IndexModel([("is_active", 1), ("category", 1), ("name", 1)]),
+    ],
+    "profiles": [
+        IndexModel("tenant_id", unique=True),
+    ],
+    "points_ledger": [
+        IndexModel([("tenant_id", 1), ("created_at", -1), ("_id", -1)]),
+    ],
+    "resource_limits": [
+        IndexModel("resource"),
+    ],
+    "resource_usage": [
+        IndexModel([("client", 1), ("resource", 1)], unique=True),
+    ],
+    "messages": [
+        IndexModel([("conversation_id", 1), ("ts", -1)]),
+    ],
+    "xapi_user": [
+        IndexModel("username"),
+        IndexModel("id", unique=True),
+    ],
+    "x_oauth": [
+        IndexModel("state", unique=True),
+    ],
+    "file": [
+        IndexModel([("storage", 1), ("sha256", 1), ("content_type", 1), ("suffix", 1)], unique=True,
+                   partialFilterExpression={"sha256": {"$exists": True}}),
+        IndexModel([("storage", 1), ("key", 1)]),
+    ],
+    "pending_upload": [
+        IndexModel([("storage", 1), ("key", 1)], unique=True),
+        IndexModel("created_at", expireAfterSeconds=SETTINGS.PENDING_UPLOAD_TTL_SECONDS),
+    ],
+    "jobs": [
+        IndexModel("job_id", unique=True),
+        IndexModel([("status", 1), ("available_at", 1)]),
+        IndexModel([("status", 1), ("lease_until", 1)]),
+        # done and failed jobs are purged, pending and running ones have no finished_at
+        IndexModel("finished_at", expireAfterSeconds=SETTINGS.JOB_RETENTION_SECONDS),
+    ],
+}
+
+# collection name -> names of indexes replaced in INDEX_REGISTRY, dropped by init_indexes() at startup
+OBSOLETE_INDEXES: dict[str, list[str]] = {
+    "digital_human": ["digital_name_1"],
+    # unique by sha256 alone, then by content type and suffix, now also by storage scope
+    "file": ["sha256_1", "sha256_1_content_type_1_suffix_1"],
+}
+
+# (collection, filter, sort) shapes of the queries issued in this module, checked against the registry
+HOT_QUERIES: list[tuple[str, dict, list | None]] = [
+    ("users", {"wallet_address": "w"}, None),
+    ("users", {"tenant_id": "t"}, None),
+    ("aigc_task", {"task_id": "t"}, None),
+    ("aigc_task", {"tenant_id": "t"}, [("created_at", -1), ("_id", -1)]),
+    ("aigc_task_history", {"task_id": "t", "sub_task": "s"}, [("archived_at", -1), ("_id", -1)]),
+    ("digital_human", {"id": "i"}, None),
+    ("digital_human", {"digital_name": "n"}, None),
+    ("digital_human", {}, [("created_at", -1), ("_id", -1)]),
+    ("digital_human", {"tag": "t"}, [("created_at", -1), ("_id", -1)]),
+    ("twitter_tts_task", {"task_id": "t"}, None),
+    ("twitter_tts_task", {"tenant_id": "t", "status": "done"}, [("created_at", -1)]),
+    ("twitter_tts_task", {"status": "in_progress"}, [("created_at", 1)]),
+    ("twitter_tts_task", {"username": "u", "twitter_url": "x", "tenant_id": "t"}, None),
+    ("predefined_voice", {"voice_id": "v"}, None),
+    ("predefined_voice", {"is_active": True}, [("name", 1)]),
+    ("predefined_voice", {"is_active": True, "category": "c"}, [("name", 1)]),
+    ("profiles", {"tenant_id": "t"}, None),
+    ("points_ledger", {"tenant_id": "t"}, [("created_at", -1), ("_id", -1)]),
+    ("resource_limits", {"resource": "r"}, None),
+    ("resource_usage", {"client": "c", "resource": "r"}, None),
+    ("messages", {"conversation_id": "c"}, [("ts", -1)]),
+    ("xapi_user", {"username": "u"}, None),
+    ("x_oauth", {"state": "s"}, None),
+    ("file", {"storage": "s", "sha256": "h", "content_type": "c", "suffix": ".s"}, None),
+    ("file", {"storage": "s", "key": "k"}, None),
+    ("pending_upload", {"storage": "s", "key": "k", "tenant_id": "t"}, None),
+    ("jobs", {"status": "pending", "available_at": {"$lte": datetime.datetime.now()}}, [("available_at", 1)]),
+]
 
 
 async def init_indexes():
-    try:
-        await create_user_indexes()
-        await create_twitter_tts_indexes()
-        await create_predefined_voice_indexes()
-        print("All indexes created successfully")
-    except Exception as e:
-        print(f"Error creating indexes: {e}")
-
-# asyncio.run(init_indexes())
+    """
+    Drop OBSOLETE_INDEXES and create every index in INDEX_REGISTRY; existing indexes are left untouched.
+
+    A unique index that cannot be built (usually duplicates, see infra/m_v5.py) stops the startup:
+    code relies on it, e.g. resource_usage_consume. Other failures are only logged.
+    """
+    for name, index_names in OBSOLETE_INDEXES.items():
+        for index_name in index_names:
+            try:
+                await db[name].drop_index(index_name)
+                logger.info(f"Dropped obsolete index {index_name} on {name}")
+            except OperationFailure as e:
+                # IndexNotFound: already dropped
+                if e.code != 27:
+                    logger.error(f"Error dropping index {index_name} on {name}: {e}")
+    for name, indexes in INDEX_REGISTRY.items():
+        for index in indexes:
+            try:
+                await db[name].create_indexes([index])
+            except Exception as e:
+                logger.error(f"Error creating index {index.document['name']} on {name}: {e}")
+                if index.document.get("unique"):
+                    raise
+    logger.info("Indexes initialized")
+
+
+def _plan_stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+async def find_collscans() -> list[tuple[str, dict]]:
+    """Explain every query in HOT_QUERIES and return those whose winning plan scans the whole collection"""
+    ret = []
+    for name, query, sort in HOT_QUERIES:
+        cursor = db[name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        if "COLLSCAN" in _plan_stages(explain["queryPlanner"]["winningPlan"]):
+            ret.append((name, query))
+    return ret
+
+
+async def _check_indexes() -> int:
+    await init_indexes()
+    collscans = await find_collscans()
+    for name, query in collscans:
+        print(f"COLLSCAN {name} {query}")
+    return 1 if collscans else 0
+
+
+if __name__ == '__main__':
+    # python -m infra.db: fails when a hot query is not covered by the registry
+    raise SystemExit(asyncio.run(_check_indexes()))
@@ -1,62 +1,194 @@
+import asyncio
 import base64
+import datetime
+import hashlib
 import logging
 import os
 import uuid
 
-import aioboto3
-import aiohttp
 from fastapi import UploadFile
 from openai.types import Image
 
+from common.error import raise_error
 from config import SETTINGS
 from entities.bo import FileBO
-from infra.db import file_col
-
-bucket_name = "web3ai"
+from entities.dto import PresignUploadReq, PresignUploadResp, CompleteUploadReq
+from infra.db import file_get_by_content, file_save_if_absent, file_get_by_key, pending_upload_save, \
+    pending_upload_get, pending_upload_delete
+from infra.http import http_session
+from infra.image_cache import IMAGES
+from infra.storage import STORAGE, ObjectInfo
 
 
 async def img_url_to_base64(image_url):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(image_url) as response:
-            response.raise_for_status()
-            content = await response.read()
-            encoded_data = base64.b64encode(content).decode("utf-8")
-            return "data:image/png;base64," + encoded_data
+    return await IMAGES.data_uri(image_url)
+
+
+# S3 rejects multipart parts below 5 MiB, except the last one; other backends follow the same rule
+_MIN_PART_SIZE = 5 * 1024 * 1024
+_READ_CHUNK_SIZE = 256 * 1024
+
+
+class _MultipartWriter:
+    """
+    Streams bytes into one content-addressed object of STORAGE, recorded in file_col by its storage scope,
+    sha256, content type and suffix.
+
+    Bytes go out in fixed-size parts, up to `max_inflight` of them concurrently, so memory stays around
+    (max_inflight + 1) parts whatever the object size. Content that fits in one part is hashed before
+    anything is sent: if it was uploaded before, the existing URL is reused and nothing is written.
+    Larger content is streamed under a random key and its upload aborted on close if it turns out to be a repeat.
+
+    Used as an async context manager: the object is completed on exit, or the upload aborted on error;
+    `url` then holds the object's public URL.
+    """
+
+    def __init__(self, content_type: str, suffix: str = "", filename: str | None = None,
+                 part_size: int = SETTINGS.S3_PART_SIZE_BYTES,
+                 max_inflight: int = SETTINGS.S3_PART_CONCURRENCY):
+        """
+        :param suffix: Appended to the key, e.g. ".mp3".
+        :param filename: Original name, only recorded.
+        """
+        self.content_type = content_type
+        self.suffix = suffix
+        self.filename = filename
+        self.part_size = max(part_size, _MIN_PART_SIZE)
+        self.key: str | None = None
+        self.url: str | None = None
+        self.size = 0
+        self.deduplicated = False
+        self._sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+        self._upload_id: str | None = None
+        self._parts: list[dict] = []
+        self._tasks: list[asyncio.Task] = []
+        self._slots = asyncio.Semaphore(max_inflight)
+
+    async def __aenter__(self) -> "_MultipartWriter":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                await self.close()
+            except BaseException:
+                await self.abort()
+                raise
+        else:
+            await self.abort()
+
+    async def write(self, data: bytes):
+        self._sha256.update(data)
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            with memoryview(self._buffer) as view:
+                part = bytes(view[:self.part_size])
+            del self._buffer[:self.part_size]
+            await self._upload_part(part)
+
+    async def _upload_part(self, body: bytes):
+        if self._upload_id is None:
+            # the hash is only known at the end, so multipart objects get a random key
+            self.key = f"{uuid.uuid4()}{self.suffix}"
+            self._upload_id = await STORAGE.create_multipart(self.key, self.content_type)
+
+        # waits while max_inflight parts are uploading, which is what bounds memory
+        await self._slots.acquire()
+        for task in self._tasks:
+            if task.done() and task.exception():
+                self._slots.release()
+                raise task.exception()
+
+        part_number = len(self._parts) + 1
+        self._parts.append({"PartNumber": part_number})
+        self._tasks.append(asyncio.create_task(self._put_part(part_number, body)))
+
+    async def _put_part(self, part_number: int, body: bytes):
+        try:
+            etag = await STORAGE.upload_part(self.key, self._upload_id, part_number, body)
+            self._parts[part_number - 1]["ETag"] = etag
+        finally:
+            self._slots.release()
+
+    async def close(self) -> str:
+        """Write what is buffered and complete the object, or reuse an identical one; returns the URL"""
+        sha256 = self._sha256.hexdigest()
+        existing = await file_get_by_content(STORAGE.scope, sha256, self.content_type, self.suffix)
+        if existing:
+            await self.abort()
+            self.key, self.url, self.deduplicated = existing.get("key"), existing["url"], True
+            return self.url
+
+        if self._upload_id is None:
+            # records tell files apart by content type too, so keys must: otherwise the same bytes stored as another
+            # type would overwrite the object an earlier record serves, Content-Type included
+            content_type_tag = hashlib.sha256((self.content_type or "").encode()).hexdigest()[:12]
+            self.key = f"{sha256}-{content_type_tag}{self.suffix}"
+            await STORAGE.put(self.key, bytes(self._buffer), self.content_type)
+        else:
+            if self._buffer:
+                await self._upload_part(bytes(self._buffer))
+            await asyncio.gather(*self._tasks)
+            await STORAGE.complete_multipart(self.key, self._upload_id, self._parts)
+        self._buffer.clear()
+
+        stored = await file_save_if_absent({
+            "url": STORAGE.public_url(self.key),
+            "key": self.key,
+            "storage": STORAGE.scope,
+            "sha256": sha256,
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "suffix": self.suffix,
+            "size": self.size,
+            "created_at": datetime.datetime.now(),
+        })
+        if stored["key"] != self.key:
+            # a concurrent upload of the same content was recorded first
+            await STORAGE.delete(self.key)
+            self.key, self.deduplicated = stored["key"], True
+        self.url = stored["url"]
+        return self.url
+
+    async def abort(self):
+        """Drop the parts uploaded so far, S3 would otherwise keep (and bill) them"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._buffer.clear()
+        if self._upload_id is not None:
+            try:
+                await STORAGE.abort_multipart(self.key, self._upload_id)
+            except Exception as e:
+                logging.error(f"Error aborting multipart upload of {self.key}: {e}", exc_info=True)
+            self._upload_id = None
+
+
+async def _upload_bytes(data: bytes, content_type: str, suffix: str = "") -> _MultipartWriter:
+    async with _MultipartWriter(content_type, suffix) as writer:
+        await writer.write(data)
+    return writer
 
 
 async def download_and_upload_url(url):
-    file_name = f"{uuid.uuid4()}"
+    """
+    Re-host `url` in STORAGE, streaming the response body into a multipart upload without buffering the file
+    """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                response.raise_for_status()
-                content = await response.read()
-
-                with open(file_name, 'wb') as f:
-                    f.write(content)
-
-                session = aioboto3.Session()
-                async with session.client(
-                        "s3",
-                        region_name="ap-southeast-2",
-                        aws_access_key_id=SETTINGS.AWS_ACCESS_KEY,
-                        aws_secret_access_key=SETTINGS.AWS_SECRET_KEY,
-                ) as s3:
-                    await s3.put_object(
-                        Bucket=bucket_name,
-                        Key=file_name,
-                        Body=content,
-                        ACL="public-read",
-                        ContentType=response.headers.get("Content-Type", "application/octet-stream")
-                    )
-                fileurl = f"https://{bucket_name}.s3.ap-southeast-2.amazonaws.com/{file_name}"
-                return fileurl
+        async with http_session("stream").get(url) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "application/octet-stream")
+            async with _MultipartWriter(content_type) as writer:
+                async for chunk in response.content.iter_chunked(_READ_CHUNK_SIZE):
+                    await writer.write(chunk)
+            logging.info(f"Relayed {url} to storage: {writer.key}, size: {writer.size}, "
+                         f"deduplicated: {writer.deduplicated}")
+            return writer.url
 
     except Exception as e:
         logging.error(f"download_and_upload_image {e}", exc_info=True)
-    finally:
-        if os.path.exists(file_name):
-            os.remove(file_name)
     return ""
 
 
@@ -74,8 +206,6 @@ async def upload_audio_file(audio_data: bytes, file_extension: str) -> str | Non
     try:
         if not file_extension:
             file_extension = "mp3"
-        file_uuid = str(uuid.uuid4())
-        file_key = f"{file_uuid}.{file_extension}"
 
         # Determine content type based on file extension
         content_type_map = {
@@ -89,26 +219,12 @@ async def upload_audio_file(audio_data: bytes, file_extension: str) -> str | Non
 
         content_type = content_type_map.get(file_extension.lower(), 'audio/mpeg')
 
-        session = aioboto3.Session()
-        async with session.client(
-                "s3",
-                region_name="ap-southeast-2",
-                aws_access_key_id=SETTINGS.AWS_ACCESS_KEY,
-                aws_secret_access_key=SETTINGS.AWS_SECRET_KEY,
-        ) as s3:
-            await s3.put_object(
-                Bucket=bucket_name,
-                Key=file_key,
-                Body=audio_data,
-                ACL="public-read",
-                ContentType=content_type
-            )
-
-        audio_url = f"https://{bucket_name}.s3.ap-southeast-2.amazonaws.com/{file_key}"
+        writer = await _upload_bytes(audio_data, content_type, f".{file_extension}")
 
-        logging.info(f"Audio file uploaded to S3: {file_key}, size: {len(audio_data)} bytes, type: {content_type}")
+        logging.info(f"Audio file uploaded to S3: {writer.key}, size: {len(audio_data)} bytes, type: {content_type}, "
+                     f"deduplicated: {writer.deduplicated}")
 
-        return audio_url
+        return writer.url
 
     except Exception as e:
         logging.error(f"Error uploading audio file: {e}", exc_info=True)
@@ -118,42 +234,121 @@ async def upload_audio_file(audio_data: bytes, file_extension: str) -> str | Non
 async def s3_upload_file(file: UploadFile) -> FileBO:
     """
     Upload file to S3 storage
-    """
-    file_uuid = str(uuid.uuid4())
-    file_content = file.file.read()
-    file_size = len(file_content)
 
+    The upload is read in chunks (off the event loop once Starlette has spooled it to disk) and streamed
+    as multipart parts; files over UPLOAD_MAX_BYTES are rejected, and their parts dropped, as soon as they cross it.
+    Content uploaded before returns the existing URL.
+    """
     # Get content type, if file object doesn't provide it, guess from filename
     content_type = file.content_type
     if not content_type:
         content_type = _guess_content_type(file.filename)
 
-    session = aioboto3.Session()
-    async with session.client(
-            "s3",
-            region_name="ap-southeast-2",
-            aws_access_key_id=SETTINGS.AWS_ACCESS_KEY,
-            aws_secret_access_key=SETTINGS.AWS_SECRET_KEY,
-    ) as s3:
-        await s3.put_object(
-            Bucket=bucket_name,
-            Key=file_uuid,
-            Body=file_content,
-            ACL="public-read",
-            ContentType=content_type
-        )
-
-    logging.info(f"File uploaded to S3: {file_uuid}, size: {file_size}, type: {content_type}")
+    async with _MultipartWriter(content_type, filename=file.filename) as writer:
+        while chunk := await file.read(_READ_CHUNK_SIZE):
+            if writer.size + len(chunk) > SETTINGS.UPLOAD_MAX_BYTES:
+                raise_error(f"file too large, the limit is {SETTINGS.UPLOAD_MAX_BYTES} bytes")
+            await writer.write(chunk)
+
+    logging.info(f"File uploaded to S3: {writer.key}, size: {writer.size}, type: {content_type}, "
+                 f"deduplicated: {writer.deduplicated}")
 
     bo = FileBO(
-        url=f"https://{bucket_name}.s3.ap-southeast-2.amazonaws.com/{file_uuid}"
+        url=writer.url
     )
 
-    file_col.insert_one(bo.model_dump())
-
     return bo
 
 
+_PRESIGNED_PREFIX = "uploads/"
+
+
+async def s3_presign_upload(req: PresignUploadReq, tenant_id: str) -> PresignUploadResp:
+    """
+    Let the client PUT a file straight to S3 instead of through the API. The signature covers the
+    declared size, content type and sha256, so S3 rejects any other body; content uploaded before
+    is answered with its URL and nothing to upload. The key is recorded as pending for `tenant_id`,
+    only that tenant can complete it.
+    """
+    if req.size > SETTINGS.UPLOAD_MAX_BYTES:
+        raise_error(f"file too large, the limit is {SETTINGS.UPLOAD_MAX_BYTES} bytes")
+
+    suffix = os.path.splitext(req.filename)[1].lower()
+    existing = await file_get_by_content(STORAGE.scope, req.sha256, req.content_type, suffix)
+    if existing:
+        return PresignUploadResp(key=existing.get("key", ""), file_url=existing["url"])
+
+    key = f"{_PRESIGNED_PREFIX}{uuid.uuid4()}{suffix}"
+    upload_url, headers = await STORAGE.presign_put(key, req.content_type, req.size, req.sha256,
+                                                    SETTINGS.S3_PRESIGN_EXPIRES_SECONDS)
+    await pending_upload_save(STORAGE.scope, key, tenant_id)
+    return PresignUploadResp(
+        key=key,
+        upload_url=upload_url,
+        headers=headers,
+        expires_in=SETTINGS.S3_PRESIGN_EXPIRES_SECONDS,
+    )
+
+
+async def _object_sha256(key: str, info: ObjectInfo) -> str:
+    """The object's sha256 from its stored checksum, or by reading it for backends that don't keep checksums"""
+    if info.sha256:
+        return info.sha256
+
+    sha256 = hashlib.sha256()
+    async for chunk in STORAGE.iter_chunks(key, _READ_CHUNK_SIZE):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+async def _reject_upload(key: str, msg: str):
+    await STORAGE.delete(key)
+    await pending_upload_delete(STORAGE.scope, key)
+    raise_error(msg)
+
+
+async def s3_complete_upload(req: CompleteUploadReq, tenant_id: str) -> FileBO:
+    """
+    Verify a presigned upload landed with the declared content and record it in file_col;
+    an object failing the checks is deleted. Only the tenant the key was presigned for can complete it,
+    and only while it is pending: recorded files are never touched.
+    """
+    if not req.key.startswith(_PRESIGNED_PREFIX):
+        raise_error("invalid key")
+    if await file_get_by_key(STORAGE.scope, req.key):
+        raise_error("upload already completed")
+    if not await pending_upload_get(STORAGE.scope, req.key, tenant_id):
+        raise_error("upload not found")
+
+    info = await STORAGE.head(req.key)
+    if info is None:
+        raise_error("upload not found")
+
+    if info.size > SETTINGS.UPLOAD_MAX_BYTES:
+        await _reject_upload(req.key, f"file too large, the limit is {SETTINGS.UPLOAD_MAX_BYTES} bytes")
+    if await _object_sha256(req.key, info) != req.sha256:
+        await _reject_upload(req.key, "uploaded content does not match its sha256")
+
+    stored = await file_save_if_absent({
+        "url": STORAGE.public_url(req.key),
+        "key": req.key,
+        "storage": STORAGE.scope,
+        "sha256": req.sha256,
+        "filename": req.filename,
+        "content_type": info.content_type,
+        "suffix": os.path.splitext(req.key)[1],
+        "size": info.size,
+        "created_at": datetime.datetime.now(),
+    })
+    if stored["key"] != req.key:
+        # the same content was recorded while this one was uploading
+        await STORAGE.delete(req.key)
+    await pending_upload_delete(STORAGE.scope, req.key)
+
+    logging.info(f"Presigned upload completed: {stored['key']}, size: {info.size}")
+    return FileBO(url=stored["url"])
+
+
 def _guess_content_type(filename: str) -> str:
     """
     Guess content type based on filename
@@ -169,25 +364,8 @@ async def s3_upload_openai_img(img: Image) -> str | None:
     """
     try:
         image_bytes = base64.b64decode(img.b64_json)
-        file_uuid = str(uuid.uuid4())
-        session = aioboto3.Session()
-        async with session.client(
-                "s3",
-                region_name="ap-southeast-2",
-                aws_access_key_id=SETTINGS.AWS_ACCESS_KEY,
-                aws_secret_access_key=SETTINGS.AWS_SECRET_KEY,
-        ) as s3:
-            await s3.put_object(
-                Bucket=bucket_name,
-                Key=file_uuid,
-                Body=image_bytes,
-                ACL="public-read",
-                ContentType='image/png'
-            )
-
-        url = f"https://{bucket_name}.s3.ap-southeast-2.amazonaws.com/{file_uuid}"
-
-        return url
+        writer = await _upload_bytes(image_bytes, 'image/png')
+        return writer.url
     except Exception as e:
         return None
 
@@ -199,3 +377,82 @@ def _guess_content_type(filename: str) -> str:
     import mimetypes
     content_type, _ = mimetypes.guess_type(filename)
     return content_type or 'application/octet-stream'
+
+
+# Benchmark ==================================================
+
+if __name__ == '__main__':
+    import io
+    import sys
+    import time
+
+    from aiohttp import web
+    from starlette.datastructures import Headers
+
+    from infra.db import file_col
+    from infra.http import HTTP
+    from infra.storage import create_storage
+
+    # python -m infra.file [backend ...]: upload, dedup and relay throughput through the real code paths,
+    # file records included (needs MONGO_STR); records of the memory backend are removed afterwards
+    _BODY_SIZE = 64 * 1024
+    _RELAY_SIZE = 1024 * 1024
+
+    async def _relay_server() -> web.AppRunner:
+        base = os.urandom(_RELAY_SIZE)
+
+        async def handler(request):
+            # unique content per request, so every relay stores a new object
+            return web.Response(body=uuid.uuid4().bytes + base, content_type="application/octet-stream")
+
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 8765).start()
+        return runner
+
+    async def _upload_unique(i: int):
+        body = uuid.uuid4().bytes + _BENCH_BODY
+        file = UploadFile(io.BytesIO(body), filename=f"bench{i}.bin",
+                          headers=Headers({"content-type": "application/octet-stream"}))
+        await s3_upload_file(file)
+
+    async def _upload_repeated(i: int):
+        writer = await _upload_bytes(_BENCH_BODY, "application/octet-stream", ".bin")
+        assert writer.deduplicated
+
+    async def _relay(i: int):
+        assert await download_and_upload_url(f"http://127.0.0.1:8765/{i}")
+
+    async def _bench(op, ops: int, concurrency: int) -> float:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with semaphore:
+                await op(i)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(ops)))
+        return ops / (time.perf_counter() - start)
+
+    async def _main(backends: list[str]):
+        global STORAGE
+        runner = await _relay_server()
+        for name in backends:
+            STORAGE = create_storage(name)
+            await STORAGE.open()
+            # the first one records the repeated body, the others are dedup hits
+            await _upload_bytes(_BENCH_BODY, "application/octet-stream", ".bin")
+            for op_name, op in (("upload", _upload_unique), ("dedup", _upload_repeated), ("relay", _relay)):
+                for concurrency in (1, 16):
+                    rate = await _bench(op, 200, concurrency)
+                    print(f"{name:<7} {op_name:<7} concurrency {concurrency:>3}: {rate:8.1f} ops/s")
+            if name == "memory":
+                await file_col.delete_many({"storage": STORAGE.scope})
+            await STORAGE.close()
+        await runner.cleanup()
+        await HTTP.close()
+
+    _BENCH_BODY = os.urandom(_BODY_SIZE)
+    asyncio.run(_main(sys.argv[1:] or [SETTINGS.STORAGE_BACKEND]))
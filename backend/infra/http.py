@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+
+import aiohttp
+
+from config import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SessionProfile:
+    timeout: aiohttp.ClientTimeout
+    limit_per_host: int
+
+
+# name -> how its session is configured
+PROFILES: dict[str, SessionProfile] = {
+    # API calls
+    "default": SessionProfile(
+        timeout=aiohttp.ClientTimeout(total=SETTINGS.HTTP_TIMEOUT_SECONDS,
+                                      connect=SETTINGS.HTTP_CONNECT_TIMEOUT_SECONDS),
+        limit_per_host=SETTINGS.HTTP_LIMIT_PER_HOST,
+    ),
+    # media downloads and streamed responses, which may take minutes but must keep making progress
+    "stream": SessionProfile(
+        timeout=aiohttp.ClientTimeout(total=None,
+                                      connect=SETTINGS.HTTP_CONNECT_TIMEOUT_SECONDS,
+                                      sock_read=SETTINGS.HTTP_STREAM_READ_TIMEOUT_SECONDS),
+        limit_per_host=SETTINGS.HTTP_LIMIT_PER_HOST,
+    ),
+}
+
+
+class _SessionStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self.requests += 1
+
+        async def on_request_exception(session, ctx, params):
+            self.errors += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self.connections_created += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.connections_reused += 1
+
+        async def on_dns_cache_hit(session, ctx, params):
+            self.dns_cache_hits += 1
+
+        async def on_dns_cache_miss(session, ctx, params):
+            self.dns_cache_misses += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace
+
+
+class HttpSessions:
+    """
+    One long-lived aiohttp session per profile, so outbound calls reuse pooled keep-alive connections
+    and cached DNS instead of paying DNS, TCP and TLS setup per call.
+
+    Sessions are opened on first use in the running loop and closed by close() at shutdown.
+    They are shared: callers must not close them or change their state (cookies are not kept).
+    """
+
+    def __init__(self):
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+        self._loops: dict[str, asyncio.AbstractEventLoop] = {}
+        self._stats: dict[str, _SessionStats] = {}
+
+    def get(self, name: str = "default") -> aiohttp.ClientSession:
+        session = self._sessions.get(name)
+        # a session is bound to the loop it was opened in, scripts may run several loops in turn
+        if session is None or session.closed or self._loops[name] is not asyncio.get_running_loop():
+            session = self._open(name)
+        return session
+
+    def _open(self, name: str) -> aiohttp.ClientSession:
+        profile = PROFILES[name]
+        stats = self._stats.setdefault(name, _SessionStats())
+        connector = aiohttp.TCPConnector(
+            limit=SETTINGS.HTTP_LIMIT,
+            limit_per_host=profile.limit_per_host,
+            ttl_dns_cache=SETTINGS.HTTP_DNS_CACHE_SECONDS,
+            keepalive_timeout=SETTINGS.HTTP_KEEPALIVE_SECONDS,
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=profile.timeout,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            trace_configs=[stats.trace_config()],
+        )
+        self._sessions[name] = session
+        self._loops[name] = asyncio.get_running_loop()
+        logger.info(f"HTTP session {name} opened")
+        return session
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, {}
+        self._loops.clear()
+        for session in sessions.values():
+            await session.close()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        ret = {}
+        for name, stats in self._stats.items():
+            ret[name] = dict(vars(stats))
+            session = self._sessions.get(name)
+            connector = session.connector if session and not session.closed else None
+            if connector is not None:
+                # aiohttp has no public accessors for pool occupancy
+                ret[name]["in_use"] = len(getattr(connector, "_acquired", ()))
+                ret[name]["idle"] = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+                ret[name]["limit"] = connector.limit
+                ret[name]["limit_per_host"] = connector.limit_per_host
+        return ret
+
+
+HTTP = HttpSessions()
+
+
+def http_session(name: str = "default") -> aiohttp.ClientSession:
+    """The shared session of profile `name` in PROFILES"""
+    return HTTP.get(name)
@@ -0,0 +1,162 @@
+import asyncio
+import base64
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from config import SETTINGS
+from infra.http import http_session
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedImage:
+    data: bytes
+    etag: str | None
+    last_modified: str | None
+    fetched_at: float  # monotonic, when the server last confirmed the content
+    data_uri: str | None = None  # memoized by ImageCache.data_uri()
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + len(self.data_uri or "")
+
+
+class ImageCache:
+    """
+    In-process LRU of fetched images by URL, bounded by the bytes it holds (data URIs included).
+
+    Entries are served without a request for `ttl` seconds, then revalidated with their ETag or
+    Last-Modified: a 304 keeps the bytes and the memoized data URI, new content replaces both.
+    Concurrent fetches of one URL share a single download. Images larger than `max_entry_bytes`
+    are returned but not kept. Cached bytes are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_bytes: int = SETTINGS.IMAGE_CACHE_MAX_BYTES,
+                 max_entry_bytes: int = SETTINGS.IMAGE_CACHE_MAX_ENTRY_BYTES,
+                 ttl: float = SETTINGS.IMAGE_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[str, CachedImage] = OrderedDict()
+        self._bytes = 0
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    async def get(self, url: str) -> CachedImage:
+        entry = self._entries.get(url)
+        if entry is not None and time.monotonic() - entry.fetched_at < self.ttl:
+            self.hits += 1
+            self._entries.move_to_end(url)
+            return entry
+
+        inflight = self._inflight.get(url)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # the fetching request was cancelled, not this one: fetch again
+                if inflight.cancelled() and not asyncio.current_task().cancelling():
+                    return await self.get(url)
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        try:
+            entry = await self._fetch(url, entry)
+            future.set_result(entry)
+            return entry
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # nobody may be waiting, don't log "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(url, None)
+
+    async def get_bytes(self, url: str) -> bytes:
+        return (await self.get(url)).data
+
+    async def data_uri(self, url: str) -> str:
+        """The image as a base64 data URI, encoded once per cached content"""
+        entry = await self.get(url)
+        if entry.data_uri is None:
+            entry.data_uri = "data:image/png;base64," + base64.b64encode(entry.data).decode("utf-8")
+            if self._entries.get(url) is entry:
+                self._bytes += len(entry.data_uri)
+                self._evict()
+        return entry.data_uri
+
+    async def _fetch(self, url: str, stale: CachedImage | None) -> CachedImage:
+        headers = {}
+        if stale is not None:
+            if stale.etag:
+                headers["If-None-Match"] = stale.etag
+            if stale.last_modified:
+                headers["If-Modified-Since"] = stale.last_modified
+
+        async with http_session("stream").get(url, headers=headers) as response:
+            if response.status == 304 and stale is not None:
+                self.revalidated += 1
+                stale.fetched_at = time.monotonic()
+                if self._entries.get(url) is stale:
+                    self._entries.move_to_end(url)
+                return stale
+            response.raise_for_status()
+            data = await response.read()
+            entry = CachedImage(
+                data=data,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                fetched_at=time.monotonic(),
+            )
+
+        self.misses += 1
+        self._remove(url)
+        if entry.nbytes <= self.max_entry_bytes:
+            self._entries[url] = entry
+            self._bytes += entry.nbytes
+            self._evict()
+        else:
+            logger.info(f"Not caching {url}, {entry.nbytes} bytes is over the entry limit")
+        return entry
+
+    def _remove(self, url: str):
+        entry = self._entries.pop(url, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+
+IMAGES = ImageCache()
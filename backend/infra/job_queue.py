@@ -0,0 +1,241 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import uuid
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Any, Awaitable, Callable, Optional
+
+from pymongo import ReturnDocument
+
+from config import SETTINGS
+from infra.db import jobs_col
+
+logger = logging.getLogger(__name__)
+
+JobFn = Callable[[dict[str, Any]], Awaitable[None]]
+
+
+class JobStatus(StrEnum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class JobHandler:
+    fn: JobFn
+    on_failure: Optional[JobFn] = None
+    on_heartbeat: Optional[JobFn] = None
+
+
+_HANDLERS: dict[str, JobHandler] = {}
+
+
+def job_handler(name: str, on_failure: Optional[JobFn] = None, on_heartbeat: Optional[JobFn] = None):
+    """
+    Register a coroutine as the handler for jobs named `name`. A handler fails an attempt by raising,
+    the job is then retried with backoff.
+
+    :param name: Job name used by enqueue_job.
+    :param on_failure: Called with the payload once the job has exhausted its attempts.
+    :param on_heartbeat: Called with the payload when an attempt starts and each time its lease is extended,
+        e.g. to keep a lock held for as long as the job runs.
+    """
+
+    def decorator(fn: JobFn) -> JobFn:
+        _HANDLERS[name] = JobHandler(fn=fn, on_failure=on_failure, on_heartbeat=on_heartbeat)
+        return fn
+
+    return decorator
+
+
+async def enqueue_job(name: str, payload: dict[str, Any], max_attempts: int = None, delay_seconds: int = 0) -> str:
+    """
+    Persist a job so any worker process can claim it.
+
+    :return: job_id
+    """
+    now = datetime.datetime.now()
+    job_id = str(uuid.uuid4())
+    await jobs_col.insert_one({
+        "job_id": job_id,
+        "name": name,
+        "payload": payload,
+        "status": JobStatus.PENDING,
+        "attempts": 0,
+        "max_attempts": max_attempts or SETTINGS.JOB_MAX_ATTEMPTS,
+        "available_at": now + datetime.timedelta(seconds=delay_seconds),
+        "lease_until": None,
+        "worker_id": None,
+        "last_error": None,
+        "created_at": now,
+        "updated_at": now,
+    })
+    logger.info(f"M enqueue job {name} {job_id}")
+    return job_id
+
+
+async def claim_job(worker_id: str, lease_seconds: int) -> dict | None:
+    """
+    Atomically claim the oldest runnable job: a pending job that is due, or a running job whose lease expired.
+    """
+    now = datetime.datetime.now()
+    return await jobs_col.find_one_and_update(
+        {
+            "name": {"$in": list(_HANDLERS.keys())},
+            "$or": [
+                {"status": JobStatus.PENDING, "available_at": {"$lte": now}},
+                {"status": JobStatus.RUNNING, "lease_until": {"$lt": now}},
+            ],
+        },
+        {
+            "$set": {
+                "status": JobStatus.RUNNING,
+                "worker_id": worker_id,
+                "lease_until": now + datetime.timedelta(seconds=lease_seconds),
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("available_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def extend_lease(job_id: str, worker_id: str, lease_seconds: int) -> bool:
+    now = datetime.datetime.now()
+    ret = await jobs_col.update_one(
+        {"job_id": job_id, "worker_id": worker_id, "status": JobStatus.RUNNING},
+        {"$set": {"lease_until": now + datetime.timedelta(seconds=lease_seconds), "updated_at": now}},
+    )
+    return ret.modified_count > 0
+
+
+async def complete_job(job_id: str, worker_id: str):
+    now = datetime.datetime.now()
+    await jobs_col.update_one(
+        {"job_id": job_id, "worker_id": worker_id},
+        {"$set": {"status": JobStatus.DONE, "lease_until": None, "updated_at": now, "finished_at": now}},
+    )
+
+
+async def fail_job(job: dict, worker_id: str, error: str) -> bool:
+    """
+    Schedule a retry with exponential backoff, or mark the job failed once attempts are exhausted.
+
+    :return: True if the job will be retried.
+    """
+    now = datetime.datetime.now()
+    if job["attempts"] < job["max_attempts"]:
+        backoff = min(SETTINGS.JOB_RETRY_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1),
+                      SETTINGS.JOB_RETRY_BACKOFF_MAX_SECONDS)
+        update = {
+            "status": JobStatus.PENDING,
+            "available_at": now + datetime.timedelta(seconds=backoff),
+        }
+    else:
+        update = {"status": JobStatus.FAILED, "finished_at": now}
+    update.update({"lease_until": None, "last_error": error, "updated_at": now})
+    await jobs_col.update_one({"job_id": job["job_id"], "worker_id": worker_id}, {"$set": update})
+    return update["status"] == JobStatus.PENDING
+
+
+class JobWorker:
+    """Drains the job collection with a fixed number of concurrent slots"""
+
+    def __init__(self,
+                 concurrency: int = SETTINGS.JOB_WORKER_CONCURRENCY,
+                 poll_interval: float = SETTINGS.JOB_POLL_INTERVAL_SECONDS,
+                 lease_seconds: int = SETTINGS.JOB_LEASE_SECONDS):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.is_running = False
+        self._loops: list[asyncio.Task] = []
+
+    async def start(self):
+        if self.is_running:
+            logger.warning("Job worker is already running")
+            return
+
+        self.is_running = True
+        self._loops = [asyncio.create_task(self._loop()) for _ in range(self.concurrency)]
+        logger.info(f"Job worker {self.worker_id} started with {self.concurrency} slots, "
+                    f"handlers: {sorted(_HANDLERS.keys())}")
+
+    async def stop(self, grace_seconds: float = 30):
+        """Stop claiming new jobs and wait for in-flight ones; unfinished jobs are re-claimed after lease expiry"""
+        if not self.is_running:
+            return
+
+        self.is_running = False
+        done, pending = await asyncio.wait(self._loops, timeout=grace_seconds)
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._loops = []
+        logger.info(f"Job worker {self.worker_id} stopped")
+
+    async def _loop(self):
+        while self.is_running:
+            try:
+                job = await claim_job(self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Error claiming job: {e}", exc_info=True)
+                job = None
+
+            if not job:
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            await self._run(job)
+
+    async def _heartbeat(self, job: dict, handler: JobHandler):
+        job_id = job["job_id"]
+        interval = max(self.lease_seconds / 3, 1)
+        while True:
+            if handler.on_heartbeat:
+                try:
+                    await handler.on_heartbeat(job["payload"])
+                except Exception as e:
+                    logger.error(f"Error in heartbeat hook of job {job_id}: {e}", exc_info=True)
+            await asyncio.sleep(interval)
+            try:
+                if not await extend_lease(job_id, self.worker_id, self.lease_seconds):
+                    logger.warning(f"M lost lease on job {job_id}")
+                    return
+            except Exception as e:
+                logger.error(f"Error extending lease of job {job_id}: {e}", exc_info=True)
+
+    async def _run(self, job: dict):
+        handler = _HANDLERS[job["name"]]
+        job_id = job["job_id"]
+        logger.info(f"M run job {job['name']} {job_id} attempt {job['attempts']}/{job['max_attempts']}")
+
+        heartbeat = asyncio.create_task(self._heartbeat(job, handler))
+        try:
+            if job["attempts"] > job["max_attempts"]:
+                # the previous owners died mid-run and used up every attempt
+                raise RuntimeError("lease expired after last attempt")
+            await handler.fn(job["payload"])
+            await complete_job(job_id, self.worker_id)
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"M job {job['name']} {job_id} error: {e}", exc_info=True)
+            error = str(e)
+        finally:
+            heartbeat.cancel()
+
+        try:
+            retry = await fail_job(job, self.worker_id, error)
+            if not retry and handler.on_failure:
+                await handler.on_failure(job["payload"])
+        except Exception as e:
+            logger.error(f"Error failing job {job_id}: {e}", exc_info=True)
@@ -0,0 +1,131 @@
+import logging
+from dataclasses import dataclass
+
+import redis
+
+from config import SETTINGS
+from infra.redis_cache import ASYNC_REDIS
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] lock, KEYS[2] fence counter; ARGV[1] lock ttl milliseconds, ARGV[2] fence ttl seconds
+# the counter expires once a name has been idle for the fence ttl; it restarts from the current time
+# in milliseconds, above any token handed out before, so every holder still gets a larger token
+_ACQUIRE_LUA = """
+if redis.replicate_commands then redis.replicate_commands() end
+local holder = redis.call('GET', KEYS[1])
+if holder then
+    return {0, tonumber(holder)}
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    local now = redis.call('TIME')
+    redis.call('SET', KEYS[2], now[1] .. string.format('%03d', math.floor(now[2] / 1000)))
+end
+local token = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+redis.call('SET', KEYS[1], token, 'PX', ARGV[1])
+return {1, token}
+"""
+
+# KEYS[1] lock; ARGV token
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS[1] lock, KEYS[2] fence counter; ARGV[1] token, ARGV[2] lock ttl milliseconds
+# a lock that expired is taken back while no later token has been handed out
+_EXTEND_LUA = """
+local holder = redis.call('GET', KEYS[1])
+if holder == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+if not holder and tonumber(redis.call('GET', KEYS[2]) or 0) <= tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+_acquire = ASYNC_REDIS.client.register_script(_ACQUIRE_LUA)
+_release = ASYNC_REDIS.client.register_script(_RELEASE_LUA)
+_extend = ASYNC_REDIS.client.register_script(_EXTEND_LUA)
+
+# token of a lock taken while Redis was unavailable, it is always current
+UNFENCED = 0
+
+
+@dataclass(frozen=True)
+class Lock:
+    name: str
+    token: int
+    acquired: bool  # False: another holder has it, `token` is theirs
+
+
+def _lock_key(name: str) -> str:
+    return f"{SETTINGS.REDIS_PREFIX}.lock.{name}"
+
+
+def _fence_key(name: str) -> str:
+    return f"{SETTINGS.REDIS_PREFIX}.fence.{name}"
+
+
+async def acquire_lock(name: str, ttl_seconds: int,
+                       fence_ttl_seconds: int = SETTINGS.LOCK_FENCE_TTL_SECONDS) -> Lock:
+    """
+    Take the lock `name` for every process sharing Redis, or report the current holder.
+
+    Each acquisition gets a fencing token larger than any before it: work started under a lock that
+    has since expired and been re-taken can tell with is_current() and must not write its results.
+    The fence counter is kept for `fence_ttl_seconds` after the last acquisition, which must outlast
+    any work started under the lock. Fails open: if Redis is unavailable the lock is acquired with
+    the UNFENCED token.
+    """
+    try:
+        acquired, token = await _acquire(keys=[_lock_key(name), _fence_key(name)],
+                                         args=[ttl_seconds * 1000, fence_ttl_seconds])
+    except redis.RedisError as e:
+        logger.error(f"Lock service unavailable, proceeding without {name}: {e}", exc_info=True)
+        return Lock(name=name, token=UNFENCED, acquired=True)
+    return Lock(name=name, token=int(token), acquired=bool(acquired))
+
+
+async def release_lock(name: str, token: int) -> bool:
+    """Release the lock if `token` still holds it; a later holder's lock is left alone"""
+    if token == UNFENCED:
+        return False
+    try:
+        return bool(await _release(keys=[_lock_key(name)], args=[token]))
+    except redis.RedisError as e:
+        logger.error(f"Error releasing lock {name}: {e}", exc_info=True)
+        return False
+
+
+async def extend_lock(name: str, token: int, ttl_seconds: int) -> bool:
+    """
+    Keep holding the lock for another `ttl_seconds`, for work outlasting the ttl it was acquired with.
+    False once a later token has taken it; like is_current, True if Redis is unavailable.
+    """
+    if token == UNFENCED:
+        return True
+    try:
+        return bool(await _extend(keys=[_lock_key(name), _fence_key(name)], args=[token, ttl_seconds * 1000]))
+    except redis.RedisError as e:
+        logger.error(f"Error extending lock {name}: {e}", exc_info=True)
+        return True
+
+
+async def is_current(name: str, token: int) -> bool:
+    """
+    False once the lock `name` has been acquired again after `token`, True if it is unknown (fails open).
+    """
+    if token == UNFENCED:
+        return True
+    try:
+        latest = await ASYNC_REDIS.client.get(_fence_key(name))
+    except redis.RedisError as e:
+        logger.error(f"Error reading fence of {name}: {e}", exc_info=True)
+        return True
+    return latest is None or int(latest) <= token
@@ -0,0 +1,31 @@
+import asyncio
+
+from infra.db import profiles_col, points_ledger_col
+
+
+async def m_v2():
+    """Move profiles.points_details into the points_ledger collection"""
+    cursor = profiles_col.find({"points_details": {"$exists": True}}, {"tenant_id": 1, "points_details": 1})
+    async for doc in cursor:
+        details = doc.get("points_details") or []
+        print(doc["tenant_id"], len(details))
+
+        # rows are tagged with their profile, so a re-run after a crash before the $unset replaces them instead of
+        # duplicating them; rows add_points appended meanwhile are left alone
+        await points_ledger_col.delete_many({"tenant_id": doc["tenant_id"], "migrated_from": doc["_id"]})
+        if details:
+            await points_ledger_col.insert_many([
+                {
+                    "tenant_id": doc["tenant_id"],
+                    "points": d.get("points", 0),
+                    "type": d.get("type", "add"),
+                    "remark": d.get("remark", ""),
+                    "created_at": d["created_at"],
+                    "migrated_from": doc["_id"],
+                }
+                for d in details
+            ])
+        await profiles_col.update_one({"_id": doc["_id"]}, {"$unset": {"points_details": ""}})
+
+
+asyncio.run(m_v2())
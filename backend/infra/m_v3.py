@@ -0,0 +1,63 @@
+import asyncio
+import datetime
+
+from infra.db import aigc_task_col, aigc_task_history_col
+
+
+def _archive_docs(doc: dict, name: str, sub_task: dict, archived_at: datetime.datetime) -> list[dict]:
+    history = sub_task.get("history") or []
+    # history is newest first, offset archived_at so the archive keeps the same order
+    return [
+        {
+            "task_id": doc["task_id"],
+            "sub_task": name,
+            "data": h,
+            "archived_at": archived_at - datetime.timedelta(microseconds=i),
+            "migrated_from": doc["_id"],
+        }
+        for i, h in enumerate(history)
+    ]
+
+
+async def m_v3():
+    """Move embedded SubTask.history arrays into aigc_task_history and keep only history_count inline"""
+    now = datetime.datetime.now()
+    cursor = aigc_task_col.find({})
+    async for doc in cursor:
+        print(doc["task_id"])
+
+        docs, update, unset, array_filters = [], {}, {}, []
+        for name in ("cover", "lyrics", "music", "audio"):
+            sub_task = doc.get(name)
+            if sub_task and "history" in sub_task:
+                docs += _archive_docs(doc, name, sub_task, now)
+                update[f"{name}.history_count"] = len(sub_task["history"] or [])
+                unset[f"{name}.history"] = ""
+
+        # only the history fields of each video are touched, jobs may be updating the rest meanwhile
+        for i, video in enumerate(doc.get("videos") or []):
+            if "history" in video:
+                key = video["input"]["key"]
+                docs += _archive_docs(doc, f"videos.{key}", video, now)
+                update[f"videos.$[v{i}].history_count"] = len(video["history"] or [])
+                unset[f"videos.$[v{i}].history"] = ""
+                array_filters.append({f"v{i}.input.key": key})
+
+        if not update:
+            continue
+        # rows left by a run that crashed before the update below are replaced, not duplicated
+        await aigc_task_history_col.delete_many({
+            "task_id": doc["task_id"],
+            "sub_task": {"$in": list({d["sub_task"] for d in docs})},
+            "migrated_from": doc["_id"],
+        })
+        if docs:
+            await aigc_task_history_col.insert_many(docs)
+        await aigc_task_col.update_one(
+            {"_id": doc["_id"]},
+            {"$set": update, "$unset": unset},
+            array_filters=array_filters or None,
+        )
+
+
+asyncio.run(m_v3())
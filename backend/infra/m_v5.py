@@ -0,0 +1,78 @@
+import asyncio
+
+from infra.db import INDEX_REGISTRY, db, profiles_col, resource_usage_col, xapi_user_col
+
+
+async def _duplicates(col, fields: list[str], partial: dict | None = None) -> list[list[dict]]:
+    """Documents sharing a value of `fields`, oldest first within each group"""
+    match = partial or {}
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": {f: f"${f}" for f in fields}, "docs": {"$push": "$$ROOT"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ]
+    return [group["docs"] async for group in col.aggregate(pipeline, allowDiskUse=True)]
+
+
+async def _merge_resource_usage():
+    # concurrent upserts each counted their own request, so the usage is the sum
+    for docs in await _duplicates(resource_usage_col, ["client", "resource"]):
+        keep, rest = docs[0], docs[1:]
+        print("resource_usage", keep["client"], keep["resource"], len(rest))
+        await resource_usage_col.update_one({"_id": keep["_id"]},
+                                            {"$inc": {"count": sum(d.get("count", 0) for d in rest)}})
+        await resource_usage_col.delete_many({"_id": {"$in": [d["_id"] for d in rest]}})
+
+
+async def _merge_profiles():
+    # points were $inc'ed into whichever duplicate matched, so they add up; follows are merged
+    for docs in await _duplicates(profiles_col, ["tenant_id"]):
+        keep, rest = docs[0], docs[1:]
+        print("profiles", keep["tenant_id"], len(rest))
+        follows = [i for d in rest for i in d.get("follow_digital_human_ids") or []]
+        await profiles_col.update_one(
+            {"_id": keep["_id"]},
+            {
+                "$inc": {"total_points": sum(d.get("total_points", 0) for d in rest)},
+                "$addToSet": {"follow_digital_human_ids": {"$each": follows}},
+            },
+        )
+        await profiles_col.delete_many({"_id": {"$in": [d["_id"] for d in rest]}})
+
+
+async def _merge_xapi_users():
+    # cached copies of the same X user, any one will do: keep the last inserted
+    for docs in await _duplicates(xapi_user_col, ["id"]):
+        print("xapi_user", docs[-1]["id"], len(docs) - 1)
+        await xapi_user_col.delete_many({"_id": {"$in": [d["_id"] for d in docs[:-1]]}})
+
+
+async def _check_unique_indexes() -> int:
+    """Print the duplicates left for every unique index in INDEX_REGISTRY; init_indexes() refuses to start on them"""
+    left = 0
+    for name, indexes in INDEX_REGISTRY.items():
+        for index in indexes:
+            doc = index.document
+            if not doc.get("unique"):
+                continue
+            fields = list(doc["key"].keys())
+            partial = doc.get("partialFilterExpression")
+            if doc.get("sparse") and not partial:
+                partial = {"$or": [{f: {"$exists": True}} for f in fields]}
+            for docs in await _duplicates(db[name], fields, partial):
+                left += 1
+                print(f"DUPLICATE {name} {doc['name']}: {[str(d['_id']) for d in docs]}")
+    return left
+
+
+async def m_v5():
+    """De-duplicate the collections whose keys became unique indexes, then check every unique index"""
+    await _merge_resource_usage()
+    await _merge_profiles()
+    await _merge_xapi_users()
+    left = await _check_unique_indexes()
+    print(f"{left} duplicate groups left to resolve by hand")
+
+
+asyncio.run(m_v5())
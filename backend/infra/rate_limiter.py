@@ -0,0 +1,82 @@
+import logging
+import uuid
+from dataclasses import dataclass
+from enum import StrEnum
+
+import redis
+
+from config import SETTINGS
+from infra.redis_cache import ASYNC_REDIS
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] counter; ARGV limit, window seconds (0 = never resets), cost
+# the counter only moves when the request is allowed, so rejections don't eat into the quota
+_FIXED_WINDOW_LUA = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local count = tonumber(redis.call('GET', KEYS[1]) or '0')
+if count + cost > limit then
+    return {0, count}
+end
+count = redis.call('INCRBY', KEYS[1], cost)
+if window > 0 and redis.call('TTL', KEYS[1]) < 0 then
+    redis.call('EXPIRE', KEYS[1], window)
+end
+return {1, count}
+"""
+
+# KEYS[1] zset of request timestamps; ARGV limit, window milliseconds, unique member
+# uses the server clock so app servers with skewed clocks share one window
+_SLIDING_WINDOW_LUA = """
+if redis.replicate_commands then redis.replicate_commands() end
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+if count >= limit then
+    return {0, count}
+end
+redis.call('ZADD', KEYS[1], now, ARGV[3])
+redis.call('PEXPIRE', KEYS[1], window)
+return {1, count + 1}
+"""
+
+_fixed_window = ASYNC_REDIS.client.register_script(_FIXED_WINDOW_LUA)
+_sliding_window = ASYNC_REDIS.client.register_script(_SLIDING_WINDOW_LUA)
+
+
+class RateLimitAlgorithm(StrEnum):
+    FIXED = "fixed"
+    SLIDING = "sliding"
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    limit: int
+    window_seconds: int = 0  # 0 with FIXED counts for the lifetime of the key, callers keep durable quotas elsewhere
+    algorithm: RateLimitAlgorithm = RateLimitAlgorithm.FIXED
+
+
+async def acquire(client: str, resource: str, rule: RateLimit) -> tuple[bool, int]:
+    """
+    Atomically check and consume one unit of `resource` for `client` in a single Redis round trip.
+
+    Fails open: if Redis is unavailable the request is allowed.
+
+    :return: (allowed, count in the current window)
+    """
+    key = f"{SETTINGS.REDIS_PREFIX}.rl.{resource}.{client}"
+    try:
+        if rule.algorithm == RateLimitAlgorithm.SLIDING and rule.window_seconds > 0:
+            allowed, count = await _sliding_window(
+                keys=[key], args=[rule.limit, rule.window_seconds * 1000, uuid.uuid4().hex])
+        else:
+            allowed, count = await _fixed_window(keys=[key], args=[rule.limit, rule.window_seconds, 1])
+    except redis.RedisError as e:
+        logger.error(f"Rate limiter unavailable, allowing {client} {resource}: {e}", exc_info=True)
+        return True, 0
+    return bool(allowed), int(count)
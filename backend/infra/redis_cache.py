@@ -1,23 +1,51 @@
-import json
 import logging
 from datetime import datetime
-from typing import Any, Optional, List, Dict
+from typing import Any, Optional, List, Dict, AsyncIterator, Iterable, Iterator
 
 import redis
+import redis.asyncio
 
-from common.json_encoder import UniversalEncoder, universal_decoder
+from common.codec import Codec, get_codec
 from config import SETTINGS
 
 logger = logging.getLogger(__name__)
 
+SCAN_COUNT = 1000  # keys examined per SCAN step
+UNLINK_CHUNK_SIZE = 500  # keys per UNLINK command, several commands share one pipeline round trip
+UNLINK_CHUNKS_PER_PIPELINE = 10
+
+
+def _chunks(keys: Iterable[str], size: int) -> Iterator[list[str]]:
+    chunk = []
+    for key in keys:
+        chunk.append(key)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def datetime_serializer(obj):
     if isinstance(obj, datetime):
         return obj.isoformat()
     raise TypeError("Type not serializable")
 
+
+def _load_hash_value(codec: Codec, raw: bytes) -> Any:
+    """
+    Decode a hash value with the codec. Hashes written before the codec, through hmset, hold plain strings:
+    those that don't parse come back as the stored string, those that do (e.g. "42") come back parsed.
+    """
+    try:
+        return codec.loads(raw)
+    except ValueError:
+        return raw.decode()
+
+
 class RedisUtils:
     def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0, password: Optional[str] = None,
-                 ssl=False):
+                 ssl=False, codec: Optional[Codec] = None):
         """
         Initialize the Redis connection.
 
@@ -25,6 +53,7 @@ class RedisUtils:
         :param port: Redis server port.
         :param db: Redis database index.
         :param password: Redis password (if required).
+        :param codec: Serializer for list and hash values (default: SETTINGS.REDIS_CODEC).
         """
         self.client = redis.StrictRedis(
             host=host,
@@ -34,6 +63,16 @@ class RedisUtils:
             decode_responses=True,
             ssl=ssl
         )
+        # codec values may be binary, so they go through a client that returns raw bytes
+        self.raw_client = redis.StrictRedis(
+            host=host,
+            port=port,
+            db=db,
+            password=password,
+            decode_responses=False,
+            ssl=ssl
+        )
+        self.codec = codec or get_codec(SETTINGS.REDIS_CODEC)
 
     def set_value(self, key: str, value: Any, ex: Optional[int] = None) -> bool:
         """
@@ -86,8 +125,8 @@ class RedisUtils:
         :param ttl: Time to live in seconds (default 5 days).
         """
         try:
-            serialized_value = json.dumps(value, cls=UniversalEncoder)  # Serialize to JSON
-            pipe = self.client.pipeline()
+            serialized_value = self.codec.dumps(value)
+            pipe = self.raw_client.pipeline()
             pipe.rpush(key, serialized_value)
             if ttl:
                 pipe.expire(key, ttl)
@@ -107,12 +146,12 @@ class RedisUtils:
         :return: List of deserialized elements.
         """
         try:
-            raw_list = self.client.lrange(key, start, end)
-            return [json.loads(item, object_hook=universal_decoder) for item in raw_list]  # Deserialize JSON
+            raw_list = self.raw_client.lrange(key, start, end)
+            return [self.codec.loads(item) for item in raw_list]
         except redis.RedisError as e:
             logger.error(f"Error getting list: {e}", exc_info=True)
             return []
-        except json.JSONDecodeError as e:
+        except ValueError as e:
             logger.error(f"Error deserializing list: {e}", exc_info=True)
             return []
 
@@ -121,11 +160,12 @@ class RedisUtils:
         Set multiple fields in a Redis hash.
 
         :param key: Key name.
-        :param mapping: Dictionary of field-value pairs.
+        :param mapping: Dictionary of field-value pairs, values are serialized with the codec.
         :return: True if successful, False otherwise.
         """
         try:
-            return self.client.hmset(key, mapping)
+            self.raw_client.hset(key, mapping={k: self.codec.dumps(v) for k, v in mapping.items()})
+            return True
         except redis.RedisError as e:
             logger.error(f"Error setting hash: {e}", exc_info=True)
             return False
@@ -138,10 +178,14 @@ class RedisUtils:
         :return: Dictionary of field-value pairs, or None if the hash does not exist.
         """
         try:
-            return self.client.hgetall(key)
+            raw = self.raw_client.hgetall(key)
+            return {k.decode(): _load_hash_value(self.codec, v) for k, v in raw.items()}
         except redis.RedisError as e:
             logger.error(f"Error getting hash: {e}", exc_info=True)
             return None
+        except ValueError as e:
+            logger.error(f"Error deserializing hash: {e}", exc_info=True)
+            return None
 
     def add_to_set(self, key: str, *values: Any) -> int:
         """
@@ -170,35 +214,66 @@ class RedisUtils:
             logger.error(f"Error getting set members: {e}", exc_info=True)
             return None
 
+    def scan_keys(self, pattern: str, count: int = SCAN_COUNT) -> Iterator[str]:
+        """
+        Iterate over keys matching a pattern with SCAN, a bounded amount of work per server call.
+
+        :param pattern: Pattern to match (e.g., "prefix:*").
+        :param count: Hint for the number of keys examined per SCAN step.
+        :raises redis.RedisError: If a SCAN step fails, after the keys already yielded.
+        """
+        yield from self.client.scan_iter(match=pattern, count=count)
+
     def get_keys_by_pattern(self, pattern: str) -> List[str]:
         """
         Get all keys matching a pattern.
 
         :param pattern: Pattern to match (e.g., "prefix:*").
-        :return: List of matching keys.
+        :return: List of matching keys, empty if the scan failed.
         """
         try:
-            return self.client.keys(pattern)
+            return list(self.scan_keys(pattern))
         except redis.RedisError as e:
             logger.error(f"Error getting keys by pattern: {e}", exc_info=True)
             return []
 
-    def delete_keys(self, keys: List[str]) -> int:
+    def delete_keys(self, keys: Iterable[str]) -> int:
         """
-        Delete multiple keys from Redis.
+        Delete multiple keys from Redis with chunked, pipelined UNLINK; memory is reclaimed off the main thread.
 
-        :param keys: List of keys to delete.
+        :param keys: Keys to delete.
         :return: Number of keys removed.
         """
-        if not keys:
-            return 0
-            
         try:
-            return self.client.delete(*keys)
+            return self._unlink(keys)
         except redis.RedisError as e:
             logger.error(f"Error deleting multiple keys: {e}", exc_info=True)
             return 0
 
+    def _unlink(self, keys: Iterable[str]) -> int:
+        removed = 0
+        pipe = self.client.pipeline(transaction=False)
+        for i, chunk in enumerate(_chunks(keys, UNLINK_CHUNK_SIZE), start=1):
+            pipe.unlink(*chunk)
+            if i % UNLINK_CHUNKS_PER_PIPELINE == 0:
+                removed += sum(pipe.execute())
+        removed += sum(pipe.execute())
+        return removed
+
+    def delete_keys_by_pattern(self, pattern: str) -> int:
+        """
+        Delete every key matching a pattern while scanning, without holding the whole key list.
+
+        :param pattern: Pattern to match (e.g., "prefix:*").
+        :return: Number of keys removed.
+        :raises redis.RedisError: If the scan or a delete fails part way, some keys may be left.
+        """
+        try:
+            return self._unlink(self.scan_keys(pattern))
+        except redis.RedisError as e:
+            logger.error(f"Error deleting keys by pattern {pattern}: {e}", exc_info=True)
+            raise
+
     def set_expiry(self, key: str, seconds: int) -> bool:
         """
         Set expiration time for a key.
@@ -227,6 +302,318 @@ class RedisUtils:
             logger.error(f"Error removing from set: {e}", exc_info=True)
             return 0
 
+    def incr(self, key: str, amount: int = 1) -> Optional[int]:
+        """
+        Increment an integer value.
+
+        :param key: Key name.
+        :param amount: Amount to add.
+        :return: Value after the increment, or None on error.
+        """
+        try:
+            return self.client.incr(key, amount)
+        except redis.RedisError as e:
+            logger.error(f"Error incrementing key: {e}", exc_info=True)
+            return None
+
+
+class AsyncRedisUtils:
+    """
+    Same API as RedisUtils on redis.asyncio, so calls never block the event loop.
+
+    All instances created from one pool share its connections.
+    """
+
+    def __init__(self, pool: redis.asyncio.ConnectionPool, raw_pool: redis.asyncio.ConnectionPool,
+                 codec: Optional[Codec] = None):
+        """
+        :param pool: Pool of connections that decode responses to str.
+        :param raw_pool: Pool of connections returning bytes, used for codec-serialized list and hash values.
+        :param codec: Serializer for list and hash values (default: SETTINGS.REDIS_CODEC).
+        """
+        self.pool = pool
+        self.raw_pool = raw_pool
+        self.client = redis.asyncio.StrictRedis(connection_pool=pool)
+        self.raw_client = redis.asyncio.StrictRedis(connection_pool=raw_pool)
+        self.codec = codec or get_codec(SETTINGS.REDIS_CODEC)
+
+    @classmethod
+    def from_settings(cls) -> "AsyncRedisUtils":
+        kwargs = dict(
+            host=SETTINGS.REDIS_HOST,
+            port=SETTINGS.REDIS_PORT,
+            db=SETTINGS.REDIS_DB,
+            password=SETTINGS.REDIS_PASSWORD,
+            decode_responses=True,
+            max_connections=SETTINGS.REDIS_MAX_CONNECTIONS,
+            socket_timeout=SETTINGS.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=SETTINGS.REDIS_SOCKET_CONNECT_TIMEOUT,
+            health_check_interval=SETTINGS.REDIS_HEALTH_CHECK_INTERVAL,
+            retry_on_timeout=True,
+        )
+        if SETTINGS.REDIS_SSL:
+            kwargs["connection_class"] = redis.asyncio.SSLConnection
+        return cls(redis.asyncio.ConnectionPool(**kwargs),
+                   redis.asyncio.ConnectionPool(**{**kwargs, "decode_responses": False}))
+
+    async def close(self) -> None:
+        """Close the client and disconnect every pooled connection"""
+        await self.client.aclose()
+        await self.raw_client.aclose()
+        await self.pool.aclose()
+        await self.raw_pool.aclose()
+
+    async def set_value(self, key: str, value: Any, ex: Optional[int] = None) -> bool:
+        """
+        Set a value in Redis.
+
+        :param key: Key name.
+        :param value: Value to set.
+        :param ex: Expiration time in seconds (optional).
+        :return: True if successful, False otherwise.
+        """
+        try:
+            return await self.client.set(key, value, ex=ex)
+        except redis.RedisError as e:
+            logger.error(f"Error setting value: {e}", exc_info=True)
+            return False
+
+    async def get_value(self, key: str) -> Optional[Any]:
+        """
+        Get a value from Redis.
+
+        :param key: Key name.
+        :return: Value if the key exists, None otherwise.
+        """
+        try:
+            return await self.client.get(key)
+        except redis.RedisError as e:
+            logger.error(f"Error getting value: {e}", exc_info=True)
+            return None
+
+    async def delete_key(self, key: str) -> int:
+        """
+        Delete a key from Redis.
+
+        :param key: Key name.
+        :return: Number of keys removed.
+        """
+        try:
+            return await self.client.delete(key)
+        except redis.RedisError as e:
+            logger.error(f"Error deleting key: {e}", exc_info=True)
+            return 0
+
+    async def push_to_list(self, key: str, value: Any, max_length: Optional[int] = None, ttl: int = None) -> None:
+        """
+        Push a serialized value to a list in Redis.
+
+        :param key: Key name.
+        :param value: Value to push (can be a structure).
+        :param max_length: Maximum length of the list (optional).
+        :param ttl: Time to live in seconds.
+        """
+        try:
+            serialized_value = self.codec.dumps(value)
+            async with self.raw_client.pipeline() as pipe:
+                pipe.rpush(key, serialized_value)
+                if ttl:
+                    pipe.expire(key, ttl)
+                if max_length is not None:
+                    pipe.ltrim(key, -max_length, -1)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.error(f"Error pushing to list: {e}", exc_info=True)
+
+    async def get_list(self, key: str, start: int = 0, end: int = -1) -> List[Any]:
+        """
+        Get a range of deserialized elements from a list in Redis.
+
+        :param key: Key name.
+        :param start: Start index (inclusive).
+        :param end: End index (inclusive).
+        :return: List of deserialized elements.
+        """
+        try:
+            raw_list = await self.raw_client.lrange(key, start, end)
+            return [self.codec.loads(item) for item in raw_list]
+        except redis.RedisError as e:
+            logger.error(f"Error getting list: {e}", exc_info=True)
+            return []
+        except ValueError as e:
+            logger.error(f"Error deserializing list: {e}", exc_info=True)
+            return []
+
+    async def set_hash(self, key: str, mapping: Dict[str, Any]) -> bool:
+        """
+        Set multiple fields in a Redis hash.
+
+        :param key: Key name.
+        :param mapping: Dictionary of field-value pairs, values are serialized with the codec.
+        :return: True if successful, False otherwise.
+        """
+        try:
+            await self.raw_client.hset(key, mapping={k: self.codec.dumps(v) for k, v in mapping.items()})
+            return True
+        except redis.RedisError as e:
+            logger.error(f"Error setting hash: {e}", exc_info=True)
+            return False
+
+    async def get_hash(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get all fields and values from a Redis hash.
+
+        :param key: Key name.
+        :return: Dictionary of field-value pairs, or None if the hash does not exist.
+        """
+        try:
+            raw = await self.raw_client.hgetall(key)
+            return {k.decode(): _load_hash_value(self.codec, v) for k, v in raw.items()}
+        except redis.RedisError as e:
+            logger.error(f"Error getting hash: {e}", exc_info=True)
+            return None
+        except ValueError as e:
+            logger.error(f"Error deserializing hash: {e}", exc_info=True)
+            return None
+
+    async def add_to_set(self, key: str, *values: Any) -> int:
+        """
+        Add one or more members to a set.
+
+        :param key: Key name.
+        :param values: Values to add.
+        :return: Number of elements added to the set.
+        """
+        try:
+            return await self.client.sadd(key, *values)
+        except redis.RedisError as e:
+            logger.error(f"Error adding to set: {e}", exc_info=True)
+            return 0
+
+    async def get_set_members(self, key: str) -> Optional[set]:
+        """
+        Get all members of a set.
+
+        :param key: Key name.
+        :return: Set of members, or None if the key does not exist.
+        """
+        try:
+            return await self.client.smembers(key)
+        except redis.RedisError as e:
+            logger.error(f"Error getting set members: {e}", exc_info=True)
+            return None
+
+    async def scan_keys(self, pattern: str, count: int = SCAN_COUNT) -> AsyncIterator[str]:
+        """
+        Iterate over keys matching a pattern with SCAN, a bounded amount of work per server call.
+
+        :param pattern: Pattern to match (e.g., "prefix:*").
+        :param count: Hint for the number of keys examined per SCAN step.
+        :raises redis.RedisError: If a SCAN step fails, after the keys already yielded.
+        """
+        async for key in self.client.scan_iter(match=pattern, count=count):
+            yield key
+
+    async def get_keys_by_pattern(self, pattern: str) -> List[str]:
+        """
+        Get all keys matching a pattern.
+
+        :param pattern: Pattern to match (e.g., "prefix:*").
+        :return: List of matching keys, empty if the scan failed.
+        """
+        try:
+            return [key async for key in self.scan_keys(pattern)]
+        except redis.RedisError as e:
+            logger.error(f"Error getting keys by pattern: {e}", exc_info=True)
+            return []
+
+    async def _unlink_chunks(self, chunks: list[list[str]]) -> int:
+        async with self.client.pipeline(transaction=False) as pipe:
+            for chunk in chunks:
+                pipe.unlink(*chunk)
+            return sum(await pipe.execute())
+
+    async def delete_keys(self, keys: Iterable[str]) -> int:
+        """
+        Delete multiple keys from Redis with chunked, pipelined UNLINK; memory is reclaimed off the main thread.
+
+        :param keys: Keys to delete.
+        :return: Number of keys removed.
+        """
+        removed = 0
+        try:
+            chunks = list(_chunks(keys, UNLINK_CHUNK_SIZE))
+            for i in range(0, len(chunks), UNLINK_CHUNKS_PER_PIPELINE):
+                removed += await self._unlink_chunks(chunks[i:i + UNLINK_CHUNKS_PER_PIPELINE])
+        except redis.RedisError as e:
+            logger.error(f"Error deleting multiple keys: {e}", exc_info=True)
+        return removed
+
+    async def delete_keys_by_pattern(self, pattern: str) -> int:
+        """
+        Delete every key matching a pattern while scanning, without holding the whole key list.
+
+        :param pattern: Pattern to match (e.g., "prefix:*").
+        :return: Number of keys removed.
+        :raises redis.RedisError: If the scan or a delete fails part way, some keys may be left.
+        """
+        removed = 0
+        batch = []
+        try:
+            async for key in self.scan_keys(pattern):
+                batch.append(key)
+                if len(batch) >= UNLINK_CHUNK_SIZE * UNLINK_CHUNKS_PER_PIPELINE:
+                    removed += await self._unlink_chunks(list(_chunks(batch, UNLINK_CHUNK_SIZE)))
+                    batch = []
+            if batch:
+                removed += await self._unlink_chunks(list(_chunks(batch, UNLINK_CHUNK_SIZE)))
+        except redis.RedisError as e:
+            logger.error(f"Error deleting keys by pattern {pattern} after {removed} keys: {e}", exc_info=True)
+            raise
+        return removed
+
+    async def set_expiry(self, key: str, seconds: int) -> bool:
+        """
+        Set expiration time for a key.
+
+        :param key: Key name.
+        :param seconds: Expiration time in seconds.
+        :return: True if successful, False otherwise.
+        """
+        try:
+            return await self.client.expire(key, seconds)
+        except redis.RedisError as e:
+            logger.error(f"Error setting expiry: {e}", exc_info=True)
+            return False
+
+    async def remove_from_set(self, key: str, *values: Any) -> int:
+        """
+        Remove one or more members from a set.
+
+        :param key: Key name.
+        :param values: Values to remove.
+        :return: Number of elements removed from the set.
+        """
+        try:
+            return await self.client.srem(key, *values)
+        except redis.RedisError as e:
+            logger.error(f"Error removing from set: {e}", exc_info=True)
+            return 0
+
+    async def incr(self, key: str, amount: int = 1) -> Optional[int]:
+        """
+        Increment an integer value.
+
+        :param key: Key name.
+        :param amount: Amount to add.
+        :return: Value after the increment, or None on error.
+        """
+        try:
+            return await self.client.incr(key, amount)
+        except redis.RedisError as e:
+            logger.error(f"Error incrementing key: {e}", exc_info=True)
+            return None
+
 
 REDIS = RedisUtils(
     host=SETTINGS.REDIS_HOST,
@@ -235,3 +622,5 @@ REDIS = RedisUtils(
     password=SETTINGS.REDIS_PASSWORD,
     ssl=SETTINGS.REDIS_SSL
 )
+
+ASYNC_REDIS = AsyncRedisUtils.from_settings()
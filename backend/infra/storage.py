@@ -0,0 +1,391 @@
+import asyncio
+import base64
+import logging
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator
+
+import aioboto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from common.error import raise_error
+from config import SETTINGS
+
+
+@dataclass(frozen=True)
+class ObjectInfo:
+    size: int
+    content_type: str | None = None
+    sha256: str | None = None  # hex, when the backend keeps a checksum
+
+
+class StorageBackend(ABC):
+    """
+    Object storage behind infra/file.py. Objects are written whole with put(), or in parts
+    (all but the last at least 5 MiB, the S3 minimum) with the multipart methods.
+    """
+    name: str
+
+    @property
+    def scope(self) -> str:
+        """Where objects live, e.g. one bucket: file records of other scopes are never reused here"""
+        return self.name
+
+    async def open(self) -> None:
+        """Acquire clients or directories up front, methods also do it lazily"""
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    def public_url(self, key: str) -> str:
+        pass
+
+    @abstractmethod
+    async def put(self, key: str, data: bytes, content_type: str) -> None:
+        pass
+
+    @abstractmethod
+    async def create_multipart(self, key: str, content_type: str) -> str:
+        """Start a multipart upload, returns its upload id"""
+        pass
+
+    @abstractmethod
+    async def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        """Upload part `part_number` (from 1), returns its ETag"""
+        pass
+
+    @abstractmethod
+    async def complete_multipart(self, key: str, upload_id: str, parts: list[dict]) -> None:
+        """Assemble the object from `parts`: [{"PartNumber": n, "ETag": etag}] in order"""
+        pass
+
+    @abstractmethod
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        pass
+
+    @abstractmethod
+    async def head(self, key: str) -> ObjectInfo | None:
+        """Size and metadata of the object, None if it does not exist"""
+        pass
+
+    @abstractmethod
+    def iter_chunks(self, key: str, chunk_size: int) -> AsyncIterator[bytes]:
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        pass
+
+    async def presign_put(self, key: str, content_type: str, size: int, sha256: str,
+                          expires_in: int) -> tuple[str, dict[str, str]]:
+        """
+        URL and headers a client can PUT exactly this content to; only backends reachable by clients support it.
+        """
+        raise_error(f"presigned uploads are not supported by the {self.name} storage backend")
+
+
+class S3Storage(StorageBackend):
+    """
+    One S3 client per process: credentials are resolved and the connection pool is created once,
+    later calls reuse its open connections.
+    """
+    name = "s3"
+
+    def __init__(self, bucket: str = SETTINGS.S3_BUCKET, region: str = SETTINGS.S3_REGION,
+                 endpoint_url: str = SETTINGS.S3_ENDPOINT_URL):
+        self.bucket = bucket
+        self.region = region
+        self.endpoint_url = endpoint_url or None
+        self._s3 = None
+        self._stack: AsyncExitStack | None = None
+        self._lock = asyncio.Lock()
+
+    def _client_kwargs(self) -> dict:
+        return dict(
+            region_name=self.region,
+            endpoint_url=self.endpoint_url,
+            aws_access_key_id=SETTINGS.AWS_ACCESS_KEY,
+            aws_secret_access_key=SETTINGS.AWS_SECRET_KEY,
+            config=Config(
+                max_pool_connections=SETTINGS.S3_MAX_POOL_CONNECTIONS,
+                connect_timeout=SETTINGS.S3_CONNECT_TIMEOUT_SECONDS,
+                read_timeout=SETTINGS.S3_READ_TIMEOUT_SECONDS,
+                retries={"max_attempts": 3, "mode": "standard"},
+                tcp_keepalive=True,
+                # presigned urls then sign the content type, length and checksum headers
+                signature_version="s3v4",
+            ),
+        )
+
+    async def client(self):
+        if self._s3 is not None:
+            return self._s3
+        async with self._lock:
+            if self._s3 is None:
+                stack = AsyncExitStack()
+                self._s3 = await stack.enter_async_context(aioboto3.Session().client("s3", **self._client_kwargs()))
+                self._stack = stack
+                logging.info(f"S3 client connected, region {self.region} bucket {self.bucket}")
+        return self._s3
+
+    @property
+    def scope(self) -> str:
+        return f"s3:{self.endpoint_url or self.region}/{self.bucket}"
+
+    async def open(self) -> None:
+        await self.client()
+
+    async def close(self) -> None:
+        async with self._lock:
+            if self._stack is not None:
+                await self._stack.aclose()
+            self._s3 = None
+            self._stack = None
+
+    def public_url(self, key: str) -> str:
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket}/{key}"
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+    async def put(self, key: str, data: bytes, content_type: str) -> None:
+        s3 = await self.client()
+        await s3.put_object(Bucket=self.bucket, Key=key, Body=data, ACL="public-read", ContentType=content_type)
+
+    async def create_multipart(self, key: str, content_type: str) -> str:
+        s3 = await self.client()
+        resp = await s3.create_multipart_upload(Bucket=self.bucket, Key=key, ACL="public-read",
+                                                ContentType=content_type)
+        return resp["UploadId"]
+
+    async def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        s3 = await self.client()
+        resp = await s3.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number,
+                                    Body=data)
+        return resp["ETag"]
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: list[dict]) -> None:
+        s3 = await self.client()
+        await s3.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                           MultipartUpload={"Parts": parts})
+
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        s3 = await self.client()
+        await s3.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+    async def head(self, key: str) -> ObjectInfo | None:
+        s3 = await self.client()
+        try:
+            head = await s3.head_object(Bucket=self.bucket, Key=key, ChecksumMode="ENABLED")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        checksum = head.get("ChecksumSHA256")
+        # composite checksums of multipart objects ("...-N") are not the content's sha256
+        sha256 = base64.b64decode(checksum).hex() if checksum and "-" not in checksum else None
+        return ObjectInfo(size=head["ContentLength"], content_type=head.get("ContentType"), sha256=sha256)
+
+    async def iter_chunks(self, key: str, chunk_size: int) -> AsyncIterator[bytes]:
+        s3 = await self.client()
+        obj = await s3.get_object(Bucket=self.bucket, Key=key)
+        body = obj["Body"]
+        async with body:
+            async for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+
+    async def delete(self, key: str) -> None:
+        s3 = await self.client()
+        await s3.delete_object(Bucket=self.bucket, Key=key)
+
+    async def presign_put(self, key: str, content_type: str, size: int, sha256: str,
+                          expires_in: int) -> tuple[str, dict[str, str]]:
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        s3 = await self.client()
+        url = await s3.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": key,
+                "ContentType": content_type,
+                "ContentLength": size,
+                "ChecksumSHA256": checksum,
+                "ACL": "public-read",
+            },
+            ExpiresIn=expires_in,
+        )
+        return url, {
+            "Content-Type": content_type,
+            "x-amz-checksum-sha256": checksum,
+            "x-amz-acl": "public-read",
+        }
+
+
+class LocalStorage(StorageBackend):
+    """
+    Objects as files under `root`, served by something else at `base_url`. File IO runs in threads.
+    Content types are not kept.
+    """
+    name = "local"
+
+    def __init__(self, root: str = SETTINGS.STORAGE_LOCAL_ROOT, base_url: str = SETTINGS.STORAGE_LOCAL_BASE_URL):
+        self.root = Path(root).resolve()
+        self.base_url = base_url.rstrip("/")
+        self._multipart_root = self.root / ".multipart"
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root) or path.is_relative_to(self._multipart_root):
+            raise_error(f"invalid key {key}")
+        return path
+
+    def _parts_dir(self, upload_id: str) -> Path:
+        # upload ids come from create_multipart, never from clients
+        return self._multipart_root / upload_id
+
+    @staticmethod
+    def _write(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    @property
+    def scope(self) -> str:
+        return f"local:{self.base_url}"
+
+    async def open(self) -> None:
+        await asyncio.to_thread(self._multipart_root.mkdir, parents=True, exist_ok=True)
+
+    def public_url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+    async def put(self, key: str, data: bytes, content_type: str) -> None:
+        await asyncio.to_thread(self._write, self._path(key), data)
+
+    async def create_multipart(self, key: str, content_type: str) -> str:
+        upload_id = uuid.uuid4().hex
+        await asyncio.to_thread(self._parts_dir(upload_id).mkdir, parents=True)
+        return upload_id
+
+    async def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        await asyncio.to_thread(self._write, self._parts_dir(upload_id) / str(part_number), data)
+        return str(part_number)
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: list[dict]) -> None:
+        path = self._path(key)
+        parts_dir = self._parts_dir(upload_id)
+
+        def assemble():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".{path.name}.{upload_id}")
+            with open(tmp, "wb") as out:
+                for part in parts:
+                    with open(parts_dir / str(part["PartNumber"]), "rb") as f:
+                        shutil.copyfileobj(f, out)
+            os.replace(tmp, path)
+            shutil.rmtree(parts_dir)
+
+        await asyncio.to_thread(assemble)
+
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        await asyncio.to_thread(shutil.rmtree, self._parts_dir(upload_id), ignore_errors=True)
+
+    async def head(self, key: str) -> ObjectInfo | None:
+        path = self._path(key)
+        try:
+            stat = await asyncio.to_thread(path.stat)
+        except FileNotFoundError:
+            return None
+        return ObjectInfo(size=stat.st_size)
+
+    async def iter_chunks(self, key: str, chunk_size: int) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(open, self._path(key), "rb")
+        try:
+            while chunk := await asyncio.to_thread(f.read, chunk_size):
+                yield chunk
+        finally:
+            f.close()
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._path(key).unlink, missing_ok=True)
+
+
+class MemoryStorage(StorageBackend):
+    """Objects in a dict of this process, for tests and offline benchmarks"""
+    name = "memory"
+
+    def __init__(self, base_url: str = "memory://"):
+        self.base_url = base_url
+        # objects die with the instance, so its records must never match another one's
+        self._scope = f"memory:{uuid.uuid4().hex}"
+        self.objects: dict[str, tuple[bytes, str]] = {}
+        # upload id -> (content type, parts by number)
+        self._multiparts: dict[str, tuple[str, dict[int, bytes]]] = {}
+
+    @property
+    def scope(self) -> str:
+        return self._scope
+
+    def public_url(self, key: str) -> str:
+        return f"{self.base_url}{key}"
+
+    async def put(self, key: str, data: bytes, content_type: str) -> None:
+        self.objects[key] = (bytes(data), content_type)
+
+    async def create_multipart(self, key: str, content_type: str) -> str:
+        upload_id = uuid.uuid4().hex
+        self._multiparts[upload_id] = (content_type, {})
+        return upload_id
+
+    async def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        self._multiparts[upload_id][1][part_number] = bytes(data)
+        return str(part_number)
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: list[dict]) -> None:
+        content_type, uploaded = self._multiparts.pop(upload_id)
+        self.objects[key] = (b"".join(uploaded[part["PartNumber"]] for part in parts), content_type)
+
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        self._multiparts.pop(upload_id, None)
+
+    async def head(self, key: str) -> ObjectInfo | None:
+        obj = self.objects.get(key)
+        if obj is None:
+            return None
+        return ObjectInfo(size=len(obj[0]), content_type=obj[1])
+
+    async def iter_chunks(self, key: str, chunk_size: int) -> AsyncIterator[bytes]:
+        data = self.objects[key][0]
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+    async def delete(self, key: str) -> None:
+        self.objects.pop(key, None)
+
+
+_BACKENDS: dict[str, type[StorageBackend]] = {
+    S3Storage.name: S3Storage,
+    LocalStorage.name: LocalStorage,
+    MemoryStorage.name: MemoryStorage,
+}
+
+
+def create_storage(name: str = SETTINGS.STORAGE_BACKEND) -> StorageBackend:
+    """
+    The storage backend called `name`: s3, local or memory. Fails on any other name rather than falling back:
+    processes sharing file records must agree on where the files are.
+    """
+    backend = _BACKENDS.get(name.lower())
+    if backend is None:
+        raise_error(f"Unknown storage backend: {name}, use one of {', '.join(_BACKENDS)}")
+    return backend()
+
+
+STORAGE = create_storage()
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+import redis
+
+from config import SETTINGS
+from infra.redis_cache import ASYNC_REDIS
+
+logger = logging.getLogger(__name__)
+
+_CHANNEL_PREFIX = f"{SETTINGS.REDIS_PREFIX}.task_events."
+
+
+async def publish_task_event(task_id: str, delta: dict):
+    """Publish a status delta of a task to every process; best effort, a lost event only delays the client"""
+    try:
+        await ASYNC_REDIS.client.publish(_CHANNEL_PREFIX + task_id, json.dumps(delta, default=str))
+    except redis.RedisError as e:
+        logger.error(f"Error publishing event of task {task_id}: {e}", exc_info=True)
+
+
+class TaskEventHub:
+    """
+    Fans task events out to local subscribers.
+
+    The process holds a single pattern subscription however many clients are listening;
+    it is opened with the first subscriber and reconnects on errors.
+    """
+
+    def __init__(self, queue_size: int = 100, ready_timeout: float = 5):
+        self.queue_size = queue_size
+        self.ready_timeout = ready_timeout
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._listener: asyncio.Task | None = None
+        # set while Redis has confirmed the pattern subscription
+        self._ready = asyncio.Event()
+
+    @asynccontextmanager
+    async def subscribe(self, task_id: str) -> AsyncIterator[asyncio.Queue]:
+        """
+        Queue of the raw JSON events of `task_id` while the context is open.
+
+        Entered once the subscription is confirmed, so every event published afterwards is delivered.
+        If Redis does not confirm within `ready_timeout` it is entered anyway and events may be missed.
+        """
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(task_id, set()).add(queue)
+        try:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=self.ready_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Task event subscription not confirmed, events of {task_id} may be missed")
+            yield queue
+        finally:
+            queues = self._subscribers.get(task_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[task_id]
+
+    def _dispatch(self, channel: str, data: str):
+        for queue in self._subscribers.get(channel[len(_CHANNEL_PREFIX):], ()):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                logger.warning(f"Dropping event for slow subscriber of {channel}")
+
+    async def _listen(self):
+        while True:
+            pubsub = ASYNC_REDIS.client.pubsub()
+            try:
+                await pubsub.psubscribe(_CHANNEL_PREFIX + "*")
+                while True:
+                    # poll with a timeout so the pool's socket timeout never fires on a quiet channel
+                    message = await pubsub.get_message(timeout=1.0)
+                    if not message:
+                        continue
+                    if message["type"] == "psubscribe":
+                        self._ready.set()
+                    elif message["type"] == "pmessage":
+                        self._dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Task event subscription failed, reconnecting: {e}", exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                self._ready.clear()
+                await pubsub.aclose()
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+            self._ready.clear()
+
+
+TASK_EVENTS = TaskEventHub()
+
+
+async def sse_task_events(task_id: str, load_snapshot: Callable[[], Awaitable[dict | None]],
+                          is_final=lambda delta: False) -> AsyncIterator[str]:
+    """
+    Server-sent events for one task: the snapshot first, then every published delta, with keep-alive comments.
+
+    `load_snapshot` is read once the subscription is confirmed, so a change is either already in the
+    snapshot or arrives as a delta. Ends when `is_final` returns True for an event, when the task is gone,
+    or after SSE_MAX_SECONDS; clients reconnect for more.
+    """
+    async with TASK_EVENTS.subscribe(task_id) as queue:
+        snapshot = await load_snapshot()
+        if snapshot is None:
+            return
+        yield f"data: {json.dumps(snapshot, default=str)}\n\n"
+        if is_final(snapshot):
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SETTINGS.SSE_MAX_SECONDS
+        while loop.time() < deadline:
+            try:
+                data = await asyncio.wait_for(queue.get(), timeout=SETTINGS.SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"data: {data}\n\n"
+            if is_final(json.loads(data)):
+                return
@@ -14,12 +14,17 @@ from config import SETTINGS
 from entities.bo import FileBO, TwitterDTO
 from entities.dto import GenCoverImgReq, AIGCTask, AIGCTaskID, GenVideoReq, DigitalHuman, ID, Username, AIGCPublishReq, \
     GenerateLyricsReq, GenMusicReq, BasicInfoReq, GenXAudioReq, Username1, Profile, DigitalHumanPageReq, PointsDetails, \
-    InvitationCode, CloneXAudioReq
-from infra.db import aigc_task_col, aigc_task_get_by_id, aigc_task_count_by_tenant_id, digital_human_col, \
-    digital_human_get_by_id, digital_human_get_by_digital_human, aigc_task_delete_by_id, digital_human_col_delete_by_id, \
+    InvitationCode, CloneXAudioReq, CursorPage, PresignUploadReq, PresignUploadResp, CompleteUploadReq
+from infra.db import aigc_task_col, aigc_task_get_by_id, aigc_task_count_by_tenant_id, \
+    digital_human_get_by_id, aigc_task_delete_by_id, digital_human_col_delete_by_id, \
     get_profile_by_tenant_id, add_points, digital_human_save, profile_save, profiles_col, aigc_task_save, \
-    digital_human_chat_count
-from infra.file import s3_upload_file
+    digital_human_chat_count, find_by_cursor, points_ledger_col, AIGC_TASK_PROJECTION, digital_human_page, \
+    digital_human_get_by_id_cached, digital_human_get_by_digital_human_cached, listing, get_profile_by_tenant_id_cached
+from infra.cache import cache_stats
+from infra.file import s3_upload_file, s3_presign_upload, s3_complete_upload
+from infra.http import HTTP
+from infra.image_cache import IMAGES
+from infra.task_events import sse_task_events
 from middleware.auth_middleware import get_optional_current_user
 from services.aigc_service import gen_cover_img_svc, gen_video_svc, aigc_task_publish_by_id, gen_lyrics_svc, \
     gen_music_svc, save_basic_info, gen_twitter_audio_svc, clone_twitter_audio_svc
@@ -59,6 +64,27 @@ async def upload_file(
     return RestResponse(data=bo)
 
 
+@router.post("/api/upload_file/presign", summary="upload_file/presign", response_model=RestResponse[PresignUploadResp])
+async def presign_upload_file(req: PresignUploadReq, user: Optional[dict] = Depends(get_optional_current_user)):
+    """
+    Presigned PUT url to upload a file directly to S3, then call upload_file/complete as the same user.
+    If the same content was uploaded before, file_url is returned instead and there is nothing to upload.
+    """
+    tenant_id = user.get("tenant_id", "")
+    if not tenant_id:
+        raise_error("tenant_id is required")
+    return RestResponse(data=await s3_presign_upload(req, tenant_id))
+
+
+@router.post("/api/upload_file/complete", summary="upload_file/complete", response_model=RestResponse[FileBO])
+async def complete_upload_file(req: CompleteUploadReq, user: Optional[dict] = Depends(get_optional_current_user)):
+    """Verify and record a file uploaded with a presigned url"""
+    tenant_id = user.get("tenant_id", "")
+    if not tenant_id:
+        raise_error("tenant_id is required")
+    return RestResponse(data=await s3_complete_upload(req, tenant_id))
+
+
 @router.post("/api/aigc_task/create",
              summary="aigc_task/create",
              response_model=RestResponse[AIGCTask]
@@ -83,9 +109,9 @@ async def create_aigc_task(user: Optional[dict] = Depends(get_optional_current_u
              summary="aigc_task/gen_cover_img",
              response_model=RestResponse[AIGCTask]
              )
-async def gen_cover_img(req: GenCoverImgReq, background_tasks: BackgroundTasks):
+async def gen_cover_img(req: GenCoverImgReq):
     logging.info(f"M gen_cover_img req: {req.model_dump_json()}")
-    ret = await gen_cover_img_svc(req, background_tasks)
+    ret = await gen_cover_img_svc(req)
     return RestResponse(data=ret)
 
 
@@ -93,9 +119,9 @@ async def gen_cover_img(req: GenCoverImgReq, background_tasks: BackgroundTasks):
              summary="aigc_task/save_base_info",
              response_model=RestResponse[AIGCTask]
              )
-async def save_base_info(req: BasicInfoReq, background_tasks: BackgroundTasks):
+async def save_base_info(req: BasicInfoReq):
     logging.info(f"M save_base_info req: {req.model_dump_json()}")
-    ret = await save_basic_info(req, background_tasks)
+    ret = await save_basic_info(req)
     return RestResponse(data=ret)
 
 
@@ -103,9 +129,9 @@ async def save_base_info(req: BasicInfoReq, background_tasks: BackgroundTasks):
              summary="aigc_task/gen_scenario_video",
              response_model=RestResponse[AIGCTask]
              )
-async def gen_scenario_video(req: GenVideoReq, background_tasks: BackgroundTasks):
+async def gen_scenario_video(req: GenVideoReq):
     logging.info(f"M gen_scenario_video req: {req.model_dump_json()}")
-    ret = await gen_video_svc(req, background_tasks)
+    ret = await gen_video_svc(req)
     return RestResponse(data=ret)
 
 
@@ -113,9 +139,9 @@ async def gen_scenario_video(req: GenVideoReq, background_tasks: BackgroundTasks
              summary="aigc_task/gen_lyrics",
              response_model=RestResponse[AIGCTask]
              )
-async def gen_lyrics(req: GenerateLyricsReq, background_tasks: BackgroundTasks):
+async def gen_lyrics(req: GenerateLyricsReq):
     logging.info(f"M gen_lyrics req: {req.model_dump_json()}")
-    ret = await gen_lyrics_svc(req, background_tasks)
+    ret = await gen_lyrics_svc(req)
     return RestResponse(data=ret)
 
 
@@ -123,9 +149,9 @@ async def gen_lyrics(req: GenerateLyricsReq, background_tasks: BackgroundTasks):
              summary="aigc_task/gen_music",
              response_model=RestResponse[AIGCTask]
              )
-async def gen_music(req: GenMusicReq, background_tasks: BackgroundTasks):
+async def gen_music(req: GenMusicReq):
     logging.info(f"M gen_music req: {req.model_dump_json()}")
-    ret = await gen_music_svc(req, background_tasks)
+    ret = await gen_music_svc(req)
     return RestResponse(data=ret)
 
 
@@ -133,19 +159,27 @@ async def gen_music(req: GenMusicReq, background_tasks: BackgroundTasks):
              summary="aigc_task/gen_twitter_audio",
              response_model=RestResponse[AIGCTask]
              )
-async def gen_twitter_audio(req: GenXAudioReq, background_tasks: BackgroundTasks):
+async def gen_twitter_audio(req: GenXAudioReq):
     logging.info(f"M gen_twitter_audio req: {req.model_dump_json()}")
-    ret = await gen_twitter_audio_svc(req, background_tasks)
+    ret = await gen_twitter_audio_svc(req)
     return RestResponse(data=ret)
 
 
+@router.get("/innerapi/metrics",
+            summary="innerapi/metrics",
+            response_model=RestResponse[dict]
+            )
+async def metrics():
+    return RestResponse(data={"cache": cache_stats(), "http": HTTP.stats(), "images": IMAGES.stats()})
+
+
 @router.post("/innerapi/clone_twitter_audio",
              summary="innerapi/clone_twitter_audio",
              response_model=RestResponse[bool]
              )
-async def clone_twitter_audio(req: CloneXAudioReq, background_tasks: BackgroundTasks):
+async def clone_twitter_audio(req: CloneXAudioReq):
     logging.info(f"clone_twitter_audio req: {req.model_dump_json()}")
-    await clone_twitter_audio_svc(req, background_tasks)
+    await clone_twitter_audio_svc(req)
     return RestResponse(data=True)
 
 
@@ -158,6 +192,25 @@ async def get_aigc_task(req: AIGCTaskID):
     return RestResponse(data=task)
 
 
+@router.get("/api/aigc_task/events",
+            summary="aigc_task/events")
+async def aigc_task_events(task_id: str = Query(..., description="task_id")):
+    """
+    Server-sent status of the task's sub tasks and videos, the current state first and then every change.
+    Needs the Authorization header, so browsers read it with fetch() rather than EventSource.
+    """
+    if not await aigc_task_get_by_id(task_id):
+        raise_error(f"task {task_id} not found")
+
+    async def load_snapshot():
+        task = await aigc_task_get_by_id(task_id)
+        if not task:
+            return None
+        return {"task_id": task.task_id, "updated_at": task.updated_at, **task.status_delta(changed_only=False)}
+
+    return StreamingResponse(sse_task_events(task_id, load_snapshot), media_type="text/event-stream")
+
+
 @router.post("/api/aigc_task/delete",
              summary="aigc_task/delete",
              response_model=RestResponse
@@ -169,19 +222,26 @@ async def delete_aigc_task(req: AIGCTaskID):
 
 @router.post("/api/aigc_task/list",
              summary="aigc_task/list",
-             response_model=RestResponse[list[AIGCTask]]
+             response_model=RestResponse[list[AIGCTask] | CursorPage[AIGCTask]]
              )
 async def list_aigc_task(
         page: int = Query(1, ge=1),
         pagesize: int = Query(10, ge=1, le=1000),
+        cursor: Optional[str] = Query(None, description="cursor mode, empty for the first page"),
         user: Optional[dict] = Depends(get_optional_current_user), ):
     tenant_id = user.get("tenant_id", "")
+    if cursor is not None:
+        data_list, next_cursor = await find_by_cursor(aigc_task_col, {"tenant_id": tenant_id}, cursor, pagesize,
+                                                      AIGC_TASK_PROJECTION)
+        return RestResponse(data=CursorPage(items=[AIGCTask(**doc) for doc in data_list], next_cursor=next_cursor))
+
     skip = (page - 1) * pagesize
-    cursor = aigc_task_col.find({"tenant_id": tenant_id}) \
+    docs_cursor = listing(aigc_task_col).find({"tenant_id": tenant_id}, AIGC_TASK_PROJECTION) \
         .sort("created_at", -1) \
         .skip(skip) \
-        .limit(pagesize)
-    data_list = await cursor.to_list(length=pagesize)
+        .limit(pagesize) \
+        .max_time_ms(SETTINGS.MONGO_LIST_MAX_TIME_MS)
+    data_list = await docs_cursor.to_list(length=pagesize)
     tasks = [AIGCTask(**doc) for doc in data_list]
     return RestResponse(data=tasks)
 
@@ -203,24 +263,18 @@ async def get_aigc_publish(req: AIGCPublishReq,
 
 @router.post("/api/digital_human/list",
              summary="digital_human/list",
-             response_model=RestResponse[list[DigitalHuman]]
+             response_model=RestResponse[list[DigitalHuman] | CursorPage[DigitalHuman]]
              )
 async def list_digital_human(
         req: DigitalHumanPageReq,
         page: int = Query(1, ge=1),
         pagesize: int = Query(10, ge=1, le=1000),
+        cursor: Optional[str] = Query(None, description="cursor mode, empty for the first page"),
 ):
-    query = {}
-    if req.tag:
-        query["tag"] = req.tag
-    skip = (page - 1) * pagesize
-    cursor = digital_human_col.find(query) \
-        .sort("created_at", -1) \
-        .skip(skip) \
-        .limit(pagesize)
-    data_list = await cursor.to_list(length=pagesize)
-    tasks = [DigitalHuman(**doc) for doc in data_list]
-    return RestResponse(data=tasks)
+    ret = await digital_human_page(req.tag, page, pagesize, cursor)
+    if cursor is not None:
+        return RestResponse(data=ret)
+    return RestResponse(data=ret.items)
 
 
 @router.post("/api/digital_human/get_by_id",
@@ -228,7 +282,7 @@ async def list_digital_human(
              response_model=RestResponse[DigitalHuman]
              )
 async def get_digital_human(req: ID):
-    task = await digital_human_get_by_id(req.id)
+    task = await digital_human_get_by_id_cached(req.id)
     return RestResponse(data=task)
 
 
@@ -244,6 +298,7 @@ async def follow_digital_human(req: ID,
         {"$addToSet": {"follow_digital_human_ids": req.id}},
         upsert=False
     )
+    await get_profile_by_tenant_id_cached.invalidate(tenant_id)
     return RestResponse(data=True)
 
 
@@ -252,7 +307,7 @@ async def follow_digital_human(req: ID,
              response_model=RestResponse[DigitalHuman]
              )
 async def get_digital_human_username(req: Username):
-    task = await digital_human_get_by_digital_human(req.digital_name)
+    task = await digital_human_get_by_digital_human_cached(req.digital_name)
     return RestResponse(data=task)
 
 
@@ -355,17 +410,43 @@ async def twitter_bind(user: Optional[dict] = Depends(get_optional_current_user)
             response_model=RestResponse[Profile])
 async def profile(user: Optional[dict] = Depends(get_optional_current_user), ):
     tenant_id = user.get("tenant_id", "")
-    p = await get_profile_by_tenant_id(tenant_id)
+    p = await get_profile_by_tenant_id_cached(tenant_id)
     return RestResponse(data=p)
 
 
 @router.get("/api/get_score_list",
             summary="get_score_list",
-            response_model=RestResponse[List[PointsDetails]])
-async def profile(user: Optional[dict] = Depends(get_optional_current_user), ):
+            response_model=RestResponse[List[PointsDetails] | CursorPage[PointsDetails]])
+async def get_score_list(
+        page: Optional[int] = Query(None, ge=1, description="page mode, newest first"),
+        pagesize: Optional[int] = Query(None, ge=1, le=1000, description="default 10 in page and cursor mode"),
+        cursor: Optional[str] = Query(None, description="cursor mode, empty for the first page"),
+        user: Optional[dict] = Depends(get_optional_current_user),
+):
+    """Without page, pagesize or cursor: the whole ledger oldest first, as before it moved out of the profile"""
     tenant_id = user.get("tenant_id", "")
-    p = await get_profile_by_tenant_id(tenant_id)
-    return RestResponse(data=p.points_details)
+    if not tenant_id:
+        raise_error("tenant_id is required")
+    if page is None and pagesize is None and cursor is None:
+        docs_cursor = listing(points_ledger_col).find({"tenant_id": tenant_id}) \
+            .sort([("created_at", 1), ("_id", 1)]) \
+            .max_time_ms(SETTINGS.MONGO_LIST_MAX_TIME_MS)
+        return RestResponse(data=[PointsDetails(**doc) async for doc in docs_cursor])
+
+    pagesize = pagesize or 10
+    if cursor is not None:
+        data_list, next_cursor = await find_by_cursor(points_ledger_col, {"tenant_id": tenant_id}, cursor, pagesize)
+        return RestResponse(data=CursorPage(items=[PointsDetails(**doc) for doc in data_list],
+                                            next_cursor=next_cursor))
+
+    skip = ((page or 1) - 1) * pagesize
+    docs_cursor = listing(points_ledger_col).find({"tenant_id": tenant_id}) \
+        .sort([("created_at", -1), ("_id", -1)]) \
+        .skip(skip) \
+        .limit(pagesize) \
+        .max_time_ms(SETTINGS.MONGO_LIST_MAX_TIME_MS)
+    data_list = await docs_cursor.to_list(length=pagesize)
+    return RestResponse(data=[PointsDetails(**doc) for doc in data_list])
 
 
 @router.post("/api/invitation_code",
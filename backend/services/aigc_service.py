@@ -4,6 +4,7 @@ import json
 import logging
 import re
 import uuid
+from typing import Awaitable, Callable
 
 from fastapi import BackgroundTasks
 
@@ -16,9 +17,12 @@ from common.error import raise_error
 from config import SETTINGS
 from entities.dto import GenCoverImgReq, AIGCTask, Cover, TaskStatus, GenVideoReq, Video, DigitalHuman, \
     DigitalVideo, GenCoverResp, AIGCPublishReq, Lyrics, GenerateLyricsResponse, \
-    GenerateLyricsResp, GenerateLyricsReq, GenMusicReq, Music, GenerateMusicResponse, GenerateMusicResp, BasicInfoReq, \
+    GenerateLyricsResp, GenerateLyricsReq, GenMusicReq, Music, GenerateMusicResp, BasicInfoReq, \
     GenXAudioReq, Audio, TwitterTTSTask, TaskType, TaskAndHuman, VideoKeyType, CloneXAudioReq, Fee
-from infra.db import aigc_task_get_by_id, aigc_task_save, digital_human_save, digital_human_get_by_digital_human
+from infra.db import aigc_task_get_by_id, aigc_task_save, digital_human_save, digital_human_get_by_digital_human, \
+    aigc_task_history_get
+from infra.job_queue import enqueue_job, job_handler
+from infra.lock import UNFENCED, acquire_lock, extend_lock, is_current, release_lock
 from services import twitter_tts_service
 from services.resource_usage_limit import check_limit_and_record
 from services.twitter_service import twitter_fetch_user_svc
@@ -39,8 +43,90 @@ style_map = {
     12: "Doll-like anime style"
 }
 
+JOB_GEN_LYRICS = "aigc.gen_lyrics"
+JOB_GEN_MUSIC = "aigc.gen_music"
+JOB_GEN_TWITTER_AUDIO = "aigc.gen_twitter_audio"
+JOB_CLONE_TWITTER_AUDIO = "aigc.clone_twitter_audio"
+JOB_GEN_COVER_IMG = "aigc.gen_cover_img"
+JOB_GEN_VIDEO = "aigc.gen_video"
+
+
+def _gen_lock_name(task_id: str, sub_task: str, key: str = "") -> str:
+    return f"gen.{task_id}.{sub_task}.{key}"
+
+
+async def _start_gen_once(task_id: str, sub_task: str, key: str,
+                          start: Callable[[int], Awaitable[AIGCTask]]) -> AIGCTask:
+    """
+    Call `start` with a fencing token unless the same (task_id, sub_task, key) is already being
+    generated by any worker; a duplicate request attaches to that generation and gets the task as it is.
+
+    `start` saves the sub task and enqueues its job with the token as payload["fence"],
+    the job releases the lock when it finishes.
+    """
+    lock = await acquire_lock(_gen_lock_name(task_id, sub_task, key), SETTINGS.GEN_LOCK_TTL_SECONDS)
+    if not lock.acquired:
+        logging.info(f"M {lock.name} already in progress, attaching to it")
+        task = await aigc_task_get_by_id(task_id)
+        if not task:
+            raise_error(f"task {task_id} not found")
+        return task
+
+    try:
+        return await start(lock.token)
+    except BaseException:
+        await release_lock(lock.name, lock.token)
+        raise
+
+
+async def _fence_ok(payload: dict) -> bool:
+    """False if a newer request for the job's sub task has taken over, its result must then be dropped"""
+    name = _gen_lock_name(payload["task_id"], payload["sub_task"], payload.get("key", ""))
+    if await is_current(name, payload.get("fence", UNFENCED)):
+        return True
+    logging.warning(f"M job for {name} was superseded by a newer request, dropping it")
+    return False
+
+
+async def _extend_gen_lock(payload: dict):
+    """Job on_heartbeat hook: keep the generation lock for as long as its job runs, retries included"""
+    fence = payload.get("fence", UNFENCED)
+    if fence == UNFENCED:
+        return
+    name = _gen_lock_name(payload["task_id"], payload["sub_task"], payload.get("key", ""))
+    await extend_lock(name, fence, SETTINGS.GEN_LOCK_TTL_SECONDS)
+
+
+async def _release_gen_lock(payload: dict):
+    name = _gen_lock_name(payload["task_id"], payload["sub_task"], payload.get("key", ""))
+    await release_lock(name, payload.get("fence", UNFENCED))
+
+
+async def _fail_sub_task(payload: dict):
+    """Job on_failure hook: a job that gave up must not leave its sub task in_progress"""
+    if not await _fence_ok(payload):
+        return
+
+    cur_task = await aigc_task_get_by_id(payload["task_id"])
+    if not cur_task:
+        await _release_gen_lock(payload)
+        return
+
+    name = payload["sub_task"]
+    if name == "videos":
+        sub_tasks = [v for v in cur_task.videos if v.input.key == payload.get("key")]
+    else:
+        sub_tasks = [getattr(cur_task, name)]
+
+    for sub_task in sub_tasks:
+        if sub_task and sub_task.status == TaskStatus.IN_PROGRESS:
+            sub_task.status = TaskStatus.FAILED
+            sub_task.done_at = datetime.datetime.now()
+    await aigc_task_save(cur_task)
+    await _release_gen_lock(payload)
 
-async def gen_lyrics_svc(req: GenerateLyricsReq, background: BackgroundTasks) -> AIGCTask:
+
+async def gen_lyrics_svc(req: GenerateLyricsReq) -> AIGCTask:
     task = await aigc_task_get_by_id(req.task_id)
 
     await check_limit_and_record(client=f"task-{task.task_id}", resource="gen-lyrics")
@@ -58,45 +144,39 @@ async def gen_lyrics_svc(req: GenerateLyricsReq, background: BackgroundTasks) ->
         )
 
     await aigc_task_save(task)
+    await enqueue_job(JOB_GEN_LYRICS, {"task_id": task.task_id, "sub_task": "lyrics"})
 
-    async def _task_gen_lyrics():
-        try:
-            result = await twitter_tts_service.generate_lyrics_from_twitter_url(
-                twitter_url=task.cover.input.x_link,
-                tenant_id=task.tenant_id,
-                lang=task.lang,
-            )
-            response = GenerateLyricsResponse(**result)
-        except Exception as e:
-            logging.error(f"M failed to generate lyrics {e}", exc_info=True)
-            response = None
-
-        cur_task = await aigc_task_get_by_id(task.task_id)
-        if response:
-            cur_task.lyrics.output = GenerateLyricsResp(
-                lyrics=response.lyrics,
-                title=response.title,
-            )
-            cur_task.lyrics.status = TaskStatus.DONE
-            cur_task.lyrics.done_at = datetime.datetime.now()
+    return task
 
-            fee = Fee.total_fee([
-                Fee.llm_fee(),
-            ])
-            cur_task.lyrics.fee.append(fee)
 
-            await aigc_task_save(cur_task)
-            return
+@job_handler(JOB_GEN_LYRICS, on_failure=_fail_sub_task)
+async def _job_gen_lyrics(payload: dict):
+    task = await aigc_task_get_by_id(payload["task_id"])
+    # errors go to the worker, which retries and marks the sub task failed after the last attempt
+    result = await twitter_tts_service.generate_lyrics_from_twitter_url(
+        twitter_url=task.cover.input.x_link,
+        tenant_id=task.tenant_id,
+        lang=task.lang,
+    )
+    response = GenerateLyricsResponse(**result)
 
-        cur_task.lyrics.status = TaskStatus.FAILED
-        await aigc_task_save(cur_task)
+    cur_task = await aigc_task_get_by_id(task.task_id)
+    cur_task.lyrics.output = GenerateLyricsResp(
+        lyrics=response.lyrics,
+        title=response.title,
+    )
+    cur_task.lyrics.status = TaskStatus.DONE
+    cur_task.lyrics.done_at = datetime.datetime.now()
 
-    background.add_task(_task_gen_lyrics)
+    fee = Fee.total_fee([
+        Fee.llm_fee(),
+    ])
+    cur_task.lyrics.add_fee(fee)
 
-    return task
+    await aigc_task_save(cur_task)
 
 
-async def gen_music_svc(req: GenMusicReq, background: BackgroundTasks) -> AIGCTask:
+async def gen_music_svc(req: GenMusicReq) -> AIGCTask:
     task = await aigc_task_get_by_id(req.task_id)
 
     await check_limit_and_record(client=f"task-{task.task_id}", resource="gen_music")
@@ -114,53 +194,47 @@ async def gen_music_svc(req: GenMusicReq, background: BackgroundTasks) -> AIGCTa
         )
 
     await aigc_task_save(task)
+    await enqueue_job(JOB_GEN_MUSIC, {"task_id": task.task_id, "sub_task": "music", "req": req.model_dump(mode="json")})
 
-    async def _task_gen_music():
-        lyrics = req.lyrics
-        if len(lyrics) > 550:
-            lyrics = lyrics[:550]
-
-        result = None
-        try:
-            result = await twitter_tts_service.generate_music_from_lyrics(
-                lyrics=lyrics,
-                style=req.style,
-                tenant_id=task.tenant_id,
-                voice=req.voice,
-                model=req.model,
-                response_format=req.response_format,
-                speed=req.speed,
-                reference_audio_url=req.reference_audio_url
-            )
-
-            response = GenerateMusicResponse(**result)
-        except Exception as e:
-            logging.exception(f"failed to generate music {e}")
-            response = None
-
-        cur_task = await aigc_task_get_by_id(task.task_id)
-        if response and result:
-            cur_task.music.output = GenerateMusicResp(**result)
-            cur_task.music.status = TaskStatus.DONE
-            cur_task.music.done_at = datetime.datetime.now()
+    return task
 
-            fee = Fee.total_fee([
-                Fee.music_fee(),
-            ])
-            cur_task.music.fee.append(fee)
 
-            await aigc_task_save(cur_task)
-            return
+@job_handler(JOB_GEN_MUSIC, on_failure=_fail_sub_task)
+async def _job_gen_music(payload: dict):
+    req = GenMusicReq(**payload["req"])
+    task = await aigc_task_get_by_id(payload["task_id"])
+
+    lyrics = req.lyrics
+    if len(lyrics) > 550:
+        lyrics = lyrics[:550]
+
+    result = await twitter_tts_service.generate_music_from_lyrics(
+        lyrics=lyrics,
+        style=req.style,
+        tenant_id=task.tenant_id,
+        voice=req.voice,
+        model=req.model,
+        response_format=req.response_format,
+        speed=req.speed,
+        reference_audio_url=req.reference_audio_url
+    )
+    if not result:
+        raise_error("music generation returned no result")
 
-        cur_task.music.status = TaskStatus.FAILED
-        await aigc_task_save(cur_task)
+    cur_task = await aigc_task_get_by_id(task.task_id)
+    cur_task.music.output = GenerateMusicResp(**result)
+    cur_task.music.status = TaskStatus.DONE
+    cur_task.music.done_at = datetime.datetime.now()
 
-    background.add_task(_task_gen_music)
+    fee = Fee.total_fee([
+        Fee.music_fee(),
+    ])
+    cur_task.music.add_fee(fee)
 
-    return task
+    await aigc_task_save(cur_task)
 
 
-async def gen_twitter_audio_svc(req: GenXAudioReq, background: BackgroundTasks) -> AIGCTask:
+async def gen_twitter_audio_svc(req: GenXAudioReq) -> AIGCTask:
     task = await aigc_task_get_by_id(req.task_id)
 
     if task.audio:
@@ -177,107 +251,108 @@ async def gen_twitter_audio_svc(req: GenXAudioReq, background: BackgroundTasks)
         )
 
     await aigc_task_save(task)
-
-    async def _bg_x_audio_task():
-        voice_id = "Abbess"
-
-        result = []
-        tasks = []
-        voice_clone_url = task.slogan_voice_url
-        fee_items = []
-        try:
-
-            for twitter_url in req.x_tts_urls:
-                tts_task = TwitterTTSTask(
-                    task_id=task.audio.sub_task_id or str(uuid.uuid4()),
-                    tenant_id=task.tenant_id,
-                    twitter_url=twitter_url,
-                    voice_id=voice_id,
-                    username=task.twitter_username,
-                    audio_url_input=task.voice_clone_url,
-                    task_type=TaskType.VOICE_CLONE,
-                )
-                tasks.append(voice_clone_svc(tts_task, task.lang))
-                fee_items.append(Fee.clone_fee())
-
-            if not voice_clone_url:
-                tts_task = TwitterTTSTask(
-                    task_id=task.audio.sub_task_id or str(uuid.uuid4()),
-                    tenant_id=task.tenant_id,
-                    read_content=task.slogan,
-                    voice_id=voice_id,
-                    audio_url_input=task.voice_clone_url,
-                    task_type=TaskType.VOICE_CLONE,
-                )
-                slogan = await voice_clone_svc(tts_task, task.lang)
-                voice_clone_url = slogan.audio_url
-
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-                for r in results:
-                    if isinstance(r, Exception):
-                        logging.error(f"voice_clone_svc error: {r}")
-                    elif r:
-                        result.append(r)
-        except Exception as e:
-            logging.exception("Error in voice clone tasks")
-
-        cur_task = await aigc_task_get_by_id(task.task_id)
-        sub_task = cur_task.audio
-        if result and voice_clone_url and len(result) == len(tasks):
-            sub_task.output = result
-            sub_task.status = TaskStatus.DONE
-            sub_task.done_at = datetime.datetime.now()
-            cur_task.slogan_voice_url = voice_clone_url
-
-            fee = Fee.total_fee(fee_items)
-            sub_task.fee.append(fee)
-
-            await aigc_task_save(cur_task)
-            return
-
-        sub_task.status = TaskStatus.FAILED
-        await aigc_task_save(cur_task)
-
-    background.add_task(_bg_x_audio_task)
+    await enqueue_job(JOB_GEN_TWITTER_AUDIO,
+                      {"task_id": task.task_id, "sub_task": "audio", "req": req.model_dump(mode="json")})
 
     return task
 
 
-async def clone_twitter_audio_svc(req: CloneXAudioReq, background: BackgroundTasks):
-    async def _bg_x_clone_twitter_audio_task():
-        if not req.username or not req.text:
-            return
-        digital_human: DigitalHuman = await digital_human_get_by_digital_human(req.username)
-        if not digital_human:
-            return
-
-        voice_id = "Abbess"
-        voice_clone_url = digital_human.slogan_voice_url
-        try:
-            tts_task = TwitterTTSTask(
-                task_id=str(uuid.uuid4()),
-                tenant_id=digital_human.from_tenant_id,
-                read_content=req.text,
-                voice_id=voice_id,
-                audio_url_input=voice_clone_url,
-                task_type=TaskType.VOICE_CLONE,
-            )
-            result = await voice_clone_svc(tts_task, "")
-            if result and voice_clone_url:
-                digital_human.audios.append(result)
-                await digital_human_save(digital_human)
-
-                cur_task = await aigc_task_get_by_id(digital_human.from_task_id)
-                if cur_task:
-                    cur_task.audio.output.append(result)
-                    await aigc_task_save(cur_task)
-        except Exception as e:
-            logging.exception("Error in clone_twitter_audio_svc tasks")
-
-    background.add_task(_bg_x_clone_twitter_audio_task)
+@job_handler(JOB_GEN_TWITTER_AUDIO, on_failure=_fail_sub_task)
+async def _job_gen_twitter_audio(payload: dict):
+    req = GenXAudioReq(**payload["req"])
+    task = await aigc_task_get_by_id(payload["task_id"])
+    voice_id = "Abbess"
+
+    result = []
+    tasks = []
+    voice_clone_url = task.slogan_voice_url
+    fee_items = []
+    for twitter_url in req.x_tts_urls:
+        tts_task = TwitterTTSTask(
+            task_id=task.audio.sub_task_id or str(uuid.uuid4()),
+            tenant_id=task.tenant_id,
+            twitter_url=twitter_url,
+            voice_id=voice_id,
+            username=task.twitter_username,
+            audio_url_input=task.voice_clone_url,
+            task_type=TaskType.VOICE_CLONE,
+        )
+        tasks.append(tts_task)
+        fee_items.append(Fee.clone_fee())
+
+    if not voice_clone_url:
+        tts_task = TwitterTTSTask(
+            task_id=task.audio.sub_task_id or str(uuid.uuid4()),
+            tenant_id=task.tenant_id,
+            read_content=task.slogan,
+            voice_id=voice_id,
+            audio_url_input=task.voice_clone_url,
+            task_type=TaskType.VOICE_CLONE,
+        )
+        slogan = await voice_clone_svc(tts_task, task.lang)
+        voice_clone_url = slogan.audio_url
+
+    # started only here, so a failed slogan clone leaves no coroutine un-awaited
+    results = await asyncio.gather(*(voice_clone_svc(t, task.lang) for t in tasks), return_exceptions=True)
+    for r in results:
+        if isinstance(r, Exception):
+            logging.error(f"voice_clone_svc error: {r}")
+        elif r:
+            result.append(r)
+
+    if not (result and voice_clone_url and len(result) == len(tasks)):
+        raise_error(f"voice clone produced {len(result)} of {len(tasks)} audios")
+
+    cur_task = await aigc_task_get_by_id(task.task_id)
+    sub_task = cur_task.audio
+    sub_task.output = result
+    sub_task.status = TaskStatus.DONE
+    sub_task.done_at = datetime.datetime.now()
+    cur_task.slogan_voice_url = voice_clone_url
+
+    fee = Fee.total_fee(fee_items)
+    sub_task.add_fee(fee)
+
+    await aigc_task_save(cur_task)
+
+
+async def clone_twitter_audio_svc(req: CloneXAudioReq):
+    await enqueue_job(JOB_CLONE_TWITTER_AUDIO, {"req": req.model_dump(mode="json")})
+
+
+@job_handler(JOB_CLONE_TWITTER_AUDIO)
+async def _job_clone_twitter_audio(payload: dict):
+    req = CloneXAudioReq(**payload["req"])
+    if not req.username or not req.text:
+        return
+    digital_human: DigitalHuman = await digital_human_get_by_digital_human(req.username)
+    if not digital_human:
+        return
+
+    voice_id = "Abbess"
+    voice_clone_url = digital_human.slogan_voice_url
+    tts_task = TwitterTTSTask(
+        task_id=str(uuid.uuid4()),
+        tenant_id=digital_human.from_tenant_id,
+        read_content=req.text,
+        voice_id=voice_id,
+        audio_url_input=voice_clone_url,
+        task_type=TaskType.VOICE_CLONE,
+    )
+    # a failed clone is retried by the worker, nothing has been saved yet
+    result = await voice_clone_svc(tts_task, "")
+    if result and voice_clone_url:
+        digital_human.audios.append(result)
+        await digital_human_save(digital_human)
+
+        cur_task = await aigc_task_get_by_id(digital_human.from_task_id)
+        if cur_task:
+            cur_task.audio.output.append(result)
+            cur_task.audio.mark_dirty("output")
+            await aigc_task_save(cur_task)
 
 
-async def save_basic_info(req: BasicInfoReq, background: BackgroundTasks) -> AIGCTask:
+async def save_basic_info(req: BasicInfoReq) -> AIGCTask:
     task = await aigc_task_get_by_id(req.task_id)
 
     task.gender = req.gender
@@ -290,7 +365,11 @@ async def save_basic_info(req: BasicInfoReq, background: BackgroundTasks) -> AIG
     return task
 
 
-async def gen_cover_img_svc(req: GenCoverImgReq, background: BackgroundTasks) -> AIGCTask:
+async def gen_cover_img_svc(req: GenCoverImgReq) -> AIGCTask:
+    return await _start_gen_once(req.task_id, "cover", "", lambda fence: _gen_cover_img(req, fence))
+
+
+async def _gen_cover_img(req: GenCoverImgReq, fence: int) -> AIGCTask:
     style = style_map.get(req.style_id, "")
     if not style:
         raise_error(f"unknown style_id: {req.style_id}")
@@ -328,121 +407,141 @@ async def gen_cover_img_svc(req: GenCoverImgReq, background: BackgroundTasks) ->
         )
 
     await aigc_task_save(task)
+    await enqueue_job(JOB_GEN_COVER_IMG, {
+        "task_id": task.task_id,
+        "sub_task": "cover",
+        "req": req.model_dump(mode="json"),
+        "avatar_url_400x400": twitter_bo.avatar_url_400x400,
+        "fence": fence,
+    })
 
-    async def _task_gen_cover_img_svc():
-        logging.info(f"M begin _task_gen_cover_img_svc")
-
-        if not task.slogan:
-            slogan_retry = 10
-            text = ""
-            while slogan_retry > 0:
-                try:
-                    logging.info(f"gen slogan {username}")
-                    text = await gen_text(SLOGAN_PROMPT.format(account=username))
-                    pattern = re.compile(r'\{.*?\}', re.DOTALL)
-                    match = pattern.search(text)
-                    if match:
-                        json_str = match.group(0)
-                        data = json.loads(json_str)
-                        logging.info(f"gen slogan result {text}")
-                        if "slogan" in data and "description" in data:
-                            curc_task = await aigc_task_get_by_id(task.task_id)
-                            curc_task.slogan = data["slogan"]
-                            curc_task.slogan_description = data["description"]
-                            await aigc_task_save(curc_task)
-                        break
-                except Exception as e:
-                    slogan_retry -= 1
-                    logging.error(f"M slogan gen text {text} error: {e} ", exc_info=True)
-
-        base_img = req.img_url
-        if not base_img:
-            base_img = twitter_bo.avatar_url_400x400
-        # first_frame_imgs_task = gen_gpt_4o_img_svc(img_urls=[base_img],
-        #                                            prompt=FIRST_FRAME_IMG_PROMPT.format(style=style),
-        #                                            scenario="first_frame")
-        # dance_imgs_task = gen_gpt_4o_img_svc(img_urls=[SETTINGS.GEN_T_URL_DANCE, base_img],
-        #                                      prompt=V_DANCE_IMAGE_PROMPT,
-        #                                      scenario="dance")
-        # sing_imgs_task = gen_gpt_4o_img_svc(img_urls=[SETTINGS.GEN_T_URL_SING, base_img],
-        #                                     prompt=V_SING_IMAGE_PROMPT,
-        #                                     scenario="sing")
-
-        first_frame_imgs_task = gen_img_svc_v3(img_urls=[base_img],
-                                               prompt=FIRST_FRAME_IMG_PROMPT.format(style=style))
-        dance_imgs_task = gen_img_svc_v3(img_urls=[SETTINGS.GEN_T_URL_DANCE, base_img],
-                                         prompt=V_DANCE_IMAGE_PROMPT)
-        sing_imgs_task = gen_img_svc_v3(img_urls=[SETTINGS.GEN_T_URL_SING, base_img])
-        # figure_imgs_task = gemini_gen_img_svc(img_url=base_img,
-        #                                       prompt=V_FIGURE_IMAGE_PROMPT,
-        #                                       scenario="figure")
-
-        first_frame_imgs, dance_imgs, sing_imgs = await asyncio.gather(
-            first_frame_imgs_task,
-            dance_imgs_task,
-            sing_imgs_task,
-        )
+    return task
 
-        cur_task = await aigc_task_get_by_id(task.task_id)
-
-        first_frame_url = first_frame_imgs
-        # if first_frame_imgs and first_frame_imgs.data:
-        #     first_frame_url = await s3_upload_openai_img(first_frame_imgs.data[0])
-        # if not first_frame_url:
-        #     logging.info(f"M first_frame_url upload error")
-
-        dance_url = dance_imgs
-        # if dance_imgs and dance_imgs.data:
-        #     dance_url = await s3_upload_openai_img(dance_imgs.data[0])
-        # if not dance_url:
-        #     logging.info(f"M dance_url upload error")
-
-        sing_url = sing_imgs
-        # if sing_imgs and sing_imgs.data:
-        #     sing_url = await s3_upload_openai_img(sing_imgs.data[0])
-        # if not sing_url:
-        #     logging.info(f"M sing_url upload error")
-
-        # figure_url = ""
-        # if figure_imgs and figure_imgs.data:
-        #     # figure_url = await s3_upload_openai_img(figure_imgs.data[0])
-        #     figure_url = figure_imgs.data[0].url
-        # if not figure_url:
-        #     logging.info(f"M figure_url upload error")
-
-        if first_frame_url and dance_url and sing_url:
-            cur_task.cover.output = GenCoverResp(
-                first_frame_img_url=first_frame_url,
-                cover_img_url=first_frame_url,
-                dance_first_frame_img_url=dance_url,
-                sing_first_frame_img_url=sing_url,
-                figure_first_frame_img_url="xxx",
-            )
 
-            fee = Fee.total_fee([
-                Fee.img_fee(),
-                Fee.img_fee(),
-                Fee.img_fee(),
-                Fee.img_fee(),
-                Fee.llm_fee(),
-            ])
+@job_handler(JOB_GEN_COVER_IMG, on_failure=_fail_sub_task, on_heartbeat=_extend_gen_lock)
+async def _job_gen_cover_img(payload: dict):
+    req = GenCoverImgReq(**payload["req"])
+    task = await aigc_task_get_by_id(payload["task_id"])
+    style = style_map.get(req.style_id, "")
+    username = req.x_link.replace("https://x.com/", "")
 
-            cur_task.cover.status = TaskStatus.DONE
-            cur_task.cover.done_at = datetime.datetime.now()
-            cur_task.cover.fee.append(fee)
-            logging.info(f"M cur_cover_img_svc: {cur_task.cover.output.model_dump_json()}")
-            await aigc_task_save(cur_task)
-            return
+    logging.info(f"M begin _job_gen_cover_img")
+    if not await _fence_ok(payload):
+        return
+
+    if not task.slogan:
+        slogan_retry = 10
+        text = ""
+        while slogan_retry > 0:
+            try:
+                logging.info(f"gen slogan {username}")
+                text = await gen_text(SLOGAN_PROMPT.format(account=username))
+                pattern = re.compile(r'\{.*?\}', re.DOTALL)
+                match = pattern.search(text)
+                if match:
+                    json_str = match.group(0)
+                    data = json.loads(json_str)
+                    logging.info(f"gen slogan result {text}")
+                    if "slogan" in data and "description" in data and await _fence_ok(payload):
+                        curc_task = await aigc_task_get_by_id(task.task_id)
+                        curc_task.slogan = data["slogan"]
+                        curc_task.slogan_description = data["description"]
+                        await aigc_task_save(curc_task)
+                    break
+            except Exception as e:
+                slogan_retry -= 1
+                logging.error(f"M slogan gen text {text} error: {e} ", exc_info=True)
+
+    base_img = req.img_url
+    if not base_img:
+        base_img = payload["avatar_url_400x400"]
+    # first_frame_imgs_task = gen_gpt_4o_img_svc(img_urls=[base_img],
+    #                                            prompt=FIRST_FRAME_IMG_PROMPT.format(style=style),
+    #                                            scenario="first_frame")
+    # dance_imgs_task = gen_gpt_4o_img_svc(img_urls=[SETTINGS.GEN_T_URL_DANCE, base_img],
+    #                                      prompt=V_DANCE_IMAGE_PROMPT,
+    #                                      scenario="dance")
+    # sing_imgs_task = gen_gpt_4o_img_svc(img_urls=[SETTINGS.GEN_T_URL_SING, base_img],
+    #                                     prompt=V_SING_IMAGE_PROMPT,
+    #                                     scenario="sing")
+
+    first_frame_imgs_task = gen_img_svc_v3(img_urls=[base_img],
+                                           prompt=FIRST_FRAME_IMG_PROMPT.format(style=style))
+    dance_imgs_task = gen_img_svc_v3(img_urls=[SETTINGS.GEN_T_URL_DANCE, base_img],
+                                     prompt=V_DANCE_IMAGE_PROMPT)
+    sing_imgs_task = gen_img_svc_v3(img_urls=[SETTINGS.GEN_T_URL_SING, base_img])
+    # figure_imgs_task = gemini_gen_img_svc(img_url=base_img,
+    #                                       prompt=V_FIGURE_IMAGE_PROMPT,
+    #                                       scenario="figure")
+
+    first_frame_imgs, dance_imgs, sing_imgs = await asyncio.gather(
+        first_frame_imgs_task,
+        dance_imgs_task,
+        sing_imgs_task,
+    )
 
-        cur_task.cover.status = TaskStatus.FAILED
-        await aigc_task_save(cur_task)
+    if not await _fence_ok(payload):
+        return
+    cur_task = await aigc_task_get_by_id(task.task_id)
+
+    first_frame_url = first_frame_imgs
+    # if first_frame_imgs and first_frame_imgs.data:
+    #     first_frame_url = await s3_upload_openai_img(first_frame_imgs.data[0])
+    # if not first_frame_url:
+    #     logging.info(f"M first_frame_url upload error")
+
+    dance_url = dance_imgs
+    # if dance_imgs and dance_imgs.data:
+    #     dance_url = await s3_upload_openai_img(dance_imgs.data[0])
+    # if not dance_url:
+    #     logging.info(f"M dance_url upload error")
+
+    sing_url = sing_imgs
+    # if sing_imgs and sing_imgs.data:
+    #     sing_url = await s3_upload_openai_img(sing_imgs.data[0])
+    # if not sing_url:
+    #     logging.info(f"M sing_url upload error")
+
+    # figure_url = ""
+    # if figure_imgs and figure_imgs.data:
+    #     # figure_url = await s3_upload_openai_img(figure_imgs.data[0])
+    #     figure_url = figure_imgs.data[0].url
+    # if not figure_url:
+    #     logging.info(f"M figure_url upload error")
+
+    if not (first_frame_url and dance_url and sing_url):
+        # retried by the worker, the on_failure hook marks the cover failed and releases the lock after the last attempt
+        raise_error("cover image generation returned no image")
+
+    cur_task.cover.output = GenCoverResp(
+        first_frame_img_url=first_frame_url,
+        cover_img_url=first_frame_url,
+        dance_first_frame_img_url=dance_url,
+        sing_first_frame_img_url=sing_url,
+        figure_first_frame_img_url="xxx",
+    )
 
-    background.add_task(_task_gen_cover_img_svc)
+    fee = Fee.total_fee([
+        Fee.img_fee(),
+        Fee.img_fee(),
+        Fee.img_fee(),
+        Fee.img_fee(),
+        Fee.llm_fee(),
+    ])
 
-    return task
+    cur_task.cover.status = TaskStatus.DONE
+    cur_task.cover.done_at = datetime.datetime.now()
+    cur_task.cover.add_fee(fee)
+    logging.info(f"M cur_cover_img_svc: {cur_task.cover.output.model_dump_json()}")
+    await aigc_task_save(cur_task)
+    await _release_gen_lock(payload)
 
 
-async def gen_video_svc(req: GenVideoReq, background: BackgroundTasks) -> AIGCTask:
+async def gen_video_svc(req: GenVideoReq) -> AIGCTask:
+    return await _start_gen_once(req.task_id, "videos", req.key, lambda fence: _gen_video(req, fence))
+
+
+async def _gen_video(req: GenVideoReq, fence: int) -> AIGCTask:
     org_task = await aigc_task_get_by_id(req.task_id)
     if not org_task.cover or not org_task.cover.output:
         raise_error("cover img not found")
@@ -468,73 +567,83 @@ async def gen_video_svc(req: GenVideoReq, background: BackgroundTasks) -> AIGCTa
         )
 
     await aigc_task_save(org_task)
+    await enqueue_job(JOB_GEN_VIDEO, {
+        "task_id": org_task.task_id,
+        "sub_task": "videos",
+        "key": req.key,
+        "req": req.model_dump(mode="json"),
+        "fence": fence,
+    })
+    return org_task
 
-    async def _task_video_svc(task: AIGCTask, req: GenVideoReq):
-        logging.info(f"M _task_video_svc req: {req.model_dump_json()}")
-
-        if VideoKeyType.DANCE == req.key:
-            prompt = V_DANCE_VIDEO_PROMPT
-        # elif VideoKeyType.GOGO == req.key:
-        #     prompt = V_GOGO_PROMPT
-        elif VideoKeyType.TURN == req.key:
-            prompt = V_TURN_PROMPT
-        # elif VideoKeyType.ANGRY == req.key:
-        #     prompt = V_ANGRY_PROMPT
-        # elif VideoKeyType.SAYING == req.key:
-        #     prompt = V_SAYING_PROMPT
-        elif VideoKeyType.SPEECH == req.key:
-            prompt = V_SPEECH_PROMPT
-        elif VideoKeyType.THINK == req.key:
-            prompt = V_THINK_PROMPT
-        elif VideoKeyType.SING == req.key:
-            prompt = V_SING_VIDEO_PROMPT
-        elif VideoKeyType.FIGURE == req.key:
-            prompt = V_FIGURE_IMAGE_PROMPT
-        else:
-            prompt = V_DEFAULT_PROMPT
-
-        if VideoKeyType.DANCE == req.key:
-            first_frame_img_url = task.cover.output.dance_first_frame_img_url
-        elif VideoKeyType.SING == req.key:
-            first_frame_img_url = task.cover.output.sing_first_frame_img_url
-        elif VideoKeyType.FIGURE == req.key:
-            first_frame_img_url = task.cover.output.figure_first_frame_img_url
-        else:
-            first_frame_img_url = task.cover.output.first_frame_img_url
-
-        if VideoKeyType.DANCE == req.key:
-            data = await veo3_gen_video_svc_v2(first_frame_img_url, prompt)
-        elif VideoKeyType.SING == req.key:
-            data = await veo3_gen_video_svc_v2(first_frame_img_url, prompt)
-        elif VideoKeyType.FIGURE == req.key:
-            data = await veo3_gen_video_svc_v2(first_frame_img_url, prompt)
-        else:
-            data = await veo3_gen_video_svc_v2(first_frame_img_url, prompt)
-
-        cur_task = await aigc_task_get_by_id(task.task_id)
-        if data:
-            for v in cur_task.videos:
-                if v.input.key == req.key:
-                    v.output = data
-                    v.status = TaskStatus.DONE
-                    v.done_at = datetime.datetime.now()
-                    fee = Fee.total_fee([
-                        Fee.video_fee(),
-                    ])
-                    v.fee.append(fee)
-                    break
 
-            await aigc_task_save(cur_task)
-        else:
-            for v in cur_task.videos:
-                if v.input.key == req.key:
-                    v.status = TaskStatus.FAILED
-                    v.done_at = datetime.datetime.now()
-                    break
-            await aigc_task_save(cur_task)
+@job_handler(JOB_GEN_VIDEO, on_failure=_fail_sub_task, on_heartbeat=_extend_gen_lock)
+async def _job_gen_video(payload: dict):
+    req = GenVideoReq(**payload["req"])
+    task = await aigc_task_get_by_id(payload["task_id"])
+    logging.info(f"M _job_gen_video req: {req.model_dump_json()}")
+    if not await _fence_ok(payload):
+        return
+
+    if VideoKeyType.DANCE == req.key:
+        prompt = V_DANCE_VIDEO_PROMPT
+    # elif VideoKeyType.GOGO == req.key:
+    #     prompt = V_GOGO_PROMPT
+    elif VideoKeyType.TURN == req.key:
+        prompt = V_TURN_PROMPT
+    # elif VideoKeyType.ANGRY == req.key:
+    #     prompt = V_ANGRY_PROMPT
+    # elif VideoKeyType.SAYING == req.key:
+    #     prompt = V_SAYING_PROMPT
+    elif VideoKeyType.SPEECH == req.key:
+        prompt = V_SPEECH_PROMPT
+    elif VideoKeyType.THINK == req.key:
+        prompt = V_THINK_PROMPT
+    elif VideoKeyType.SING == req.key:
+        prompt = V_SING_VIDEO_PROMPT
+    elif VideoKeyType.FIGURE == req.key:
+        prompt = V_FIGURE_IMAGE_PROMPT
+    else:
+        prompt = V_DEFAULT_PROMPT
+
+    if VideoKeyType.DANCE == req.key:
+        first_frame_img_url = task.cover.output.dance_first_frame_img_url
+    elif VideoKeyType.SING == req.key:
+        first_frame_img_url = task.cover.output.sing_first_frame_img_url
+    elif VideoKeyType.FIGURE == req.key:
+        first_frame_img_url = task.cover.output.figure_first_frame_img_url
+    else:
+        first_frame_img_url = task.cover.output.first_frame_img_url
+
+    if VideoKeyType.DANCE == req.key:
+        data = await veo3_gen_video_svc_v2(first_frame_img_url, prompt)
+    elif VideoKeyType.SING == req.key:
+        data = await veo3_gen_video_svc_v2(first_frame_img_url, prompt)
+    elif VideoKeyType.FIGURE == req.key:
+        data = await veo3_gen_video_svc_v2(first_frame_img_url, prompt)
+    else:
+        data = await veo3_gen_video_svc_v2(first_frame_img_url, prompt)
 
-    background.add_task(_task_video_svc, org_task, req)
-    return org_task
+    if not await _fence_ok(payload):
+        return
+    if not data:
+        # retried by the worker, the on_failure hook marks the video failed and releases the lock after the last attempt
+        raise_error(f"video generation returned no video for {req.key}")
+
+    cur_task = await aigc_task_get_by_id(task.task_id)
+    for v in cur_task.videos:
+        if v.input.key == req.key:
+            v.output = data
+            v.status = TaskStatus.DONE
+            v.done_at = datetime.datetime.now()
+            fee = Fee.total_fee([
+                Fee.video_fee(),
+            ])
+            v.add_fee(fee)
+            break
+
+    await aigc_task_save(cur_task)
+    await _release_gen_lock(payload)
 
 
 async def aigc_task_publish_by_id(req: AIGCPublishReq, user_dict: dict, background: BackgroundTasks) -> DigitalHuman:
@@ -595,8 +704,8 @@ async def aigc_task_publish_by_id(req: AIGCPublishReq, user_dict: dict, backgrou
     basic = TaskAndHuman(**task.model_dump())
 
     audios = task.audio.output
-    if task.audio.history:
-        for h in task.audio.history:
+    if task.audio.history_count:
+        for h in await aigc_task_history_get(task.task_id, "audio"):
             audios.extend(Audio(**h).output)
 
     bo = DigitalHuman(
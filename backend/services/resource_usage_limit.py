@@ -1,25 +1,47 @@
 from common.error import raise_error
-from infra.db import resource_limits_col, resource_usage_col
+from config import SETTINGS
+from infra.cache import LRUTTLCache
+from infra.db import resource_limits_col, resource_usage_consume
+from infra.rate_limiter import RateLimit, RateLimitAlgorithm, acquire
 
+# lifetime quotas allow one use fewer than their limit (see resource_usage_consume): 3 uses here
+DEFAULT_LIMIT = RateLimit(limit=4)
 
-async def check_limit_and_record(client: str, resource: str):
-    doc = await resource_limits_col.find_one({"resource": resource})
-    if not doc:
-        limit = 4
-    else:
-        limit = doc["limit"]
+# resource -> RateLimit, definitions change rarely so they are only re-read from Mongo after the ttl
+_limits = LRUTTLCache(maxsize=1024, ttl=SETTINGS.RATE_LIMIT_DEFINITION_TTL_SECONDS)
 
-    usage = await resource_usage_col.find_one_and_update(
-        {"client": client, "resource": resource},
-        {"$inc": {"count": 1}},
-        upsert=True,
-        return_document=True
-    )
 
-    if "limit" in usage:
-        limit = usage["limit"]
+async def get_limit(resource: str) -> RateLimit:
+    """
+    The limit of `resource` from `resource_limits`:
+    {"resource": ..., "limit": 4, "window_seconds": 0, "algorithm": "fixed" | "sliding"}
+    """
+    rule = _limits.get(resource)
+    if rule is None:
+        doc = await resource_limits_col.find_one({"resource": resource})
+        if not doc:
+            rule = DEFAULT_LIMIT
+        else:
+            rule = RateLimit(
+                limit=doc["limit"],
+                window_seconds=doc.get("window_seconds", 0),
+                algorithm=RateLimitAlgorithm(doc.get("algorithm", RateLimitAlgorithm.FIXED)),
+            )
+        _limits.set(resource, rule)
+    return rule
 
-    count = usage["count"] + 1 if usage else 1
 
-    if count > limit:
-        raise_error(f"{client} exceeded limit for {resource} ({limit})")
+async def check_limit_and_record(client: str, resource: str):
+    """
+    Consume one unit of `resource` for `client`, or raise once its limit is reached.
+
+    Windowed limits are counted in Redis (and fail open) and allow `limit` requests per window; lifetime quotas
+    (window_seconds 0) are durable counts in resource_usage, which a Redis flush or failover must not reset.
+    """
+    rule = await get_limit(resource)
+    if rule.window_seconds > 0:
+        allowed, _ = await acquire(client, resource, rule)
+    else:
+        allowed, _ = await resource_usage_consume(client, resource, rule.limit)
+    if not allowed:
+        raise_error(f"{client} exceeded limit for {resource} ({rule.limit})")
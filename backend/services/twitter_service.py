@@ -6,18 +6,19 @@ import re
 import secrets
 from urllib.parse import urlencode
 
-from aiohttp import ClientSession
-
 from clients.x_api_io_client import x_get_user_info_by_username, x_get_user_last_tweets_by_username
 from config import SETTINGS
 from entities.bo import TwitterBO, Country
+from infra.cache import cached
 from infra.db import x_oauth_col, get_profile_by_tenant_id, profile_save, add_points, xapi_user_col
+from infra.http import http_session
 
 AUTH_URL = "https://twitter.com/i/oauth2/authorize"
 TOKEN_URL = "https://api.twitter.com/2/oauth2/token"
 USERINFO_URL = "https://api.twitter.com/2/users/me"
 
 
+@cached(ttl=SETTINGS.X_USER_CACHE_TTL_SECONDS)
 async def twitter_fetch_user_svc(username: str) -> TwitterBO | None:
     ret = await xapi_user_col.find_one({"username": username})
     if ret:
@@ -102,34 +103,34 @@ async def twitter_callback_svc(code: str, state: str):
     basic_token = base64.b64encode(
         f"{SETTINGS.X_APP_CLIENT_ID}:{SETTINGS.X_APP_CLIENT_SECRET}".encode()
     ).decode()
-    async with ClientSession() as session:
-        async with session.post(
-                TOKEN_URL,
-                data={
-                    "client_id": SETTINGS.X_APP_CLIENT_ID,
-                    "grant_type": "authorization_code",
-                    "code": code,
-                    "redirect_uri": SETTINGS.X_APP_REDIRECT_URI,
-                    "code_verifier": oauth2_params["code_verifier"],
-                },
-                headers={
-                    "Content-Type": "application/x-www-form-urlencoded",
-                    "Authorization": f"Basic {basic_token}"
-                },
-        ) as resp:
-            token_data = await resp.json()
-            logging.info(f"M Token response: {token_data}")
+    session = http_session()
+    async with session.post(
+            TOKEN_URL,
+            data={
+                "client_id": SETTINGS.X_APP_CLIENT_ID,
+                "grant_type": "authorization_code",
+                "code": code,
+                "redirect_uri": SETTINGS.X_APP_REDIRECT_URI,
+                "code_verifier": oauth2_params["code_verifier"],
+            },
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Authorization": f"Basic {basic_token}"
+            },
+    ) as resp:
+        token_data = await resp.json()
+        logging.info(f"M Token response: {token_data}")
 
     access_token = token_data.get("access_token")
     if not access_token:
         logging.error(f"M No access token found: {token_data}")
 
-    async with ClientSession() as session:
-        async with session.get(
-                USERINFO_URL,
-                headers={"Authorization": f"Bearer {access_token}"}
-        ) as user_resp:
-            user_data = await user_resp.json()
+    session = http_session()
+    async with session.get(
+            USERINFO_URL,
+            headers={"Authorization": f"Bearer {access_token}"}
+    ) as user_resp:
+        user_data = await user_resp.json()
 
     x_username = user_data.get("data", {}).get("username")
     x_user_id = user_data.get("data", {}).get("id")
@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import os
+import signal
+
+from agents import set_default_openai_key
+
+from common.log import setup_logger
+from common.tracing import Otel
+from config import SETTINGS
+from infra.db import connect_db, close_db
+from infra.http import HTTP
+from infra.job_queue import JobWorker
+from infra.redis_cache import ASYNC_REDIS
+from infra.storage import STORAGE
+from infra.task_events import TASK_EVENTS
+# importing the services registers their job handlers
+from services import aigc_service  # noqa: F401
+
+Otel.init()
+setup_logger()
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    connect_db()
+    await STORAGE.open()
+    worker = JobWorker()
+    await worker.start()
+    await stop_event.wait()
+    logger.info("Stopping job worker")
+    await worker.stop()
+    close_db()
+    await STORAGE.close()
+    await HTTP.close()
+    await TASK_EVENTS.close()
+    await ASYNC_REDIS.close()
+
+
+if __name__ == '__main__':
+    set_default_openai_key(SETTINGS.OPENAI_API_KEY)
+    os.environ["OPENAI_API_KEY"] = SETTINGS.OPENAI_API_KEY
+    os.environ["FAL_KEY"] = SETTINGS.FA_KEY
+
+    asyncio.run(main())